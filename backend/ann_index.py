@@ -0,0 +1,111 @@
+"""
+Approximate nearest-neighbour search for TKR Chatbot
+Inverted-file (IVF) index over normalized embeddings, trained offline with spherical k-means
+"""
+import os
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per block when assigning vectors to centroids
+ASSIGN_BLOCK_SIZE = 8192
+
+
+def index_path(index_dir, subject_id):
+    """Path of the trained IVF centroids for a subject"""
+    return os.path.join(index_dir, f"ivf_subject_{subject_id}.npy")
+
+
+def default_nlist(num_vectors):
+    """Pick a list count of roughly 4 * sqrt(N), the usual IVF rule of thumb"""
+    return max(1, int(4 * np.sqrt(num_vectors)))
+
+
+class IVFIndex:
+    """Coarse quantizer: a set of unit-length centroids shared by one subject"""
+
+    def __init__(self, centroids):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, vectors, nlist, iterations=20, points_per_list=256, seed=0):
+        """Fit centroids with spherical k-means on a sample of vectors"""
+        start_time = time.time()
+        rng = np.random.default_rng(seed)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = min(nlist, len(vectors))
+
+        sample_size = min(len(vectors), nlist * points_per_list)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        index = cls(centroids)
+        for _ in range(iterations):
+            assignments = index.assign(sample)
+            sums = np.zeros_like(index.centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+
+            # Re-seed empty lists with random sample points
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            index.centroids = sums / norms
+
+        logger.info(
+            f"Trained IVF index: {nlist} lists from {sample_size} samples "
+            f"in {time.time() - start_time:.2f}s"
+        )
+        return index
+
+    def assign(self, vectors):
+        """Return the nearest centroid of every vector"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_BLOCK_SIZE):
+            block = vectors[start:start + ASSIGN_BLOCK_SIZE]
+            assignments[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def probe(self, query_vec, nprobe):
+        """Return the ids of the nprobe lists closest to the query"""
+        scores = self.centroids @ query_vec
+        nprobe = min(nprobe, len(scores))
+        if nprobe < len(scores):
+            return np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.arange(len(scores))
+
+    def save(self, path):
+        """Persist the centroids as a .npy file"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, self.centroids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load centroids written by save()"""
+        return cls(np.load(path))
+
+
+class InvertedLists:
+    """Rows of one subject matrix grouped by their assigned centroid"""
+
+    def __init__(self, assignments, nlist):
+        self.order = np.argsort(assignments, kind='stable')
+        self.offsets = np.searchsorted(assignments[self.order], np.arange(nlist + 1))
+
+    def rows(self, list_ids):
+        """Return the matrix rows stored in the given lists"""
+        return np.concatenate([
+            self.order[self.offsets[i]:self.offsets[i + 1]] for i in list_ids
+        ])
@@ -0,0 +1,136 @@
+"""
+Thread-safe LRU cache for TKR Chatbot answers
+Sharded O(1) LRU with TTL, bounded by entry count and estimated bytes
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """Rough deep size in bytes of JSON-like data (dicts, lists, strings, numbers)"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Shard:
+    """One independently locked LRU segment"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.lock = threading.Lock()
+        self.items = OrderedDict()  # key -> (value, expires_at, size)
+        self.bytes = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+
+class LRUCache:
+    """Sharded LRU cache with per-entry TTL
+
+    Keys are spread over independently locked shards so concurrent request
+    threads rarely contend. Each shard is an OrderedDict, giving O(1) get,
+    put and least-recently-used eviction. Limits are split evenly across
+    shards.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=300, shards=16):
+        self.ttl = ttl
+        self._shards = [
+            _Shard(max(1, max_entries // shards), max(1, max_bytes // shards))
+            for _ in range(shards)
+        ]
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        shard = self._shard(key)
+        with shard.lock:
+            item = shard.items.get(key)
+            if item is not None:
+                value, expires_at, size = item
+                if expires_at > time.time():
+                    shard.items.move_to_end(key)
+                    hit = True
+                else:
+                    del shard.items[key]
+                    shard.bytes -= size
+                    hit = None
+            else:
+                hit = False
+
+        if hit:
+            self._count('hits')
+            return value
+        if hit is None:
+            self._count('expirations')
+        self._count('misses')
+        return None
+
+    def put(self, key, value, ttl=None):
+        """Insert or replace a value, evicting least-recently-used entries as needed"""
+        size = estimate_size(value)
+        shard = self._shard(key)
+        evicted = 0
+        with shard.lock:
+            if size > shard.max_bytes:
+                return False
+            old = shard.items.pop(key, None)
+            if old is not None:
+                shard.bytes -= old[2]
+            shard.items[key] = (value, time.time() + (ttl or self.ttl), size)
+            shard.bytes += size
+            while len(shard.items) > shard.max_entries or shard.bytes > shard.max_bytes:
+                _, (_, _, old_size) = shard.items.popitem(last=False)
+                shard.bytes -= old_size
+                evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+        return True
+
+    def delete_where(self, predicate):
+        """Remove every entry whose key matches predicate; returns the count"""
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                for key in [k for k in shard.items if predicate(k)]:
+                    shard.bytes -= shard.items.pop(key)[2]
+                    removed += 1
+        return removed
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.items.clear()
+                shard.bytes = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters plus current size"""
+        entries = 0
+        size = 0
+        for shard in self._shards:
+            with shard.lock:
+                entries += len(shard.items)
+                size += shard.bytes
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'entries': entries,
+            'bytes': size,
+            'hit_rate': stats['hits'] / lookups if lookups else 0.0
+        })
+        return stats
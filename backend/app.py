@@ -1,17 +1,25 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
+import json
 import uuid
+import multiprocessing
 import logging
 from werkzeug.utils import secure_filename
 
 from config import Config
 from database import get_db, init_db
-from models import Subject, Material, Syllabus, ImportantQuestion, ChatHistory, ExtractedImage
+from models import Subject, Material, Syllabus, ImportantQuestion, ChatHistory, ExtractedImage, IngestJob
 from pdf_processor import PDFProcessor
-from gemini_rag import get_gemini_rag_engine  # Using Gemini AI-powered RAG engine
+from gemini_rag import start_engine_loader  # Using Gemini AI-powered RAG engine
+from ingest_queue import create_worker_pool
 from auth import AuthService  # Admin authentication
 from email_service import email_service  # Email verification
+from metrics import get_metrics
+from content_hash import save_and_hash
+from shared_cache import SharedAnswerCache
+from image_cache import ImageCache, image_key, render_extracted_image
+from file_serving import send_static
 
 # Configure logging
 logging.basicConfig(
@@ -34,10 +42,21 @@ email_service.init_app(app)
 # Initialize processors
 pdf_processor = PDFProcessor()
 
-# Initialize Gemini RAG engine at startup (not lazy loaded)
-logger.info("Initializing Gemini RAG engine...")
-gemini_rag_engine = get_gemini_rag_engine()
-logger.info("Gemini RAG engine ready")
+# PDF images are rendered on first request and kept on disk
+image_cache = ImageCache(Config.IMAGE_CACHE_DIR, Config.IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+# Spawned PDF worker processes re-import this module when it is run as a script;
+# only the server process itself loads the engine and starts background threads
+if multiprocessing.parent_process() is None:
+    # Load the Gemini RAG engine in the background so the port binds immediately;
+    # /api/ready reports when it is warm
+    logger.info("Loading Gemini RAG engine in the background...")
+    engine_loader = start_engine_loader()
+    
+    # Uploaded PDFs are processed by background workers; each job waits for the engine
+    ingest_pool = create_worker_pool(engine_loader.wait, pdf_processor)
+    if Config.INGEST_WORKERS > 0:
+        ingest_pool.start()
 
 
 def allowed_file(filename):
@@ -77,12 +96,56 @@ def require_admin(f):
     return decorated_function
 
 
+def require_engine(f):
+    """Decorator that waits briefly for the RAG engine, answering 503 while it is still loading"""
+    from functools import wraps
+    
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'OPTIONS' and engine_loader.wait(Config.ENGINE_WAIT_SECONDS) is None:
+            return jsonify({
+                'success': False,
+                'error': 'The assistant is still starting up, please retry shortly'
+            }), 503, {'Retry-After': '5'}
+        return f(*args, **kwargs)
+    
+    return decorated_function
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'message': 'TKR Chatbot API is running'})
 
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint: 200 once every engine component is loaded and warm"""
+    readiness = engine_loader.readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
+
+@app.route('/api/metrics', methods=['GET'])
+@require_engine
+def get_metrics_snapshot():
+    """Performance metrics and vector index statistics"""
+    try:
+        return jsonify({
+            'success': True,
+            'metrics': get_metrics().snapshot(),
+            'vector_index': engine_loader.engine.vector_index.stats(),
+            'answer_cache': engine_loader.engine.answer_cache.stats(),
+            'semantic_cache': engine_loader.engine.semantic_cache.stats(),
+            'shared_cache': engine_loader.engine.shared_cache.stats() if engine_loader.engine.shared_cache else None,
+            'single_flight': engine_loader.engine.inflight.stats(),
+            'image_cache': image_cache.stats(),
+            'ingest': ingest_pool.stats()
+        })
+    except Exception as e:
+        logger.error(f"Error fetching metrics: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/subjects', methods=['GET'])
 def get_subjects():
     """Get all subjects or filter by semester"""
@@ -140,7 +203,7 @@ def get_materials():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_material():
-    """Upload and process PDF material"""
+    """Upload PDF material and queue it for background processing"""
     try:
         # Check if file is present
         if 'file' not in request.files:
@@ -161,13 +224,11 @@ def upload_material():
         if not subject_id:
             return jsonify({'success': False, 'error': 'Subject ID required'}), 400
         
-        # Save file
+        # Save file, hashing it on the way to disk
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
         file_path = os.path.join(Config.UPLOAD_FOLDER, unique_filename)
-        file.save(file_path)
-        
-        file_size = os.path.getsize(file_path)
+        content_hash, file_size = save_and_hash(file.stream, file_path)
         
         # Create material record
         material_id = Material.create(
@@ -176,62 +237,100 @@ def upload_material():
             description,
             file_path,
             'pdf',
-            file_size
+            file_size,
+            content_hash
         )
         
-        # Process PDF in background
-        try:
-            logger.info(f"Processing PDF for material {material_id}")
-            result = pdf_processor.process_pdf(file_path, material_id)
-            
-            # Generate and store AI embeddings with Gemini RAG (engine already initialized)
-            gemini_rag_engine.store_embeddings(material_id, result['chunks'])
-            
-            # Store extracted images
-            for img in result['images']:
-                ExtractedImage.create(
-                    material_id,
-                    img['path'],
-                    img['page'],
-                    img['type'],
-                    None
-                )
-            
-            # Mark as processed
-            Material.mark_processed(material_id)
-            
-            logger.info(f"Successfully processed material {material_id}")
-            
-            return jsonify({
-                'success': True,
-                'material_id': material_id,
-                'chunks_created': len(result['chunks']),
-                'images_extracted': len(result['images'])
-            })
-            
-        except Exception as process_error:
-            logger.error(f"Error processing PDF: {process_error}")
+        # Text extraction, embeddings and images are done by the ingestion workers
+        job_id = IngestJob.create(material_id)
+        ingest_pool.notify()
+        logger.info(f"Queued ingest job {job_id} for material {material_id}")
+        
+        response = {
+            'success': True,
+            'material_id': material_id,
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/materials/{material_id}/status'
+        }
+        
+        # Identical file already processed: the worker copies its results instead of parsing
+        if Config.UPLOAD_DEDUP_ENABLED:
+            duplicate = Material.find_processed_duplicate(content_hash, material_id)
+            if duplicate:
+                counts = Material.get_content_counts(duplicate['id'])
+                response['duplicate_of'] = duplicate['id']
+                response['skipped'] = {
+                    'parsing': True,
+                    'chunks': counts['chunks'],
+                    'images': counts['images']
+                }
+                logger.info(f"Material {material_id} duplicates material {duplicate['id']}")
+        
+        return jsonify(response), 202
+        
+    except Exception as e:
+        logger.error(f"Error uploading material: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/materials/<int:material_id>/status', methods=['GET'])
+def get_material_status(material_id):
+    """Ingestion status of a material: stage, progress and error of its latest job"""
+    try:
+        material = Material.get_by_id(material_id)
+        if not material:
+            return jsonify({'success': False, 'error': 'Material not found'}), 404
+        
+        job = IngestJob.get_latest_by_material(material_id)
+        if job is None:
+            # Uploaded before background ingestion existed
+            status = 'done' if material['is_processed'] else 'failed'
             return jsonify({
                 'success': True,
                 'material_id': material_id,
-                'warning': 'File uploaded but processing failed',
-                'error': str(process_error)
+                'status': status,
+                'stage': status,
+                'progress': 1.0 if material['is_processed'] else 0.0,
+                'attempts': 0,
+                'error': None if material['is_processed'] else 'Material was never processed',
+                'retryable': not material['is_processed']
             })
         
+        return jsonify({
+            'success': True,
+            'material_id': material_id,
+            'job_id': job['id'],
+            'status': job['status'],
+            'stage': job['stage'],
+            'progress': job['progress'],
+            'attempts': job['attempts'],
+            'error': job['error'],
+            'retryable': job['status'] == 'failed',
+            'reused_from': job['reused_from'],
+            'chunks_total': job['chunks_total'],
+            'chunks_reused': job['chunks_reused'],
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at'],
+            'finished_at': job['finished_at']
+        })
     except Exception as e:
-        logger.error(f"Error uploading material: {e}")
+        logger.error(f"Error fetching material status: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 @app.route('/api/materials/<int:material_id>/download', methods=['GET'])
 def download_material(material_id):
-    """Download material file"""
+    """Download material file (supports Range requests and ETag revalidation)"""
     try:
         material = Material.get_by_id(material_id)
         if not material:
             return jsonify({'success': False, 'error': 'Material not found'}), 404
+        if not material['file_path'] or not os.path.exists(material['file_path']):
+            return jsonify({'success': False, 'error': 'File missing'}), 404
         
-        return send_file(material['file_path'], as_attachment=True)
+        # The content hash identifies the bytes exactly, so it makes a strong ETag
+        return send_static(material['file_path'], as_attachment=True, etag=material.get('content_hash') or True)
     except Exception as e:
         logger.error(f"Error downloading material: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -242,12 +341,44 @@ def get_material_images(material_id):
     """Get extracted images from material"""
     try:
         images = ExtractedImage.get_by_material(material_id)
+        for image in images:
+            # Images are rendered when first fetched from these URLs
+            image['url'] = f"/api/images/{image['id']}"
+            image['thumbnail_url'] = f"/api/images/{image['id']}?thumb=1"
         return jsonify({'success': True, 'images': images})
     except Exception as e:
         logger.error(f"Error fetching images: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/images/<int:image_id>', methods=['GET'])
+def get_image(image_id):
+    """Serve an extracted image (?thumb=1 for a thumbnail), rendering it on first request"""
+    try:
+        image = ExtractedImage.get_by_id(image_id)
+        if not image:
+            return jsonify({'success': False, 'error': 'Image not found'}), 404
+        thumbnail = request.args.get('thumb', type=int) == 1
+        
+        if image['source'] == 'file' and not thumbnail:
+            if not os.path.exists(image['image_path']):
+                return jsonify({'success': False, 'error': 'Image file missing'}), 404
+            return send_static(image['image_path'], mimetype='image/png', max_age=Config.IMAGE_CACHE_MAX_AGE)
+        
+        material = Material.get_by_id(image['material_id'])
+        if not material or not material['file_path'] or not os.path.exists(material['file_path']):
+            return jsonify({'success': False, 'error': 'Source PDF missing'}), 404
+        key = image_key(image, thumbnail)
+        path = image_cache.get(key, lambda: render_extracted_image(
+            image, material['file_path'], pdf_processor, Config.IMAGE_THUMBNAIL_PX, thumbnail
+        ))
+        # Cache hits touch the file's mtime, so the ETag comes from the key rather than mtime and size
+        return send_static(path, mimetype='image/png', etag=key, max_age=Config.IMAGE_CACHE_MAX_AGE)
+    except Exception as e:
+        logger.error(f"Error serving image {image_id}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/syllabus', methods=['GET'])
 def get_syllabus():
     """Get syllabus by subject"""
@@ -321,6 +452,7 @@ def create_important_question():
 
 
 @app.route('/api/chat', methods=['POST'])
+@require_engine
 def chat():
     """Handle chat messages and answer questions"""
     try:
@@ -332,8 +464,8 @@ def chat():
         if not message:
             return jsonify({'success': False, 'error': 'Message required'}), 400
         
-        # Get answer using Gemini AI-powered RAG (engine already initialized at startup)
-        result = gemini_rag_engine.answer_question(message, subject_id)
+        # Get answer using Gemini AI-powered RAG (engine loaded by require_engine)
+        result = engine_loader.engine.answer_question(message, subject_id)
         
         # Save to chat history
         context_info = {
@@ -361,6 +493,43 @@ def chat():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/chat/stream', methods=['POST'])
+@require_engine
+def chat_stream():
+    """Stream a chat answer as server-sent events: sources first, then answer tokens"""
+    data = request.json or {}
+    message = data.get('message', '').strip()
+    subject_id = data.get('subject_id')
+    session_id = data.get('session_id', str(uuid.uuid4()))
+    
+    if not message:
+        return jsonify({'success': False, 'error': 'Message required'}), 400
+    
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    
+    def events():
+        for event, payload in engine_loader.engine.stream_answer(message, subject_id):
+            if event == 'done':
+                # Save to chat history once the whole answer is known
+                context_info = {
+                    'sources': payload.get('sources', []),
+                    'confidence': payload.get('confidence', 0)
+                }
+                try:
+                    ChatHistory.create(session_id, message, payload['answer'], str(context_info))
+                except Exception as e:
+                    logger.error(f"Error saving streamed chat: {e}")
+                payload = dict(context_info, answer=payload['answer'], session_id=session_id)
+            yield sse(event, payload)
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/chat/history', methods=['GET'])
 def get_chat_history():
     """Get chat history for a session"""
@@ -581,6 +750,20 @@ def check_auth():
 # ==================== ADMIN-ONLY RESOURCE MANAGEMENT ====================
 
 
+def forget_deleted_content(subject_id, remove):
+    """Drop deleted rows' vectors from the engine, now or once it is loaded
+    
+    Deletes never wait for the engine: the loader replays the removal on an
+    engine that is still loading (it may have read the rows already) before
+    it serves any request. Cached answers are invalidated either way.
+    """
+    try:
+        if not engine_loader.apply(remove) and Config.SHARED_CACHE_ENABLED:
+            SharedAnswerCache(Config.SHARED_CACHE_PATH, ttl=Config.SHARED_CACHE_TTL).bump(subject_id)
+    except Exception as e:
+        logger.warning(f"Could not drop deleted content of subject {subject_id} from the engine: {e}")
+
+
 @app.route('/api/admin/materials/<int:material_id>', methods=['DELETE'])
 @require_admin
 def delete_material(material_id):
@@ -590,7 +773,7 @@ def delete_material(material_id):
         
         # Get material file path
         material = db.execute_query(
-            "SELECT file_path FROM materials WHERE id = %s",
+            "SELECT file_path, subject_id FROM materials WHERE id = %s",
             (material_id,)
         )
         
@@ -618,6 +801,13 @@ def delete_material(material_id):
             logger.error(f"Database error deleting material {material_id}: {db_error}")
             return jsonify({'success': False, 'error': f'Database error: {str(db_error)}'}), 500
         
+        # Drop its vectors from the in-memory search index and its rendered images
+        forget_deleted_content(
+            material[0]['subject_id'],
+            lambda engine: engine.remove_material(material_id, material[0]['subject_id'])
+        )
+        image_cache.remove_prefix(f"m{material_id}_")
+        
         logger.info(f"Material {material_id} deleted by admin {request.admin_email}")
         return jsonify({'success': True, 'message': 'Material deleted successfully'}), 200
         
@@ -703,6 +893,12 @@ def delete_subject(subject_id):
         if not subject or len(subject) == 0:
             return jsonify({'success': False, 'error': 'Subject not found'}), 404
         
+        # Its materials' rendered images are cached by material id, so list them before the cascade
+        materials = db.execute_query(
+            "SELECT id FROM materials WHERE subject_id = %s",
+            (subject_id,)
+        ) or []
+        
         # Delete from database (cascades to related materials, syllabus, questions)
         try:
             db.execute_query(
@@ -714,6 +910,11 @@ def delete_subject(subject_id):
             logger.error(f"Database error deleting subject {subject_id}: {db_error}")
             return jsonify({'success': False, 'error': f'Database error: {str(db_error)}'}), 500
         
+        # Drop its vectors from the in-memory search index and its rendered images
+        forget_deleted_content(subject_id, lambda engine: engine.remove_subject(subject_id))
+        for material in materials:
+            image_cache.remove_prefix(f"m{material['id']}_")
+        
         logger.info(f"Subject {subject_id} deleted by admin {request.admin_email}")
         return jsonify({'success': True, 'message': 'Subject deleted successfully'}), 200
         
@@ -724,6 +925,42 @@ def delete_subject(subject_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/admin/materials/<int:material_id>/retry', methods=['POST', 'OPTIONS'])
+@require_admin
+def retry_material_ingest(material_id):
+    """Re-queue a material whose processing failed (admin only)"""
+    if request.method == 'OPTIONS':
+        return '', 204
+    try:
+        material = Material.get_by_id(material_id)
+        if not material:
+            return jsonify({'success': False, 'error': 'Material not found'}), 404
+        
+        job = IngestJob.get_latest_by_material(material_id)
+        if job is None:
+            if material['is_processed']:
+                return jsonify({'success': False, 'error': 'Material is already processed'}), 409
+            job_id = IngestJob.create(material_id)
+        elif job['status'] == 'failed':
+            IngestJob.retry(job['id'])
+            job_id = job['id']
+        else:
+            return jsonify({'success': False, 'error': f"Ingest job is {job['status']}, only failed jobs can be retried"}), 409
+        
+        ingest_pool.notify()
+        logger.info(f"Ingest of material {material_id} re-queued by admin {request.admin_email}")
+        return jsonify({
+            'success': True,
+            'material_id': material_id,
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/materials/{material_id}/status'
+        }), 202
+    except Exception as e:
+        logger.error(f"Error retrying material ingest: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ==================== DATABASE INITIALIZATION ====================
 
 @app.route('/api/init-db', methods=['POST'])
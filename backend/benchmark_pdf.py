@@ -0,0 +1,274 @@
+"""
+PDF ingestion benchmark for TKR Chatbot
+Generates a synthetic textbook-like PDF and reports pages/sec of PDFProcessor.process_pdf
+
+Compare against an older pdf_processor.py with --baseline, e.g.
+    git show HEAD~1:backend/pdf_processor.py > /tmp/pdf_processor_old.py
+--memory reports peak RSS of parsing and store_embeddings (against a stand-in database) at a quarter, half
+and all of --pages (Unix only).
+--eager-images adds a run that renders every image at parse time, to compare against LAZY_IMAGES.
+Usage: python benchmark_pdf.py [--pages 500] [--images-every 1] [--workers 1 4] [--baseline /tmp/pdf_processor_old.py]
+                               [--eager-images] [--memory]
+"""
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+from config import Config
+from pdf_processor import PDFProcessor
+
+# all-MiniLM-L6-v2's embedding size
+BENCH_DIM = 384
+
+WORDS = (
+    "data structure algorithm stack queue tree graph node edge pointer memory array list "
+    "normal form relation schema key index transaction lock query join table attribute "
+    "voltage current resistor diode transistor circuit signal frequency amplifier gain"
+).split()
+
+
+def _text_stream(rng, lines=40, words_per_line=12):
+    """Page content: a heading and paragraphs of filler text in Helvetica"""
+    parts = ["BT /F1 11 Tf 14 TL 72 740 Td"]
+    for line in range(lines):
+        if line and line % 8 == 0:
+            parts.append("T*")  # blank line between paragraphs
+        text = ' '.join(rng.choice(WORDS) for _ in range(words_per_line))
+        parts.append(f"({text}) '")
+    parts.append("ET")
+    return '\n'.join(parts).encode('latin-1')
+
+
+def _image_stream(rng, width=96, height=64):
+    """A small RGB figure, Flate-compressed like most PDF producers write them"""
+    row = bytes(rng.randrange(256) for _ in range(width * 3))
+    return zlib.compress(row * height), width, height
+
+
+def synthetic_pdf(path, pages=500, images_every=1, seed=0):
+    """Write a pages-long PDF with filler text and a figure every images_every pages"""
+    rng = random.Random(seed)
+    objects = {}  # object number -> bytes
+    # 1: catalog, 2: page tree, 3: font; pages start at 4
+    page_numbers = []
+    next_number = 4
+    for page_index in range(pages):
+        page_number, content_number = next_number, next_number + 1
+        next_number += 2
+        content = _text_stream(rng)
+        resources = "/Font << /F1 3 0 R >>"
+        if images_every and page_index % images_every == 0:
+            image_number = next_number
+            next_number += 1
+            data, width, height = _image_stream(rng)
+            objects[image_number] = (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>\n"
+                "stream\n"
+            ).encode('latin-1') + data + b"\nendstream"
+            resources += f" /XObject << /Im1 {image_number} 0 R >>"
+            content += b"\nq 192 0 0 128 72 120 cm /Im1 Do Q"
+        objects[content_number] = f"<< /Length {len(content)} >>\nstream\n".encode('latin-1') + content + b"\nendstream"
+        objects[page_number] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << {resources} >> /Contents {content_number} 0 R >>"
+        ).encode('latin-1')
+        page_numbers.append(page_number)
+
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = ' '.join(f"{number} 0 R" for number in page_numbers)
+    objects[2] = f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode('latin-1')
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+    offsets = {}
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        for number in sorted(objects):
+            offsets[number] = f.tell()
+            f.write(f"{number} 0 obj\n".encode('latin-1') + objects[number] + b"\nendobj\n")
+        xref_offset = f.tell()
+        f.write(f"xref\n0 {next_number}\n0000000000 65535 f \n".encode('latin-1'))
+        for number in range(1, next_number):
+            f.write(f"{offsets[number]:010d} 00000 n \n".encode('latin-1'))
+        f.write(f"trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('latin-1'))
+    return path
+
+
+def load_processor(module_path=None, workers=None):
+    """PDFProcessor from this tree, or from another copy of pdf_processor.py"""
+    if module_path is None:
+        return PDFProcessor(workers=workers)
+    spec = importlib.util.spec_from_file_location('pdf_processor_baseline', module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.PDFProcessor()
+
+
+def run(processor, pdf_path, pages):
+    """Return (pages/sec, result) of one process_pdf call"""
+    start_time = time.perf_counter()
+    result = processor.process_pdf(pdf_path, material_id=0)
+    elapsed = time.perf_counter() - start_time
+    return pages / elapsed, elapsed, result
+
+
+class _BenchDB:
+    """Database stand-in for --memory runs: keeps no rows, as a separate MySQL server would not in this process
+
+    Chunk ids are chunk_index + 1, which is what sequential inserts of one material produce.
+    """
+
+    def __init__(self):
+        self.rows = 0
+
+    def execute_many(self, query, rows):
+        self.rows += len(rows)
+        return len(rows)
+
+    def execute_query(self, query, params=None, fetch=True):
+        if 'FROM materials' in query:
+            return [{'subject_id': 1, 'title': 'benchmark'}]
+        if 'SELECT id FROM document_embeddings' in query:
+            return [{'id': index + 1} for index in range(self.rows)]
+        return []
+
+
+def _bench_engine(store_dir):
+    """RAG engine that runs the real store_embeddings path against _BenchDB and a memory-mapped store
+
+    Embeddings are random: the model's memory does not depend on document size, so it is left out.
+    """
+    import gemini_rag
+    from vector_index import VectorIndex
+    from vector_store import MmapVectorStore
+    bench_db = _BenchDB()
+    gemini_rag.get_db = lambda: bench_db
+    rng = np.random.default_rng(0)
+    engine = gemini_rag.GeminiRAGEngine.__new__(gemini_rag.GeminiRAGEngine)
+    engine.embedding_version = 1
+    engine.vector_index = VectorIndex(BENCH_DIM, store=MmapVectorStore(store_dir, BENCH_DIM))
+    engine.generate_embeddings = lambda texts: rng.standard_normal((len(texts), BENCH_DIM), dtype=np.float32)
+    return engine
+
+
+def _measure_pipeline(mode, pdf_path, images_folder, module_path=None):
+    """Run in a fresh interpreter: ingest one PDF and print peak RSS (MB) of this process and its workers
+
+    Both modes store the chunks through store_embeddings; 'streaming' feeds
+    it iter_chunks, 'materialized' builds the whole process_pdf result first.
+    """
+    import resource
+    Config.IMAGES_FOLDER = images_folder
+    store_dir = tempfile.mkdtemp(prefix='pdf_bench_store_')
+    processor = load_processor(module_path)
+    engine = _bench_engine(store_dir)
+    if mode == 'materialized':
+        chunks = processor.process_pdf(pdf_path, material_id=0)['chunks']
+    else:
+        chunks = processor.iter_chunks(pdf_path, 0)
+    count = engine.store_embeddings(0, chunks)['chunks']
+    if hasattr(processor, 'close'):
+        processor.close()
+    shutil.rmtree(store_dir, ignore_errors=True)
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    main_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    worker_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    print(f"{main_mb:.1f} {worker_mb:.1f} {count}")
+
+
+def peak_rss(mode, pdf_path, images_folder, module_path=None):
+    """Return (main MB, largest worker MB, chunks) for one pipeline run in a fresh interpreter"""
+    command = [sys.executable, os.path.abspath(__file__), '--measure', mode, pdf_path, images_folder]
+    if module_path:
+        command.append(os.path.abspath(module_path))
+    proc = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}")
+    main_mb, worker_mb, count = proc.stdout.split()[-3:]
+    return float(main_mb), float(worker_mb), int(count)
+
+
+def memory_benchmark(pages, images_every, work_dir, baseline=None):
+    """Peak RSS against document size: streaming should stay flat, materializing grows"""
+    images_folder = os.path.join(work_dir, 'images')
+    runs = [('streaming', None)]
+    if baseline:
+        runs.insert(0, ('baseline', baseline))
+    print(f"{'pipeline':<11} {'pages':>6} {'chunks':>7} {'peak RSS':>9} {'worker RSS':>11}")
+    for count in sorted({max(pages // 4, 1), max(pages // 2, 1), pages}):
+        pdf_path = synthetic_pdf(os.path.join(work_dir, f'synthetic_{count}.pdf'), count, images_every)
+        for name, module_path in runs:
+            mode = 'materialized' if name == 'baseline' else 'streaming'
+            main_mb, worker_mb, chunks = peak_rss(mode, pdf_path, images_folder, module_path)
+            print(f"{name:<11} {count:>6} {chunks:>7} {main_mb:>7.0f}MB {worker_mb:>9.0f}MB")
+        os.remove(pdf_path)
+
+
+def benchmark(pages, images_every, baseline=None, workers=None, keep=False, memory=False, eager_images=False):
+    work_dir = tempfile.mkdtemp(prefix='pdf_bench_')
+    images_folder = Config.IMAGES_FOLDER
+    Config.IMAGES_FOLDER = os.path.join(work_dir, 'images')
+    os.makedirs(Config.IMAGES_FOLDER)
+    try:
+        if memory:
+            memory_benchmark(pages, images_every, work_dir, baseline)
+            return
+        pdf_path = synthetic_pdf(os.path.join(work_dir, 'synthetic.pdf'), pages, images_every)
+        size_mb = os.path.getsize(pdf_path) / 1024 ** 2
+        print(f"Synthetic PDF: {pages} pages, {size_mb:.1f} MB, a figure every {images_every or '-'} page(s)")
+
+        candidates = [('current', None, worker_count, None) for worker_count in workers or [None]]
+        if eager_images:
+            candidates.insert(0, ('eager', None, None, False))
+        if baseline:
+            candidates.insert(0, ('baseline', baseline, None, None))
+        rates = []
+        for name, module_path, worker_count, lazy_images in candidates:
+            processor = load_processor(module_path, worker_count)
+            if lazy_images is not None:
+                processor.lazy_images = lazy_images
+            label = f"{name} x{processor.workers}" if hasattr(processor, 'workers') else name
+            rate, elapsed, result = run(processor, pdf_path, pages)
+            if hasattr(processor, 'close'):
+                processor.close()
+            rates.append(rate)
+            print(f"{label:<12} {rate:>7.1f} pages/s ({elapsed:.1f}s): "
+                  f"{len(result['page_texts'])} text pages, {len(result['chunks'])} chunks, "
+                  f"{len(result['images'])} images")
+        if len(rates) > 1:
+            print(f"✓ Speed-up: {rates[-1] / rates[0]:.2f}x")
+    finally:
+        Config.IMAGES_FOLDER = images_folder
+        if keep:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDF parsing throughput")
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--images-every', type=int, default=1, help="add a figure every N pages (0 = none)")
+    parser.add_argument('--baseline', default=None, help="path to another pdf_processor.py to compare against")
+    parser.add_argument('--workers', type=int, nargs='*', default=None,
+                        help="PDF worker counts to compare (default: PDF_WORKERS)")
+    parser.add_argument('--eager-images', action='store_true',
+                        help="also time rendering every image at parse time (LAZY_IMAGES=False)")
+    parser.add_argument('--memory', action='store_true', help="report peak RSS against page count instead of speed")
+    parser.add_argument('--keep', action='store_true', help="keep the generated PDF and images")
+    parser.add_argument('--measure', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        _measure_pipeline(*args.measure)
+    else:
+        benchmark(args.pages, args.images_every, args.baseline, args.workers, args.keep, args.memory,
+                  args.eager_images)
@@ -0,0 +1,97 @@
+"""
+Quantized index report for TKR Chatbot
+Compares int8 / binary first-pass scoring with float32 re-scoring against exact search
+
+Usage: python benchmark_quantization.py [--subject ID] [--synthetic N] [--rescore 100 200 400]
+"""
+import argparse
+import time
+import numpy as np
+from config import Config
+from vector_index import SubjectVectors, normalize_rows, top_k_positions
+from quantization import QUANTIZERS
+
+
+def load_subjects(subject_id=None):
+    """Read every subject's vectors from the database as in-memory snapshots"""
+    from database import get_db
+    from vector_index import VectorIndex
+    from build_ann_index import active_version, detect_dimension
+
+    db = get_db()
+    version = active_version()
+    dim = detect_dimension(db, version)
+    if dim is None:
+        return {}
+    index = VectorIndex(dim, embedding_version=version)
+    index.load(db)
+    return {
+        sid: index.subject(sid)
+        for sid in sorted(index.stats()['subjects'])
+        if subject_id is None or sid == subject_id
+    }
+
+
+def synthetic_subject(count, dim=384, clusters=200, seed=0):
+    """Clustered unit vectors, roughly shaped like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return SubjectVectors(
+        normalize_rows(vectors),
+        np.arange(count, dtype=np.int64),
+        np.zeros(count, dtype=np.int64),
+        [None] * count
+    )
+
+
+def sample_queries(vectors, num_queries, seed=1):
+    """Perturbed corpus vectors, so queries are close to but not copies of stored chunks"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+    dim = vectors.shape[1]
+    noise = rng.standard_normal((len(rows), dim)).astype(np.float32) * (0.5 / np.sqrt(dim))
+    return normalize_rows(np.asarray(vectors[rows]) + noise)
+
+
+def report(name, snapshot, k, rescore_counts, num_queries):
+    queries = sample_queries(snapshot.vectors, num_queries)
+
+    start_time = time.perf_counter()
+    exact = [top_k_positions(snapshot.vectors @ query, k) for query in queries]
+    exact_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+    float_mb = snapshot.vectors.nbytes / 1024 ** 2
+    print(f"\n{name}: {len(snapshot)} chunks, float32 {float_mb:.1f} MB, exact {exact_ms:.2f} ms/query")
+
+    for mode, quantizer_class in QUANTIZERS.items():
+        quantizer = quantizer_class.fit(snapshot.vectors)
+        quantized = snapshot.quantized(quantizer)
+        code_mb = quantized.codes.nbytes / 1024 ** 2
+        print(f"  {mode:<6} codes {code_mb:.1f} MB ({float_mb / code_mb:.0f}x smaller, "
+              f"{float_mb - code_mb:.1f} MB saved)")
+        for rescore in rescore_counts:
+            start_time = time.perf_counter()
+            approx = [quantized.top_k(query, k, rescore=rescore)[0] for query in queries]
+            approx_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+            hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+            print(f"    rescore {rescore:>4}: recall@{k} = {hits / (len(queries) * k):.3f}, "
+                  f"{approx_ms:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report memory and recall of quantized vector search")
+    parser.add_argument('--subject', type=int, default=None, help="only report this subject")
+    parser.add_argument('--synthetic', type=int, default=None, help="use N synthetic vectors instead of the database")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--rescore', type=int, nargs='+', default=[50, Config.QUANTIZED_RESCORE_CANDIDATES, 500])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        subjects = {'synthetic': synthetic_subject(args.synthetic)}
+    else:
+        subjects = {f"Subject {sid}": snapshot for sid, snapshot in load_subjects(args.subject).items()}
+    if not subjects:
+        print("No embeddings stored yet, nothing to report")
+    for name, snapshot in subjects.items():
+        report(name, snapshot, args.k, args.rescore, args.queries)
@@ -0,0 +1,154 @@
+"""
+Keyword (BM25) index for TKR Chatbot
+In-memory inverted index over chunk text, fused with vector search results
+"""
+import math
+import re
+import heapq
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have how in is it its of on or that the
+this to was were what when where which who why will with explain define
+describe give me please tell about
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word/number tokens without stopwords"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class SubjectPostings:
+    """BM25 statistics and postings lists for one subject"""
+
+    def __init__(self):
+        self.postings = {}   # term -> {chunk_id: term frequency}
+        self.doc_len = {}    # chunk_id -> token count
+        self.docs = {}       # chunk_id -> result metadata
+        self.total_len = 0
+
+    def add(self, chunk_id, metadata):
+        tokens = tokenize(metadata['chunk_text'])
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        self.doc_len[chunk_id] = len(tokens)
+        self.docs[chunk_id] = metadata
+        self.total_len += len(tokens)
+
+    def remove(self, chunk_id):
+        metadata = self.docs.pop(chunk_id, None)
+        if metadata is None:
+            return
+        for term in set(tokenize(metadata['chunk_text'])):
+            plist = self.postings.get(term)
+            if plist is not None:
+                plist.pop(chunk_id, None)
+                if not plist:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(chunk_id, 0)
+
+    def score(self, terms, k1, b):
+        """Return {chunk_id: BM25 score} for the query terms"""
+        n_docs = len(self.doc_len)
+        if not n_docs:
+            return {}
+        avg_len = self.total_len / n_docs or 1.0
+        scores = {}
+        for term in terms:
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for chunk_id, tf in plist.items():
+                norm = tf + k1 * (1 - b + b * self.doc_len[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (k1 + 1) / norm
+        return scores
+
+
+class BM25Index:
+    """Per-subject BM25 index kept in step with the vector index
+
+    sync_subject() is registered as a VectorIndex listener. It diffs the
+    subject's live chunk ids against what is already indexed, so only new
+    or deleted chunks are (re)tokenized.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._subjects = {}
+        self._lock = threading.Lock()
+
+    def sync_subject(self, subject_id, segments):
+        """Bring one subject in line with its vector index segments"""
+        live = {}
+        for seg in segments:
+            rows = range(len(seg.metadata)) if seg.live is None else np.flatnonzero(seg.live)
+            for row in rows:
+                metadata = seg.metadata[row]
+                if metadata is not None:
+                    live[int(seg.chunk_ids[row])] = metadata
+
+        with self._lock:
+            if not live:
+                self._subjects.pop(subject_id, None)
+                return
+            subject = self._subjects.setdefault(subject_id, SubjectPostings())
+            stale = subject.docs.keys() - live.keys()
+            added = live.keys() - subject.docs.keys()
+            for chunk_id in stale:
+                subject.remove(chunk_id)
+            for chunk_id in added:
+                subject.add(chunk_id, live[chunk_id])
+
+        if stale or added:
+            logger.info(f"BM25 subject {subject_id}: +{len(added)} / -{len(stale)} chunks")
+
+    def search(self, query, subject_id=None, top_k=5):
+        """Return the top_k chunks by BM25 score"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            if subject_id is not None:
+                subjects = [self._subjects[subject_id]] if subject_id in self._subjects else []
+            else:
+                subjects = list(self._subjects.values())
+            scored = []
+            for subject in subjects:
+                scores = subject.score(terms, self.k1, self.b)
+                for chunk_id, score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1]):
+                    scored.append((score, subject.docs[chunk_id]))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        results = []
+        for score, metadata in scored[:top_k]:
+            result = metadata.copy()
+            result['bm25_score'] = score
+            results.append(result)
+        return results
+
+
+def reciprocal_rank_fusion(result_lists, top_k, k=60):
+    """Merge ranked result lists by summing 1 / (k + rank) per chunk"""
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            entry = fused.get(result['chunk_id'])
+            if entry is None:
+                entry = fused[result['chunk_id']] = dict(result, fusion_score=0.0)
+            else:
+                entry.update({key: value for key, value in result.items() if key not in entry})
+            entry['fusion_score'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda r: r['fusion_score'], reverse=True)[:top_k]
@@ -0,0 +1,92 @@
+"""
+Offline builder for the approximate nearest-neighbour (IVF) index
+Trains per-subject centroids from document_embeddings and reports recall against exact search
+
+Restart the backend (with ANN_ENABLED=True) to pick up newly built indexes.
+"""
+import argparse
+import time
+import numpy as np
+from config import Config
+from database import get_db
+from embedding_codec import unpack_embedding
+from models import EmbeddingVersion
+from vector_index import VectorIndex, top_k_positions, version_index_dir
+from ann_index import IVFIndex, default_nlist, index_path
+from projection import load_projection
+
+
+def active_version():
+    """Id of the embedding version the backend serves (1 before any model migration)"""
+    active = EmbeddingVersion.get_active()
+    return active['id'] if active else 1
+
+
+def detect_dimension(db, embedding_version=1):
+    """Read the embedding dimension from a stored vector"""
+    rows = db.execute_query(
+        "SELECT embedding_vector FROM document_embeddings WHERE embedding_version = %s LIMIT 1",
+        (embedding_version,)
+    )
+    return len(unpack_embedding(rows[0]['embedding_vector'])) if rows else None
+
+
+def measure_recall(snapshot, nprobe, k=10, num_queries=100, seed=0):
+    """Return (recall@k, IVF ms/query, exact ms/query) against exact search"""
+    rng = np.random.default_rng(seed)
+    queries = snapshot.vectors[rng.choice(len(snapshot), min(num_queries, len(snapshot)), replace=False)]
+
+    start_time = time.time()
+    approx = [snapshot.top_k(query, k, nprobe)[0] for query in queries]
+    approx_ms = (time.time() - start_time) * 1000 / len(queries)
+
+    start_time = time.time()
+    exact = [top_k_positions(snapshot.vectors @ query, k) for query in queries]
+    exact_ms = (time.time() - start_time) * 1000 / len(queries)
+
+    hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+    return hits / (len(queries) * k), approx_ms, exact_ms
+
+
+def build_ann_index(min_vectors, nlist=None, nprobe=Config.ANN_NPROBE, subject_id=None):
+    """Train and save IVF centroids for every large subject"""
+    db = get_db()
+    version = active_version()
+    dim = detect_dimension(db, version)
+    if dim is None:
+        print("No embeddings stored yet, nothing to build")
+        return
+    index_dir = version_index_dir(Config.VECTOR_INDEX_DIR, version)
+
+    # Train in the same (possibly reduced) space the backend searches
+    projection = load_projection(Config.EMBEDDING_REDUCTION, index_dir, dim, Config.EMBEDDING_REDUCED_DIM)
+    index = VectorIndex(dim, projection=projection, embedding_version=version)
+    index.load(db)
+
+    for sid, count in sorted(index.stats()['subjects'].items()):
+        if subject_id is not None and sid != subject_id:
+            continue
+        if count < min_vectors:
+            print(f"Subject {sid}: {count} chunks, below {min_vectors}, exact search only")
+            continue
+
+        snapshot = index.subject(sid)
+        lists = nlist or default_nlist(count)
+        print(f"Subject {sid}: training {lists} lists over {count} chunks...")
+        ivf = IVFIndex.train(snapshot.vectors, lists)
+        ivf.save(index_path(index_dir, sid))
+
+        recall, approx_ms, exact_ms = measure_recall(snapshot.with_ivf(ivf), nprobe)
+        print(f"  ✓ saved; nprobe={nprobe}: recall@10 = {recall:.3f}, "
+              f"{approx_ms:.2f} ms/query (exact: {exact_ms:.2f} ms/query)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build IVF indexes for large subjects")
+    parser.add_argument('--min-vectors', type=int, default=Config.ANN_MIN_VECTORS)
+    parser.add_argument('--nlist', type=int, default=None, help="lists per subject (default 4*sqrt(N))")
+    parser.add_argument('--nprobe', type=int, default=Config.ANN_NPROBE, help="probe count used for the recall report")
+    parser.add_argument('--subject', type=int, default=None, help="only build this subject")
+    args = parser.parse_args()
+
+    build_ann_index(args.min_vectors, args.nlist, args.nprobe, args.subject)
@@ -0,0 +1,86 @@
+"""
+Offline fitting of the embedding projection (PCA) for TKR Chatbot
+Fits on stored chunk embeddings, saves it next to the vector index and reports recall / latency / memory
+
+Set EMBEDDING_REDUCTION=pca and EMBEDDING_REDUCED_DIM to the fitted dimension, then restart the backend.
+Usage: python build_projection.py --dim 128 [--compare 64 96 192] [--synthetic N] [--no-save]
+"""
+import argparse
+import time
+import numpy as np
+from config import Config
+from vector_index import normalize_rows, top_k_positions, version_index_dir
+from projection import Projection, projection_path
+from benchmark_quantization import synthetic_subject, sample_queries
+
+
+def load_corpus():
+    """Every stored chunk embedding as one unit-length matrix"""
+    from benchmark_quantization import load_subjects
+
+    snapshots = load_subjects().values()
+    if not snapshots:
+        return None
+    return np.vstack([snapshot.vectors for snapshot in snapshots])
+
+
+def evaluate(vectors, queries, exact, projection, k):
+    """Return (recall@k, ms/query, index MB) of searching in the projected space"""
+    reduced = normalize_rows(projection.apply(vectors)) if projection is not None else vectors
+    reduced_queries = normalize_rows(projection.apply(queries)) if projection is not None else queries
+
+    start_time = time.perf_counter()
+    found = [top_k_positions(reduced @ query, k) for query in reduced_queries]
+    ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+
+    hits = sum(len(np.intersect1d(f, e)) for f, e in zip(found, exact))
+    return hits / (len(queries) * k), ms, reduced.nbytes / 1024 ** 2
+
+
+def build_projection(dim, compare_dims, vectors, k=10, num_queries=200, save=True):
+    """Fit PCA at dim, save it, and print the trade-off against the full embeddings"""
+    queries = sample_queries(vectors, num_queries)
+    exact = [top_k_positions(vectors @ query, k) for query in queries]
+
+    recall, ms, mb = evaluate(vectors, queries, exact, None, k)
+    print(f"full   {vectors.shape[1]:>4}d: recall@{k} = {recall:.3f}, {ms:.2f} ms/query, {mb:.1f} MB")
+
+    fitted = None
+    for target in sorted(set(compare_dims) | {dim}):
+        if target >= vectors.shape[1]:
+            continue
+        start_time = time.time()
+        pca = Projection.fit_pca(vectors, target)
+        fit_s = time.time() - start_time
+        recall, ms, mb = evaluate(vectors, queries, exact, pca, k)
+        print(f"pca    {target:>4}d: recall@{k} = {recall:.3f}, {ms:.2f} ms/query, {mb:.1f} MB "
+              f"(explained variance {pca.explained_variance:.1%}, fit {fit_s:.1f}s)")
+        truncated = Projection.truncate(vectors.shape[1], target)
+        recall, ms, mb = evaluate(vectors, queries, exact, truncated, k)
+        print(f"trunc  {target:>4}d: recall@{k} = {recall:.3f}, {ms:.2f} ms/query, {mb:.1f} MB")
+        if target == dim:
+            fitted = pca
+
+    if save and fitted is not None:
+        from build_ann_index import active_version
+
+        path = projection_path(version_index_dir(Config.VECTOR_INDEX_DIR, active_version()))
+        fitted.save(path)
+        print(f"✓ Saved {dim}-d PCA projection ({fitted.fingerprint}) to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit a PCA projection for stored embeddings")
+    parser.add_argument('--dim', type=int, default=Config.EMBEDDING_REDUCED_DIM, help="dimension to fit and save")
+    parser.add_argument('--compare', type=int, nargs='*', default=[64, 96, 192], help="extra dimensions to report")
+    parser.add_argument('--synthetic', type=int, default=None, help="use N synthetic vectors instead of the database")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--no-save', action='store_true', help="only report, do not write the projection")
+    args = parser.parse_args()
+
+    vectors = synthetic_subject(args.synthetic).vectors if args.synthetic else load_corpus()
+    if vectors is None:
+        print("No embeddings stored yet, nothing to fit")
+    else:
+        build_projection(args.dim, args.compare, vectors, args.k, args.queries, save=not args.no_save)
@@ -0,0 +1,323 @@
+"""
+Offline bulk ingestion for TKR Chatbot
+Parses a directory (or a CSV manifest) of PDFs on a process pool, embeds their chunks and writes
+materials, pages, images and embeddings to the database in large batches
+
+Files already ingested for the same subject (by SHA-256) are skipped, and materials left half-written
+by a crash are redone, so an interrupted run can simply be started again. Identical files already
+processed for another subject are copied instead of parsed. Restart the backend afterwards to
+load the new materials into its vector index (with VECTOR_STORE_ENABLED the store adds every row it
+lacks on load).
+Usage: python bulk_ingest.py DIRECTORY --subject-id 3 [--workers 4] [--batch-size 5000]
+       python bulk_ingest.py --manifest files.csv   (columns: path,subject_id[,title,description])
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from config import Config
+from database import get_db
+from models import Subject, Material, IngestJob, EmbeddingVersion
+from content_hash import file_sha256, text_hash
+from embedding_codec import pack_embedding
+from pdf_processor import PDFProcessor, _limit_worker_memory
+from ingest_queue import clear_partial_ingest, copy_material_content
+
+EMBEDDING_QUERY = """
+    INSERT INTO document_embeddings
+    (material_id, chunk_text, chunk_index, page_number, embedding_vector, text_hash, embedding_version)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+PAGE_QUERY = """
+    INSERT INTO material_pages (material_id, page_number, page_text)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE page_text = VALUES(page_text)
+"""
+IMAGE_QUERY = """
+    INSERT INTO extracted_images
+    (material_id, image_path, page_number, image_type, caption, source, bbox, xref)
+    VALUES (%s, %s, %s, %s, NULL, %s, %s, %s)
+"""
+
+
+def _parse_file(pdf_path, material_id, images_folder):
+    """Process-pool task: parse one PDF into page texts, chunks and saved (or, with LAZY_IMAGES, located) images"""
+    processor = PDFProcessor(workers=1)
+    pages, chunks, images = [], [], []
+    page_count = 0
+    for page_num, page_count, text, page_images in processor.parse_page_range(
+            pdf_path, material_id, images_folder=images_folder):
+        if text:
+            pages.append((page_num, text))
+            chunks.extend(processor.chunk_page(page_num, text))
+        images.extend(page_images)
+    return {'pages': pages, 'chunks': chunks, 'images': images, 'page_count': page_count}
+
+
+def read_manifest(path):
+    """(file path, subject_id, title, description) rows of a CSV manifest; paths are relative to it"""
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            entries.append((
+                os.path.join(base, row['path']),
+                int(row['subject_id']),
+                row.get('title') or None,
+                row.get('description') or ''
+            ))
+    return entries
+
+
+def scan_directory(directory, subject_id):
+    """Every PDF below directory, in a stable order"""
+    entries = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.pdf'):
+                entries.append((os.path.join(root, name), subject_id, None, ''))
+    return entries
+
+
+class BatchWriter:
+    """Buffers rows of finished materials and writes them with executemany in large batches
+
+    A material is marked processed only after all of its rows were written,
+    so after a crash it is still unprocessed and gets redone.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.embeddings = []
+        self.pages = []
+        self.images = []
+        self.materials = []
+        self.flushes = 0
+
+    def add(self, material_id, embeddings, pages, images, job_id=None):
+        """Buffer a material's rows; job_id is a failed ingest job to close once they are written"""
+        self.embeddings.extend(embeddings)
+        self.pages.extend((material_id, page, text) for page, text in pages)
+        self.images.extend(
+            (material_id, img['path'], img['page'], img['type'], img['source'], img.get('bbox'), img.get('xref'))
+            for img in images
+        )
+        self.materials.append((material_id, job_id, len(embeddings)))
+        if len(self.embeddings) + len(self.pages) + len(self.images) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.materials:
+            return
+        db = get_db()
+        for query, rows in ((EMBEDDING_QUERY, self.embeddings), (PAGE_QUERY, self.pages), (IMAGE_QUERY, self.images)):
+            for start in range(0, len(rows), self.batch_size):
+                db.execute_many(query, rows[start:start + self.batch_size])
+        for material_id, job_id, chunk_count in self.materials:
+            Material.mark_processed(material_id)
+            if job_id is not None:
+                IngestJob.mark_done(job_id, chunks_total=chunk_count)
+        self.embeddings, self.pages, self.images, self.materials = [], [], [], []
+        self.flushes += 1
+
+
+class Embedder:
+    """Encodes chunks with the active embedding version's model, reusing stored vectors"""
+
+    def __init__(self):
+        from sentence_transformers import SentenceTransformer
+        from gemini_rag import cached_embeddings
+        self.version = EmbeddingVersion.ensure_active(Config.EMBEDDING_MODEL)
+        self.model = SentenceTransformer(self.version['model_name'])
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self._cached = cached_embeddings
+        self.seconds = 0.0
+        self.cached = 0
+
+    def rows(self, material_id, chunks):
+        """document_embeddings rows for a material's chunks"""
+        start_time = time.time()
+        hashes = [text_hash(chunk['text']) for chunk in chunks]
+        blobs = self._cached(hashes, self.version['id'], self.dim) if Config.EMBEDDING_CACHE_ENABLED and chunks else {}
+        new_texts = {}
+        for chunk, chunk_hash in zip(chunks, hashes):
+            if chunk_hash not in blobs:
+                new_texts.setdefault(chunk_hash, chunk['text'])
+        if new_texts:
+            vectors = self.model.encode(
+                list(new_texts.values()), batch_size=Config.EMBEDDING_BATCH_SIZE, convert_to_numpy=True
+            ).astype(np.float32, copy=False)
+            for chunk_hash, vector in zip(new_texts, vectors):
+                blobs[chunk_hash] = pack_embedding(vector, Config.EMBEDDING_STORAGE_DTYPE)
+        self.cached += len(chunks) - len(new_texts)
+        self.seconds += time.time() - start_time
+        return [
+            (material_id, chunk['text'], index, chunk.get('page', 0), blobs[chunk_hash], chunk_hash, self.version['id'])
+            for index, (chunk, chunk_hash) in enumerate(zip(chunks, hashes))
+        ]
+
+
+def prepare(entry, stats, seen):
+    """Return the material to parse for a manifest entry, or None when nothing needs parsing
+
+    seen holds the (content hash, subject) pairs of this run, so a file listed twice is parsed once.
+    """
+    path, subject_id, title, description = entry
+    content_hash = file_sha256(path)
+    if (content_hash, subject_id) in seen:
+        stats['skipped'] += 1
+        return None
+    seen.add((content_hash, subject_id))
+
+    existing = Material.find_by_hash(content_hash, subject_id)
+    if existing and existing['is_processed']:
+        stats['skipped'] += 1
+        return None
+    if existing:
+        job = IngestJob.get_latest_by_material(existing['id'])
+        if job and job['status'] in ('queued', 'running'):
+            # Uploaded through the API and still in the backend's queue
+            stats['skipped'] += 1
+            return None
+        # Left behind by an interrupted run, or failed earlier
+        clear_partial_ingest(existing)
+        existing['job_id'] = job['id'] if job else None
+        return existing
+
+    filename = os.path.basename(path)
+    file_path = os.path.join(Config.UPLOAD_FOLDER, f"{uuid.uuid4()}_{filename}")
+    shutil.copyfile(path, file_path)
+    material_id = Material.create(
+        subject_id, title or filename, description, file_path, 'pdf', os.path.getsize(file_path), content_hash
+    )
+
+    source = Material.find_processed_duplicate(content_hash, material_id) if Config.UPLOAD_DEDUP_ENABLED else None
+    if source is not None:
+        copy_material_content(source['id'], material_id)
+        Material.mark_processed(material_id)
+        stats['copied'] += 1
+        return None
+    material = Material.get_by_id(material_id)
+    material['job_id'] = None
+    return material
+
+
+def record_failure(material, error, stats):
+    """Leave a failed ingest job behind so the admin UI can retry the file (or the next run redoes it)"""
+    stats['failed'] += 1
+    print(f"  ❌ {material['title']}: {error}")
+    try:
+        job_id = material['job_id'] or IngestJob.create(material['id'])
+        IngestJob.mark_failed(job_id, str(error) or error.__class__.__name__)
+    except Exception as e:
+        print(f"  ⚠ could not record the failure: {e}")
+
+
+def bulk_ingest(entries, workers=None, batch_size=5000):
+    workers = workers or Config.PDF_WORKERS
+    for subject_id in sorted({entry[1] for entry in entries}):
+        if Subject.get_by_id(subject_id) is None:
+            raise ValueError(f"Subject {subject_id} does not exist")
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(Config.IMAGES_FOLDER, exist_ok=True)
+
+    embedder = Embedder()
+    writer = BatchWriter(batch_size)
+    stats = {'ingested': 0, 'skipped': 0, 'copied': 0, 'failed': 0, 'pages': 0, 'chunks': 0, 'images': 0}
+    print(f"Ingesting {len(entries)} files with {workers} parser processes "
+          f"({embedder.version['model_name']}, embedding version {embedder.version['id']})")
+
+    start_time = time.time()
+    remaining = deque(entries)
+    inflight = {}
+    seen = set()
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_limit_worker_memory,
+        initargs=(Config.PDF_WORKER_MAX_MEMORY_MB,)
+    )
+    try:
+        while remaining or inflight:
+            # Keep a bounded number of files parsed ahead of the embedder
+            while remaining and len(inflight) < workers * 2:
+                entry = remaining.popleft()
+                try:
+                    material = prepare(entry, stats, seen)
+                except Exception as e:
+                    stats['failed'] += 1
+                    print(f"  ❌ {entry[0]}: {e}")
+                    continue
+                if material is not None:
+                    future = executor.submit(_parse_file, material['file_path'], material['id'], Config.IMAGES_FOLDER)
+                    inflight[future] = material
+            if not inflight:
+                continue
+
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                material = inflight.pop(future)
+                try:
+                    parsed = future.result()
+                    rows = embedder.rows(material['id'], parsed['chunks'])
+                except Exception as e:
+                    record_failure(material, e, stats)
+                    continue
+                writer.add(material['id'], rows, parsed['pages'], parsed['images'], material['job_id'])
+                stats['ingested'] += 1
+                stats['pages'] += parsed['page_count']
+                stats['chunks'] += len(rows)
+                stats['images'] += len(parsed['images'])
+                elapsed = time.time() - start_time
+                print(f"  ✓ {material['title']}: {parsed['page_count']} pages, {len(rows)} chunks "
+                      f"({stats['pages'] / elapsed:.1f} pages/s overall)")
+        writer.flush()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.time() - start_time
+    touched = sorted({entry[1] for entry in entries})
+    if Config.SHARED_CACHE_ENABLED:
+        from shared_cache import SharedAnswerCache
+        try:
+            cache = SharedAnswerCache(Config.SHARED_CACHE_PATH, ttl=Config.SHARED_CACHE_TTL)
+            if not all([cache.bump(subject_id) for subject_id in touched]):
+                print("⚠ Could not invalidate every cached answer; stale ones expire after SHARED_CACHE_TTL")
+        except sqlite3.Error as e:
+            print(f"⚠ Shared answer cache unavailable ({e}); stale answers expire after SHARED_CACHE_TTL")
+
+    print(f"\n✅ {stats['ingested']} parsed, {stats['copied']} copied from identical files, "
+          f"{stats['skipped']} already ingested, {stats['failed']} failed")
+    print(f"   {stats['pages']} pages, {stats['chunks']} chunks ({embedder.cached} cached embeddings), "
+          f"{stats['images']} images in {elapsed:.1f}s, {writer.flushes} batch writes")
+    print(f"   {stats['pages'] / max(elapsed, 1e-6):.1f} pages/s, {stats['chunks'] / max(elapsed, 1e-6):.1f} chunks/s "
+          f"(embedding {embedder.seconds:.1f}s)")
+    if stats['ingested'] or stats['copied']:
+        print("   Restart the backend to load the new materials into its vector index")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest a directory or manifest of PDFs offline")
+    parser.add_argument('directory', nargs='?', help="directory searched recursively for PDFs")
+    parser.add_argument('--subject-id', type=int, help="subject of every PDF in the directory")
+    parser.add_argument('--manifest', help="CSV with path,subject_id[,title,description] columns")
+    parser.add_argument('--workers', type=int, default=None, help="parser processes (default: PDF_WORKERS)")
+    parser.add_argument('--batch-size', type=int, default=5000, help="rows buffered per batch write")
+    args = parser.parse_args()
+
+    if args.manifest:
+        files = read_manifest(args.manifest)
+    elif args.directory and args.subject_id:
+        files = scan_directory(args.directory, args.subject_id)
+    else:
+        parser.error("give a DIRECTORY with --subject-id, or --manifest")
+    bulk_ingest(files, args.workers, args.batch_size)
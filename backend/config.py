@@ -26,11 +26,100 @@ class Config:
     
     # Model configuration
     EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+    # Stored vector precision: 'float32' or 'float16' (half the size)
+    EMBEDDING_STORAGE_DTYPE = os.getenv('EMBEDDING_STORAGE_DTYPE', 'float32')
+    # Chunks per encode() call, and rows per INSERT batch during ingestion
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+    EMBEDDING_INSERT_BATCH_SIZE = int(os.getenv('EMBEDDING_INSERT_BATCH_SIZE', 500))
     CHUNK_SIZE = 500
     CHUNK_OVERLAP = 50
+    # Seconds between checks for a newly activated embedding version (0 = never hot-swap)
+    EMBEDDING_VERSION_POLL_SECONDS = float(os.getenv('EMBEDDING_VERSION_POLL_SECONDS', 30))
+    # reembed.py throttling: chunks/s cap (0 = unthrottled) and torch threads
+    REEMBED_MAX_CHUNKS_PER_SECOND = float(os.getenv('REEMBED_MAX_CHUNKS_PER_SECOND', 100))
+    REEMBED_THREADS = int(os.getenv('REEMBED_THREADS', 1))
+    
+    # Vector index configuration
+    VECTOR_INDEX_DIR = os.path.abspath(os.getenv('VECTOR_INDEX_DIR', '../vector_index'))
+    # Approximate search (IVF) for large subjects; smaller subjects stay exact
+    ANN_ENABLED = os.getenv('ANN_ENABLED', 'False') == 'True'
+    ANN_NPROBE = int(os.getenv('ANN_NPROBE', 16))
+    ANN_MIN_VECTORS = int(os.getenv('ANN_MIN_VECTORS', 20000))
+    # Hybrid retrieval: BM25 keyword scores fused with vector scores (RRF)
+    HYBRID_SEARCH_ENABLED = os.getenv('HYBRID_SEARCH_ENABLED', 'True') == 'True'
+    HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 50))
+    RRF_K = int(os.getenv('RRF_K', 60))
+    # Answer caching
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 300))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 1000))
+    ANSWER_CACHE_MAX_BYTES = int(os.getenv('ANSWER_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 64MB
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'True') == 'True'
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92))
+    SEMANTIC_CACHE_NEAR_MISS_MARGIN = float(os.getenv('SEMANTIC_CACHE_NEAR_MISS_MARGIN', 0.05))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 1000))
+    # Share of retrieved chunks a semantic hit must have in common with the cached answer
+    SEMANTIC_CACHE_MIN_OVERLAP = float(os.getenv('SEMANTIC_CACHE_MIN_OVERLAP', 0.6))
+    # Micro-batching of query embeddings across concurrent requests
+    QUERY_BATCHING_ENABLED = os.getenv('QUERY_BATCHING_ENABLED', 'True') == 'True'
+    QUERY_BATCH_MAX_SIZE = int(os.getenv('QUERY_BATCH_MAX_SIZE', 32))
+    QUERY_BATCH_MAX_WAIT_MS = float(os.getenv('QUERY_BATCH_MAX_WAIT_MS', 5))
+    # Seconds a request waits for the background-loaded RAG engine before answering 503
+    ENGINE_WAIT_SECONDS = float(os.getenv('ENGINE_WAIT_SECONDS', 5))
+    # Re-uploads of an already processed file copy its chunks and vectors instead of re-parsing
+    UPLOAD_DEDUP_ENABLED = os.getenv('UPLOAD_DEDUP_ENABLED', 'True') == 'True'
+    # Chunks whose normalized text was embedded before reuse the stored vector
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True') == 'True'
+    # Processes parsing page ranges of one PDF in parallel (1 = parse in the ingesting thread)
+    PDF_WORKERS = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1))
+    PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 32))
+    # Address-space cap per PDF worker process in MB (0 = unlimited; ignored on Windows)
+    PDF_WORKER_MAX_MEMORY_MB = int(os.getenv('PDF_WORKER_MAX_MEMORY_MB', 2048))
+    # Record image positions at ingestion and render them on first request (False = render every image up front)
+    LAZY_IMAGES = os.getenv('LAZY_IMAGES', 'True') == 'True'
+    # Rendered images and thumbnails, evicted least-recently-used beyond IMAGE_CACHE_MAX_MB
+    IMAGE_CACHE_DIR = os.path.abspath(os.getenv('IMAGE_CACHE_DIR', os.path.join(UPLOAD_FOLDER, 'image_cache')))
+    IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', 512))
+    IMAGE_RENDER_DPI = int(os.getenv('IMAGE_RENDER_DPI', 150))
+    IMAGE_THUMBNAIL_PX = int(os.getenv('IMAGE_THUMBNAIL_PX', 256))
+    # Seconds browsers may reuse a served image without asking again
+    IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', 86400))
+    # Let a fronting server stream downloads and images: '' (the app does), 'x-sendfile' or 'x-accel-redirect'
+    FILE_OFFLOAD = os.getenv('FILE_OFFLOAD', '').lower()
+    USE_X_SENDFILE = FILE_OFFLOAD == 'x-sendfile'
+    # For x-accel-redirect: files under X_ACCEL_ROOT map to this internal nginx location
+    X_ACCEL_ROOT = os.path.abspath(os.getenv('X_ACCEL_ROOT', UPLOAD_FOLDER))
+    X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/protected-uploads/')
+    # Background ingestion workers per backend process (0 = this process only queues uploads)
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 2))
+    INGEST_POLL_SECONDS = float(os.getenv('INGEST_POLL_SECONDS', 2))
+    # Running jobs whose worker sent no heartbeat for this long are assumed dead and re-queued
+    INGEST_STALE_SECONDS = int(os.getenv('INGEST_STALE_SECONDS', 600))
+    # Seconds between heartbeats of a running job (well below INGEST_STALE_SECONDS)
+    INGEST_HEARTBEAT_SECONDS = float(os.getenv('INGEST_HEARTBEAT_SECONDS', 30))
+    # LLM used for answers: 'gemini', or 'fake' for offline development
+    LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'gemini')
+    FAKE_LLM_TOKEN_DELAY = float(os.getenv('FAKE_LLM_TOKEN_DELAY', 0.02))
+    # Answer cache file shared by all workers on a node and kept across restarts
+    SHARED_CACHE_ENABLED = os.getenv('SHARED_CACHE_ENABLED', 'True') == 'True'
+    SHARED_CACHE_PATH = os.path.abspath(os.getenv('SHARED_CACHE_PATH', '../cache/answers.sqlite3'))
+    SHARED_CACHE_TTL = int(os.getenv('SHARED_CACHE_TTL', 86400))
+    # Memory-mapped segment files shared by all worker processes (for gunicorn)
+    VECTOR_STORE_ENABLED = os.getenv('VECTOR_STORE_ENABLED', 'False') == 'True'
+    VECTOR_STORE_MAX_SEGMENTS = int(os.getenv('VECTOR_STORE_MAX_SEGMENTS', 8))
+    # First-pass scoring on quantized codes: none, int8 (4x smaller) or binary (32x smaller).
+    # Pair with VECTOR_STORE_ENABLED so float32 vectors stay on disk and are only read to re-score.
+    QUANTIZATION = os.getenv('QUANTIZATION', 'none')
+    QUANTIZED_RESCORE_CANDIDATES = int(os.getenv('QUANTIZED_RESCORE_CANDIDATES', 200))
+    # Refit int8 scales of an in-memory subject once this share of its rows was clipped by them
+    QUANTIZATION_REFIT_CLIPPED = float(os.getenv('QUANTIZATION_REFIT_CLIPPED', 0.01))
+    # Reduce stored and query embeddings: none, pca (fit with build_projection.py) or truncate (Matryoshka models)
+    EMBEDDING_REDUCTION = os.getenv('EMBEDDING_REDUCTION', 'none')
+    EMBEDDING_REDUCED_DIM = int(os.getenv('EMBEDDING_REDUCED_DIM', 128))
     
     @staticmethod
     def init_app():
         """Initialize application directories"""
         os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(Config.IMAGES_FOLDER, exist_ok=True)
+        os.makedirs(Config.IMAGE_CACHE_DIR, exist_ok=True)
+        os.makedirs(Config.VECTOR_INDEX_DIR, exist_ok=True)
@@ -0,0 +1,46 @@
+"""
+Content hashing for TKR Chatbot uploads and chunks
+SHA-256 of uploaded files (computed while they stream to disk) and of normalized chunk text
+"""
+import hashlib
+import re
+import unicodedata
+
+# Bytes read from the upload stream per write
+COPY_BUFFER_BYTES = 1024 * 1024
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def save_and_hash(stream, path):
+    """Copy an upload stream to path, returning (sha256 hex digest, size in bytes)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as out:
+        while True:
+            block = stream.read(COPY_BUFFER_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file already on disk"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_chunk_text(text):
+    """Unicode-normalize and collapse whitespace, so re-extracted copies of a chunk compare equal"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def text_hash(text):
+    """SHA-256 hex digest of a chunk's normalized text (the embedding cache key)"""
+    return hashlib.sha256(normalize_chunk_text(text).encode('utf-8')).hexdigest()
@@ -0,0 +1,68 @@
+"""
+Database migration script for background ingestion
+Creates the ingest_jobs table and optionally queues materials that were never processed
+"""
+import argparse
+from database import get_db
+from migrate_content_hashes import has_column
+
+def create_ingest_tables(enqueue_unprocessed=False):
+    """Create the ingest_jobs table"""
+    db = get_db()
+    
+    ingest_jobs_sql = """
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        material_id INT NOT NULL,
+        status ENUM('queued', 'running', 'done', 'failed') DEFAULT 'queued',
+        stage VARCHAR(50) DEFAULT 'queued',
+        progress FLOAT DEFAULT 0,
+        attempts INT DEFAULT 0,
+        error TEXT,
+        claimed_by VARCHAR(100),
+        reused_from INT NULL,
+        chunks_total INT DEFAULT 0,
+        chunks_reused INT DEFAULT 0,
+        heartbeat_at TIMESTAMP NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP NULL,
+        FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
+        INDEX idx_status (status, id),
+        INDEX idx_material (material_id)
+    )
+    """
+    
+    try:
+        print("Creating ingest_jobs table...")
+        db.execute_query(ingest_jobs_sql, fetch=False)
+        print("✓ ingest_jobs table created")
+        
+        if not has_column(db, 'ingest_jobs', 'heartbeat_at'):
+            db.execute_query("ALTER TABLE ingest_jobs ADD COLUMN heartbeat_at TIMESTAMP NULL", fetch=False)
+            print("✓ ingest_jobs.heartbeat_at added")
+        
+        if enqueue_unprocessed:
+            print("Queueing unprocessed materials...")
+            db.execute_query("""
+                INSERT INTO ingest_jobs (material_id)
+                SELECT m.id FROM materials m
+                WHERE m.is_processed = FALSE
+                  AND NOT EXISTS (SELECT 1 FROM ingest_jobs j WHERE j.material_id = m.id)
+            """, fetch=False)
+            queued = db.execute_query("SELECT COUNT(*) AS count FROM ingest_jobs WHERE status = 'queued'")
+            print(f"✓ {queued[0]['count']} jobs queued")
+        
+        print("\n✅ Background ingestion tables ready!")
+        
+    except Exception as e:
+        print(f"❌ Error creating tables: {e}")
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the ingest_jobs table")
+    parser.add_argument('--enqueue-unprocessed', action='store_true',
+                        help="queue a job for every material that was never processed")
+    args = parser.parse_args()
+    
+    create_ingest_tables(args.enqueue_unprocessed)
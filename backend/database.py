@@ -3,6 +3,7 @@ from pymysql.cursors import DictCursor
 from dbutils.pooled_db import PooledDB
 from config import Config
 import logging
+import threading
 import time
 
 logger = logging.getLogger(__name__)
@@ -95,11 +96,17 @@ class Database:
             if connection:
                 connection.close()  # Return to pool
 
-# Global database instance
-db = Database()
+# Global database instance, created on first use so importing this module never connects
+db = None
+_db_lock = threading.Lock()
 
 def get_db():
     """Get database instance"""
+    global db
+    if db is None:
+        with _db_lock:
+            if db is None:
+                db = Database()
     return db
 
 def init_db():
@@ -0,0 +1,108 @@
+"""
+Micro-batching executor for TKR Chatbot query embeddings
+Collects concurrent single-query encode calls for a few milliseconds and runs them as one batch
+"""
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets for queue depth and batch size
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# Queued by close() to stop the worker thread
+_CLOSE = object()
+
+
+class MicroBatcher:
+    """Single worker thread that encodes queued items in batches
+
+    A batch is closed when it reaches max_batch_size items or max_wait
+    seconds after its first item arrived, whichever comes first. Callers
+    block only on their own future.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=32, max_wait=0.005, name='query_embedding'):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future for its encoding"""
+        future = Future()
+        with self._close_lock:
+            if not self._closed:
+                get_metrics().observe(f"{self.name}.queue_depth", self._queue.qsize(), BATCH_SIZE_BUCKETS)
+                self._queue.put((item, future, time.perf_counter()))
+                return future
+        # No worker any more: encode on the caller's thread
+        try:
+            future.set_result(self.encode_batch([item])[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def encode(self, item):
+        """Encode one item through the shared batch and wait for the result"""
+        return self.submit(item).result()
+
+    def close(self):
+        """Stop the worker thread once the items already queued are encoded"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_CLOSE)
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the window closes
+
+        Returns (batch, closing); closing is True once close() was called.
+        """
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch_size:
+            if deadline is None:
+                entry = self._queue.get()
+                deadline = time.perf_counter() + self.max_wait
+            else:
+                remaining = deadline - time.perf_counter()
+                try:
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if entry is _CLOSE:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self):
+        metrics = get_metrics()
+        closing = False
+        while not closing:
+            batch, closing = self._collect()
+            if not batch:
+                continue
+            start_time = time.perf_counter()
+            metrics.observe(f"{self.name}.batch_size", len(batch), BATCH_SIZE_BUCKETS)
+            for _, _, queued_at in batch:
+                metrics.observe(f"{self.name}.wait_seconds", start_time - queued_at)
+            try:
+                results = self.encode_batch([item for item, _, _ in batch])
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Batch encode of {len(batch)} items failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            metrics.observe(f"{self.name}.encode_seconds", time.perf_counter() - start_time)
@@ -0,0 +1,96 @@
+"""
+Binary encoding for stored embedding vectors
+Packs vectors as float32/float16 with a small header so readers can use np.frombuffer
+"""
+import json
+import struct
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# magic, format version, dtype code, dimension, reserved
+HEADER = struct.Struct('<2sBBHH')
+MAGIC = b'EV'
+VERSION = 1
+
+DTYPE_CODES = {
+    'float32': 1,
+    'float16': 2,
+}
+CODE_DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f2'),
+}
+
+
+def pack_embedding(vector, dtype='float32'):
+    """Pack a single embedding vector into the binary storage format"""
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    array = np.asarray(vector, dtype=CODE_DTYPES[DTYPE_CODES[dtype]]).ravel()
+    header = HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], len(array), 0)
+    return header + array.tobytes()
+
+
+def is_packed(blob):
+    """Check whether a stored value uses the binary format (vs legacy JSON)"""
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:2]) == MAGIC
+
+
+def read_header(blob):
+    """Return (dtype, dim) for a packed embedding"""
+    magic, version, code, dim, _ = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION or code not in CODE_DTYPES:
+        raise ValueError("Invalid embedding header")
+    return CODE_DTYPES[code], dim
+
+
+def unpack_embedding(blob):
+    """Decode one stored embedding (binary or legacy JSON) to a float32 vector"""
+    if is_packed(blob):
+        dtype, dim = read_header(blob)
+        vector = np.frombuffer(blob, dtype=dtype, count=dim, offset=HEADER.size)
+        return vector.astype(np.float32, copy=False)
+
+    if isinstance(blob, (bytes, bytearray)):
+        blob = blob.decode('utf-8')
+    return np.asarray(json.loads(blob), dtype=np.float32)
+
+
+def unpack_matrix(blobs, dim):
+    """Decode many stored embeddings into one float32 matrix
+
+    Returns (matrix, kept) where kept lists the indices of blobs that
+    decoded to a vector of the expected dimension. The matrix is allocated
+    once and each binary payload is converted straight into its row, so
+    apart from the result only one row is ever decoded at a time; legacy
+    JSON rows (e.g. mid-migration) are parsed individually.
+    """
+    matrix = np.empty((len(blobs), dim), dtype=np.float32)
+    kept = []
+    for i, blob in enumerate(blobs):
+        try:
+            if is_packed(blob):
+                dtype, blob_dim = read_header(blob)
+                if blob_dim == dim:
+                    matrix[len(kept)] = np.frombuffer(blob, dtype=dtype, count=dim, offset=HEADER.size)
+                    kept.append(i)
+                    continue
+                vector_dim = blob_dim
+            else:
+                vector = unpack_embedding(blob)
+                vector_dim = len(vector)
+                if vector_dim == dim:
+                    matrix[len(kept)] = vector
+                    kept.append(i)
+                    continue
+        except (ValueError, TypeError, struct.error) as e:
+            logger.warning(f"Skipping invalid embedding: {e}")
+            continue
+        logger.warning(f"Skipping embedding with dimension {vector_dim}")
+
+    if len(kept) < len(blobs):
+        # Do not keep the rows of skipped blobs allocated behind a view
+        return matrix[:len(kept)].copy(), kept
+    return matrix, kept
@@ -0,0 +1,151 @@
+"""
+Background loader for the TKR Chatbot RAG engine
+Builds the engine off the request path, reports per-component readiness for /api/ready,
+and swaps in a rebuilt engine when its inputs change (e.g. a new embedding version)
+"""
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EngineLoader:
+    """Build an engine on a daemon thread, tracking when each component became ready
+
+    build(mark) must construct and return the engine, calling mark(name)
+    as each named component finishes loading.
+    """
+
+    def __init__(self, components):
+        self.engine = None
+        self.error = None
+        self._components = {name: None for name in components}
+        self._started_at = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._watcher = None
+        self.rebuilds = 0
+        # Changes (e.g. deletes) made while an engine is being built, applied
+        # to it before it is published; None while no build is pending
+        self._pending = []
+
+    def mark(self, component):
+        """Record that a component finished loading"""
+        with self._lock:
+            self._components[component] = time.time() - self._started_at
+        logger.info(f"Engine component ready: {component} ({self._components[component]:.2f}s)")
+
+    def start(self, build):
+        """Start loading in the background (only the first call has any effect)"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._run, args=(build,), name='engine-loader', daemon=True)
+        self._thread.start()
+        return self
+
+    def apply(self, change):
+        """Run change(engine) on the current engine and on any engine being built
+
+        An engine still being built may have read the database before the
+        change was made, so the change is queued and replayed on it before
+        it is published. Returns False if no engine is serving yet.
+        """
+        with self._lock:
+            engine = self.engine
+            if self._pending is not None:
+                self._pending.append(change)
+        if engine is not None:
+            change(engine)
+        return engine is not None
+
+    def _publish(self, engine):
+        """Replay queued changes on a freshly built engine, then swap it in"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+            for change in pending:
+                try:
+                    change(engine)
+                except Exception as e:
+                    logger.error(f"Could not apply a queued change to the new engine: {e}")
+            self.engine = engine
+        if pending:
+            logger.info(f"Applied {len(pending)} changes made while the engine was building")
+
+    def _run(self, build):
+        try:
+            self._publish(build(self.mark))
+            logger.info(f"Engine ready in {time.time() - self._started_at:.2f}s")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Engine failed to load: {e}")
+            with self._lock:
+                self._pending = None
+        finally:
+            self._ready.set()
+
+    def watch(self, needs_rebuild, build, interval, retire=None, retire_delay=60.0):
+        """Every interval seconds, rebuild the engine in the background if needs_rebuild(engine)
+
+        The current engine keeps serving until build(mark) returns its
+        replacement, which is then swapped in with a single assignment.
+        retire(old_engine) runs retire_delay seconds later, once requests
+        that already held the old engine have finished with it.
+        """
+        if interval <= 0 or self._watcher is not None:
+            return self
+
+        def run():
+            self._ready.wait()
+            while True:
+                time.sleep(interval)
+                current = self.engine
+                try:
+                    if current is None or not needs_rebuild(current):
+                        continue
+                    logger.info("Engine inputs changed, building a replacement in the background")
+                    start_time = time.time()
+                    with self._lock:
+                        self._pending = []
+                    replacement = build(lambda component: None)
+                except Exception as e:
+                    logger.error(f"Engine rebuild failed, still serving the current engine: {e}")
+                    with self._lock:
+                        self._pending = None
+                    continue
+                self._publish(replacement)
+                self.rebuilds += 1
+                logger.info(f"Switched to the rebuilt engine ({time.time() - start_time:.1f}s to build)")
+                if retire is not None:
+                    threading.Timer(retire_delay, retire, args=(current,)).start()
+
+        self._watcher = threading.Thread(target=run, name='engine-watcher', daemon=True)
+        self._watcher.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Return the engine once loaded, or None if it is still loading (or failed) after timeout"""
+        self._ready.wait(timeout)
+        return self.engine
+
+    @property
+    def ready(self):
+        return self.engine is not None
+
+    def readiness(self):
+        """Per-component load times (None while pending) plus overall state"""
+        with self._lock:
+            components = {
+                name: {'ready': seconds is not None, 'seconds': seconds}
+                for name, seconds in self._components.items()
+            }
+        return {
+            'ready': self.ready,
+            'loading': self._thread is not None and not self._ready.is_set(),
+            'error': self.error,
+            'rebuilds': self.rebuilds,
+            'components': components
+        }
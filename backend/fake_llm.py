@@ -0,0 +1,62 @@
+"""
+Fake streaming LLM for TKR Chatbot
+Offline stand-in for the Gemini model, used for development and streaming tests
+"""
+import re
+import time
+
+
+class FakeChunk:
+    """One streamed piece of a response"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """Response with .text, iterable as chunks like a streamed Gemini response"""
+
+    def __init__(self, tokens, token_delay=0.0):
+        self._tokens = tokens
+        self._token_delay = token_delay
+        self.text = ''.join(tokens)
+
+    def __iter__(self):
+        for token in self._tokens:
+            if self._token_delay:
+                time.sleep(self._token_delay)
+            yield FakeChunk(token)
+
+
+class FakeStreamingModel:
+    """Deterministic markdown answers built from the prompt, with no network access
+
+    Mirrors the parts of genai.GenerativeModel the engine uses:
+    generate_content(prompt) and generate_content(prompt, stream=True).
+    """
+
+    def __init__(self, token_delay=0.02, tokens_per_chunk=3):
+        self.token_delay = token_delay
+        self.tokens_per_chunk = tokens_per_chunk
+
+    def _answer(self, prompt):
+        question = re.search(r"QUESTION: (.*)|Student's Question: (.*)", prompt)
+        question = next((g for g in question.groups() if g), '').strip() if question else 'your question'
+        refs = list(dict.fromkeys(re.findall(r'\[Ref: ([^\]]+)\]', prompt)))
+
+        lines = [f"## 📖 {question}", "", "This is an offline answer from the fake LLM.", ""]
+        if refs:
+            lines.append("## 🔍 Key Points")
+            lines += [f"• **Context {i}**: drawn from {ref}" for i, ref in enumerate(refs, 1)]
+            lines += ["", "---", "## 📚 Sources", f"**Referenced from:** {'; '.join(refs)}"]
+        else:
+            lines.append("## ⚠️ Topic Not Found in Your Materials")
+        return "\n".join(lines)
+
+    def generate_content(self, prompt, stream=False):
+        words = re.findall(r'\S+\s*|\s+', self._answer(prompt))
+        tokens = [
+            ''.join(words[i:i + self.tokens_per_chunk])
+            for i in range(0, len(words), self.tokens_per_chunk)
+        ]
+        return FakeResponse(tokens, self.token_delay if stream else 0.0)
@@ -0,0 +1,67 @@
+"""
+Static file responses for TKR Chatbot downloads and images
+Range requests and conditional GET (ETag/Last-Modified) through send_file, or hand-off of the
+transfer to a fronting web server with X-Sendfile / X-Accel-Redirect (FILE_OFFLOAD)
+"""
+import os
+import mimetypes
+import logging
+from urllib.parse import quote
+from flask import Response, send_file
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _accel_uri(path):
+    """Internal nginx URI of a file under X_ACCEL_ROOT, or None if it lies elsewhere"""
+    path = os.path.abspath(path)
+    if os.path.commonpath([path, Config.X_ACCEL_ROOT]) != Config.X_ACCEL_ROOT:
+        return None
+    relative = os.path.relpath(path, Config.X_ACCEL_ROOT).replace(os.sep, '/')
+    return Config.X_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative)
+
+
+def _accel_response(path, uri, mimetype, as_attachment, download_name, max_age):
+    """Empty response telling nginx to serve the file itself
+
+    nginx keeps Content-Type, Content-Disposition and Cache-Control from
+    this response and answers Range and If-None-Match/If-Modified-Since
+    with its own ETag and Last-Modified.
+    """
+    response = Response(mimetype=mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = uri
+    if as_attachment:
+        name = download_name or os.path.basename(path)
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(name)}"
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def send_static(path, mimetype=None, as_attachment=False, download_name=None, etag=True, max_age=None):
+    """Serve a file on disk with range and conditional GET support
+
+    etag may be a string (e.g. a content hash) to use instead of the one
+    derived from mtime and size. Without max_age clients revalidate every
+    time, which costs a 304 rather than the whole file.
+    """
+    if Config.FILE_OFFLOAD == 'x-accel-redirect':
+        uri = _accel_uri(path)
+        if uri is not None:
+            return _accel_response(path, uri, mimetype, as_attachment, download_name, max_age)
+        logger.warning(f"{path} is outside X_ACCEL_ROOT; serving it through the app")
+    # With FILE_OFFLOAD=x-sendfile Flask's USE_X_SENDFILE makes send_file emit the header
+    # instead of the body; either way werkzeug answers Range and conditional requests
+    return send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=etag,
+        max_age=max_age
+    )
@@ -2,14 +2,31 @@
 Gemini-powered RAG Engine for TKR Chatbot
 Uses Google's Gemini AI with retrieval augmented generation
 """
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import json
 import time
 from database import get_db
+from vector_index import VectorIndex, normalize_rows, version_index_dir
+from semantic_cache import SemanticCache, SIMILARITY_BUCKETS
+from answer_cache import LRUCache
+from shared_cache import SharedAnswerCache, InProcessGenerations, GLOBAL_SCOPE
+from fake_llm import FakeStreamingModel
+from single_flight import SingleFlight, chunk_overlap
+from embedding_batcher import MicroBatcher
+from projection import load_projection
+from vector_store import MmapVectorStore
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from embedding_codec import pack_embedding, unpack_embedding, is_packed, read_header
+from content_hash import text_hash
+from models import EmbeddingVersion, IngestJobSuperseded
+from config import Config
+from metrics import get_metrics
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from engine_loader import EngineLoader
+import threading
 import logging
-import google.generativeai as genai
 import os
+import sqlite3
 from dotenv import load_dotenv
 
 # Force reload .env to avoid caching issues
@@ -17,30 +34,244 @@ load_dotenv(override=True)
 
 logger = logging.getLogger(__name__)
 
+
+def cached_embeddings(hashes, embedding_version, dim):
+    """Stored blobs of an embedding version for chunk text hashes, keyed by hash"""
+    unique = list(set(hashes))
+    placeholders = ', '.join(['%s'] * len(unique))
+    rows = get_db().execute_query(f"""
+        SELECT de.text_hash, de.embedding_vector
+        FROM document_embeddings de
+        JOIN (
+            SELECT MIN(id) AS id FROM document_embeddings
+            WHERE embedding_version = %s AND text_hash IN ({placeholders})
+            GROUP BY text_hash
+        ) first_rows ON de.id = first_rows.id
+    """, (embedding_version, *unique))
+    blobs = {}
+    for row in rows:
+        # Vectors from a different model (dimension) cannot be reused
+        if is_packed(row['embedding_vector']) and read_header(row['embedding_vector'])[1] == dim:
+            blobs[row['text_hash']] = row['embedding_vector']
+    return blobs
+
+
 class GeminiRAGEngine:
     """RAG Engine using Gemini AI for answer generation"""
     
-    def __init__(self, model_name='all-MiniLM-L6-v2', gemini_api_key=None):
-        """Initialize RAG engine with embedding model and Gemini"""
+    def __init__(self, model_name=None, gemini_api_key=None, progress=None):
+        """Initialize RAG engine with embedding model and Gemini
+        
+        The embedding model is the one of the active embedding version
+        (EMBEDDING_MODEL when none is recorded yet); model_name overrides it.
+        progress(component) is called as 'embedding_model', 'vector_index'
+        and 'llm' finish loading.
+        """
+        progress = progress or (lambda component: None)
         try:
-            # Load embedding model for semantic search
-            self.embedding_model = SentenceTransformer(model_name)
-            logger.info(f"Loaded embedding model: {model_name}")
+            self.embedding_version, active_model = self._active_embedding_version()
+            model_name = model_name or active_model
             
-            # Configure Gemini - force reload env vars
-            load_dotenv(override=True)
-            api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
-            if not api_key:
-                raise ValueError("GEMINI_API_KEY not found in environment")
-            
-            genai.configure(api_key=api_key)
-            self.gemini_model = genai.GenerativeModel(os.getenv('GEMINI_MODEL', 'gemini-pro'))
-            logger.info("Initialized Gemini AI model")
+            # Load embedding model for semantic search (imported here: torch is slow to import)
+            from sentence_transformers import SentenceTransformer
+            self.embedding_model = SentenceTransformer(model_name)
+            self.model_name = model_name
+            logger.info(f"Loaded embedding model: {model_name} (embedding version {self.embedding_version})")
+            progress('embedding_model')
+            
+            # Resident vector index, built once and updated on upload/delete
+            dim = self.embedding_model.get_sentence_embedding_dimension()
+            index_dir = version_index_dir(Config.VECTOR_INDEX_DIR, self.embedding_version)
+            projection = None
+            try:
+                projection = load_projection(
+                    Config.EMBEDDING_REDUCTION, index_dir, dim, Config.EMBEDDING_REDUCED_DIM
+                )
+            except Exception as e:
+                logger.error(f"Embedding reduction disabled: {e}")
+            store = None
+            if Config.VECTOR_STORE_ENABLED:
+                # Reduced vectors get their own store, re-seeded whenever the projection changes
+                store_dir = 'store' if projection is None else f"store_{projection.fingerprint}"
+                store = MmapVectorStore(
+                    os.path.join(index_dir, store_dir),
+                    projection.dim if projection is not None else dim,
+                    max_segments=Config.VECTOR_STORE_MAX_SEGMENTS
+                )
+            self.vector_index = VectorIndex(
+                dim,
+                ann_dir=index_dir if Config.ANN_ENABLED else None,
+                ann_nprobe=Config.ANN_NPROBE,
+                ann_min_vectors=Config.ANN_MIN_VECTORS,
+                store=store,
+                quantization=Config.QUANTIZATION,
+                rescore_candidates=Config.QUANTIZED_RESCORE_CANDIDATES,
+                projection=projection,
+                embedding_version=self.embedding_version,
+                refit_clipped_fraction=Config.QUANTIZATION_REFIT_CLIPPED
+            )
+            # Keyword index, kept in step with the vector index through its listener hook
+            self.bm25_index = BM25Index()
+            self.vector_index.listeners.append(self.bm25_index.sync_subject)
+            # Answers shared by every worker on this node; subject generations
+            # are part of each cache key so uploads and deletes invalidate at once
+            self.shared_cache = None
+            self.generations = InProcessGenerations()
+            if Config.SHARED_CACHE_ENABLED:
+                try:
+                    self.shared_cache = SharedAnswerCache(Config.SHARED_CACHE_PATH, ttl=Config.SHARED_CACHE_TTL)
+                    self.generations = self.shared_cache
+                except sqlite3.Error as e:
+                    logger.warning(f"Shared answer cache unavailable, using this process's cache only: {e}")
+            self._seen_generations = {}
+            self._generations_lock = threading.Lock()
+            # Subject generations the in-memory index reflects (see _reload_changed_subjects)
+            self._indexed_generations = {}
+            self._reload_lock = threading.Lock()
+            
+            # Read before loading, so rows reembed.py adds during the load are picked up later
+            self.catch_up_generation = self._catch_up_generation()
+            self.load_vector_index()
+            progress('vector_index')
+            
+            # Exact-question answer cache
+            self.answer_cache = LRUCache(
+                max_entries=Config.ANSWER_CACHE_MAX_ENTRIES,
+                max_bytes=Config.ANSWER_CACHE_MAX_BYTES,
+                ttl=Config.ANSWER_CACHE_TTL
+            )
+            
+            # Answers keyed by query embedding, for paraphrased questions
+            self.semantic_cache = SemanticCache(
+                dim,
+                threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+                near_miss_margin=Config.SEMANTIC_CACHE_NEAR_MISS_MARGIN,
+                max_entries=Config.SEMANTIC_CACHE_MAX_ENTRIES,
+                ttl=Config.ANSWER_CACHE_TTL
+            )
+            
+            # Concurrent identical questions wait on one in-flight answer; a
+            # paraphrase only joins if it retrieved mostly the same chunks
+            self.inflight = SingleFlight(
+                threshold=Config.SEMANTIC_CACHE_THRESHOLD if Config.SEMANTIC_CACHE_ENABLED else None,
+                min_overlap=Config.SEMANTIC_CACHE_MIN_OVERLAP
+            )
+            
+            # Query embeddings from concurrent requests are encoded together
+            self.query_batcher = None
+            if Config.QUERY_BATCHING_ENABLED:
+                self.query_batcher = MicroBatcher(
+                    self.generate_embeddings,
+                    max_batch_size=Config.QUERY_BATCH_MAX_SIZE,
+                    max_wait=Config.QUERY_BATCH_MAX_WAIT_MS / 1000.0
+                )
+            
+            self._init_llm(gemini_api_key)
+            progress('llm')
             
         except Exception as e:
             logger.error(f"Failed to initialize Gemini RAG engine: {e}")
             raise
     
+    @staticmethod
+    def _active_embedding_version():
+        """(version id, model name) of the embedding version to serve"""
+        try:
+            active = EmbeddingVersion.ensure_active(Config.EMBEDDING_MODEL)
+        except Exception as e:
+            # Pre-versioning database (run migrate_embedding_versions.py) or DB down
+            logger.error(f"Could not read the active embedding version, assuming version 1: {e}")
+            return 1, Config.EMBEDDING_MODEL
+        if active['model_name'] != Config.EMBEDDING_MODEL:
+            logger.warning(
+                f"EMBEDDING_MODEL is {Config.EMBEDDING_MODEL} but stored vectors use {active['model_name']}; "
+                f"serving {active['model_name']} until reembed.py activates a new version"
+            )
+        return active['id'], active['model_name']
+    
+    def _init_llm(self, gemini_api_key=None):
+        """Configure the answer-generating model"""
+        if Config.LLM_PROVIDER == 'fake':
+            # Offline stand-in with the same generate_content() interface
+            self.gemini_model = FakeStreamingModel(token_delay=Config.FAKE_LLM_TOKEN_DELAY)
+            logger.info("Using fake streaming LLM")
+            return
+        
+        # Configure Gemini - force reload env vars
+        load_dotenv(override=True)
+        api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment")
+        
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.gemini_model = genai.GenerativeModel(os.getenv('GEMINI_MODEL', 'gemini-pro'))
+        logger.info("Initialized Gemini AI model")
+    
+    def close(self):
+        """Release background threads once a replacement engine is serving"""
+        if self.query_batcher is not None:
+            self.query_batcher.close()
+    
+    def embedding_version_changed(self):
+        """True when another embedding version was activated since this engine loaded"""
+        try:
+            active = EmbeddingVersion.get_active()
+        except Exception as e:
+            logger.warning(f"Could not check the active embedding version: {e}")
+            return False
+        return active is not None and active['id'] != self.embedding_version
+    
+    def _catch_up_generation(self):
+        """This engine's embedding version's catch_up_generation (None if unreadable)"""
+        try:
+            version = EmbeddingVersion.get_by_id(self.embedding_version)
+        except Exception as e:
+            logger.warning(f"Could not read embedding version {self.embedding_version}: {e}")
+            return None
+        return (version or {}).get('catch_up_generation', 0)
+    
+    def index_caught_up_materials(self):
+        """Index materials reembed.py added to this engine's version after the index was loaded
+        
+        Rows re-embedded during a model switch are written straight to the
+        database; reembed.py bumps the version's catch_up_generation, and
+        on a change every backend loads the materials its index lacks.
+        Returns the number of materials indexed.
+        """
+        generation = self._catch_up_generation()
+        if generation is None or generation == self.catch_up_generation:
+            return 0
+        try:
+            rows = get_db().execute_query("""
+                SELECT DISTINCT de.material_id, m.subject_id
+                FROM document_embeddings de
+                JOIN materials m ON de.material_id = m.id
+                WHERE m.is_processed = TRUE AND de.embedding_version = %s
+            """, (self.embedding_version,))
+        except Exception as e:
+            logger.warning(f"Could not list materials of embedding version {self.embedding_version}: {e}")
+            return 0
+        self.catch_up_generation = generation
+        indexed = 0
+        for row in rows:
+            if self.vector_index.has_material(row['material_id']):
+                continue
+            if self.index_stored_material(row['material_id']):
+                self.invalidate_subject(row['subject_id'])
+                indexed += 1
+        if indexed:
+            logger.info(f"Indexed {indexed} materials re-embedded into version {self.embedding_version}")
+        return indexed
+    
+    def warm_up(self):
+        """Run one query through encoding and search so the first real request is not slow"""
+        start_time = time.time()
+        query_vec = self.embed_query("warm up")
+        self.vector_index.search(query_vec, None, 1)
+        self.bm25_index.search("warm up", None, 1)
+        logger.info(f"Engine warm-up took {time.time() - start_time:.2f}s")
+    
     def generate_embedding(self, text):
         """Generate embedding vector for text"""
         try:
@@ -50,35 +281,304 @@ class GeminiRAGEngine:
             logger.error(f"Embedding generation failed: {e}")
             raise
     
-    def store_embeddings(self, material_id, chunks):
-        """Store document chunks and their embeddings"""
+    def embed_query(self, text):
+        """Embedding of a search query as float32, batched with concurrent queries"""
+        if self.query_batcher is not None:
+            return self.query_batcher.encode(text)
+        return np.asarray(self.generate_embedding(text), dtype=np.float32)
+    
+    def load_vector_index(self):
+        """(Re)build the in-memory vector index from the database"""
+        # Read first, so changes other workers make during the load are reloaded later
+        if self._follows_other_workers():
+            self._indexed_generations = self.shared_cache.all_generations() or {}
         try:
-            db = get_db()
-            embeddings_data = []
-            
-            for idx, chunk in enumerate(chunks):
-                embedding = self.generate_embedding(chunk['text'])
-                embeddings_data.append((
-                    material_id,
-                    chunk['text'],
-                    idx,
-                    chunk.get('page', 0),
-                    json.dumps(embedding)
-                ))
-            
-            query = """
-                INSERT INTO document_embeddings 
-                (material_id, chunk_text, chunk_index, page_number, embedding_vector)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            
-            db.execute_many(query, embeddings_data)
-            logger.info(f"Stored {len(embeddings_data)} embeddings for material {material_id}")
-            return True
-            
+            self.vector_index.load(get_db())
+        except Exception as e:
+            # Searches retry the load, so a DB outage at startup is not fatal
+            logger.error(f"Failed to load vector index: {e}")
+    
+    def generate_embeddings(self, texts):
+        """Generate embedding vectors for a batch of texts in one forward pass"""
+        try:
+            return self.embedding_model.encode(
+                texts,
+                batch_size=Config.EMBEDDING_BATCH_SIZE,
+                convert_to_numpy=True
+            ).astype(np.float32, copy=False)
+        except Exception as e:
+            logger.error(f"Batch embedding generation failed: {e}")
+            raise
+    
+    def store_embeddings(self, material_id, chunks, progress=None):
+        """Store document chunks and their embeddings, returning {'chunks': stored, 'cached': reused}
+        
+        chunks may be a list or any iterable, such as a generator streaming
+        the pages of a PDF. Chunks are encoded EMBEDDING_BATCH_SIZE at a
+        time, and each full batch of EMBEDDING_INSERT_BATCH_SIZE rows is
+        written on a background thread while the next chunks are encoded;
+        at most one batch of packed rows is in flight. The material is added
+        to the in-memory index once, after its last batch, so the subject's
+        matrix is rebuilt once per material rather than once per batch; until
+        then only its float32 vectors (in one growing array) and chunk texts
+        are kept. Chunks whose normalized text was embedded before (in any
+        material) reuse the stored vector instead of being encoded again.
+        progress(done, total) is called after each batch (total is None
+        for iterators).
+        """
+        query = """
+            INSERT INTO document_embeddings 
+            (material_id, chunk_text, chunk_index, page_number, embedding_vector, text_hash, embedding_version)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+        db = get_db()
+        metrics = get_metrics()
+        start_time = time.time()
+        total = len(chunks) if hasattr(chunks, '__len__') else None
+        remaining = iter(chunks)
+        stored_count = 0
+        pending = []
+        # Text/page and vector of every stored chunk, for the in-memory index
+        stored_chunks = []
+        vectors = np.empty((total or Config.EMBEDDING_INSERT_BATCH_SIZE, self.vector_index.input_dim), dtype=np.float32)
+        inflight = None
+        cached_count = 0
+        
+        try:
+            with ThreadPoolExecutor(max_workers=1) as writer:
+                while True:
+                    batch = list(islice(remaining, Config.EMBEDDING_BATCH_SIZE))
+                    if not batch:
+                        break
+                    start = stored_count
+                    hashes = [text_hash(chunk['text']) for chunk in batch]
+                    blobs = self._cached_embeddings(hashes) if Config.EMBEDDING_CACHE_ENABLED else {}
+                    
+                    # Encode each new text once, even if it repeats within the batch
+                    new_texts = {}
+                    for chunk, chunk_hash in zip(batch, hashes):
+                        if chunk_hash not in blobs:
+                            new_texts.setdefault(chunk_hash, chunk['text'])
+                    fresh = {}
+                    if new_texts:
+                        with metrics.timer('embedding.batch_seconds'):
+                            embeddings = self.generate_embeddings(list(new_texts.values()))
+                        fresh = dict(zip(new_texts, embeddings))
+                    
+                    if stored_count + len(batch) > len(vectors):
+                        # Double the capacity, so streamed PDFs copy each vector O(1) times on average
+                        grown = np.empty((max(2 * len(vectors), stored_count + len(batch)), vectors.shape[1]),
+                                         dtype=np.float32)
+                        grown[:stored_count] = vectors[:stored_count]
+                        vectors = grown
+                    batch_vectors = vectors[start:start + len(batch)]
+                    for offset, (chunk, chunk_hash) in enumerate(zip(batch, hashes)):
+                        if chunk_hash in fresh:
+                            batch_vectors[offset] = fresh[chunk_hash]
+                            blob = pack_embedding(fresh[chunk_hash], Config.EMBEDDING_STORAGE_DTYPE)
+                        else:
+                            blob = blobs[chunk_hash]
+                            batch_vectors[offset] = unpack_embedding(blob)
+                            cached_count += 1
+                        pending.append((
+                            material_id,
+                            chunk['text'],
+                            start + offset,
+                            chunk.get('page', 0),
+                            blob,
+                            chunk_hash,
+                            self.embedding_version
+                        ))
+                    stored_chunks.extend({'text': chunk['text'], 'page': chunk.get('page', 0)} for chunk in batch)
+                    stored_count += len(batch)
+                    
+                    if len(pending) >= Config.EMBEDDING_INSERT_BATCH_SIZE:
+                        if inflight is not None:
+                            inflight.result()
+                        inflight = writer.submit(db.execute_many, query, pending)
+                        pending = []
+                    
+                    if progress:
+                        progress(stored_count, total)
+                
+                if inflight is not None:
+                    inflight.result()
+                if pending:
+                    db.execute_many(query, pending)
+            self.index_material(material_id, stored_chunks, vectors[:stored_count])
+            
+        except IngestJobSuperseded:
+            # Another worker re-claimed the material; its rows are no longer ours to delete
+            raise
         except Exception as e:
             logger.error(f"Failed to store embeddings: {e}")
+            # Batches commit separately, so remove any partial insert (and index update)
+            try:
+                self.vector_index.remove_material(material_id)
+            except Exception as cleanup_error:
+                logger.error(f"Failed to unindex partial material {material_id}: {cleanup_error}")
+            try:
+                db.execute_query(
+                    "DELETE FROM document_embeddings WHERE material_id = %s AND embedding_version = %s",
+                    (material_id, self.embedding_version),
+                    fetch=False
+                )
+            except Exception as cleanup_error:
+                logger.error(f"Failed to clean up embeddings for material {material_id}: {cleanup_error}")
             raise
+        
+        elapsed = time.time() - start_time
+        rate = stored_count / elapsed if elapsed > 0 else 0.0
+        metrics.incr('embedding.chunks_total', stored_count)
+        metrics.incr('embedding.cache_hits', cached_count)
+        metrics.set_gauge('embedding.chunks_per_second', rate)
+        logger.info(
+            f"Stored {stored_count} embeddings for material {material_id} "
+            f"({cached_count} reused, {rate:.1f} chunks/s)"
+        )
+        return {'chunks': stored_count, 'cached': cached_count}
+    
+    def _cached_embeddings(self, hashes):
+        """Stored embedding blobs for chunk text hashes seen before in any material, keyed by hash"""
+        return cached_embeddings(hashes, self.embedding_version, self.vector_index.input_dim)
+    
+    def index_stored_material(self, material_id):
+        """Load a material's stored chunks and vectors from the database into the in-memory index"""
+        rows = get_db().execute_query(
+            "SELECT chunk_text, page_number, embedding_vector FROM document_embeddings "
+            "WHERE material_id = %s AND embedding_version = %s ORDER BY chunk_index",
+            (material_id, self.embedding_version)
+        )
+        if not rows:
+            return 0
+        chunks = [{'text': row['chunk_text'], 'page': row['page_number']} for row in rows]
+        vectors = np.vstack([unpack_embedding(row['embedding_vector']) for row in rows])
+        self.index_material(material_id, chunks, vectors, skip_existing=True)
+        return len(rows)
+    
+    def index_material(self, material_id, chunks, vectors, skip_existing=False):
+        """Add a freshly stored material to the in-memory vector index
+        
+        skip_existing is passed on to VectorIndex.add_material.
+        """
+        if not chunks:
+            return
+        db = get_db()
+        material = db.execute_query(
+            "SELECT subject_id, title FROM materials WHERE id = %s",
+            (material_id,)
+        )
+        if not material:
+            logger.warning(f"Material {material_id} not found, skipping indexing")
+            return
+        
+        rows = db.execute_query(
+            "SELECT id FROM document_embeddings WHERE material_id = %s AND embedding_version = %s "
+            "ORDER BY chunk_index",
+            (material_id, self.embedding_version)
+        )
+        self.vector_index.add_material(
+            material[0]['subject_id'],
+            material_id,
+            material[0]['title'],
+            [row['id'] for row in rows],
+            chunks,
+            vectors,
+            skip_existing=skip_existing
+        )
+    
+    def remove_material(self, material_id, subject_id=None):
+        """Forget a deleted material in every in-memory structure"""
+        self.vector_index.remove_material(material_id)
+        self.invalidate_subject(subject_id)
+    
+    def remove_subject(self, subject_id):
+        """Forget a deleted subject in every in-memory structure"""
+        self.vector_index.remove_subject(subject_id)
+        self.invalidate_subject(subject_id)
+    
+    def invalidate_subject(self, subject_id):
+        """Bump a subject's cache generation after its materials changed
+        
+        Other workers see the new generation on their next lookup; this
+        process also drops its local entries straight away.
+        """
+        subject_id = int(subject_id) if subject_id else None
+        if not self._follows_other_workers():
+            self.generations.bump(subject_id)
+        else:
+            with self._reload_lock:
+                scopes = {subject_id or GLOBAL_SCOPE, GLOBAL_SCOPE}
+                before = {scope: self.generations.generation(scope) for scope in scopes}
+                self.generations.bump(subject_id)
+                for scope in scopes:
+                    # Our index already has this change; it stays current only
+                    # if it was before and no other worker bumped meanwhile
+                    if (before[scope] is not None and self._indexed_generations.get(scope, 0) == before[scope]
+                            and self.generations.generation(scope) == before[scope] + 1):
+                        self._indexed_generations[scope] = before[scope] + 1
+        self._drop_local_answers(subject_id)
+    
+    def _follows_other_workers(self):
+        """True when this process's in-memory index must pick up other workers' changes itself
+        
+        Memory-mapped store segments are shared and refreshed by the index;
+        an in-memory index instead reloads subjects whose shared generation
+        moved. Without a shared cache there is no way to notice, so that
+        setup is limited to a single worker process.
+        """
+        return self.vector_index.store is None and self.shared_cache is not None
+    
+    def _reload_changed_subjects(self):
+        """Reload subjects whose shared generation moved since the index last reflected them"""
+        with self._reload_lock:
+            generations = self.shared_cache.all_generations()
+            if generations is None:
+                return
+            changed = {
+                scope for scope, generation in generations.items()
+                if scope != GLOBAL_SCOPE and generation != self._indexed_generations.get(scope, 0)
+            }
+            reloaded = set()
+            if changed:
+                try:
+                    reloaded = self.vector_index.reload_subjects(get_db(), changed)
+                except Exception as e:
+                    logger.warning(f"Could not reload subjects {sorted(changed)} changed by another worker: {e}")
+            # Subjects left out are retried on a later lookup
+            for scope in changed - reloaded:
+                generations[scope] = self._indexed_generations.get(scope, 0)
+            if changed - reloaded:
+                generations[GLOBAL_SCOPE] = self._indexed_generations.get(GLOBAL_SCOPE, 0)
+            self._indexed_generations = generations
+    
+    def _drop_local_answers(self, subject_id):
+        """Remove this process's cached answers that may depend on a subject"""
+        if subject_id is None:
+            self.answer_cache.clear()
+        else:
+            self.answer_cache.delete_where(lambda key: key[1] in (subject_id, None))
+        self.semantic_cache.invalidate(subject_id)
+    
+    def _cache_generation(self, subject_id):
+        """Current generation of a subject, dropping stale local answers when it moved
+        
+        None when the shared generation could not be read.
+        """
+        generation = self.generations.generation(subject_id)
+        if generation is None:
+            get_metrics().incr('shared_cache.errors')
+            return None
+        if self._follows_other_workers() and generation != self._indexed_generations.get(subject_id or GLOBAL_SCOPE, 0):
+            # Another worker changed the subject's materials in the database
+            self._reload_changed_subjects()
+        with self._generations_lock:
+            moved = self._seen_generations.get(subject_id, generation) != generation
+            self._seen_generations[subject_id] = generation
+        if moved:
+            # Another worker changed this subject since we last looked
+            self._drop_local_answers(subject_id)
+        return generation
     
     def cosine_similarity(self, vec1, vec2):
         """Calculate cosine similarity between two vectors"""
@@ -86,90 +586,45 @@ class GeminiRAGEngine:
         vec2 = np.array(vec2)
         return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
     
-    def search_similar_chunks(self, query, subject_id=None, top_k=5):
-        """Search for most similar document chunks with optimized vectorization"""
+    def search_similar_chunks(self, query, subject_id=None, top_k=5, query_vec=None):
+        """Search for the most relevant chunks with hybrid vector + BM25 retrieval"""
         try:
-            db = get_db()
+            if not self.vector_index.loaded:
+                self.load_vector_index()
             
-            # Generate query embedding
-            query_embedding = self.generate_embedding(query)
-            query_vec = np.array(query_embedding)
+            metrics = get_metrics()
+            subject_id = int(subject_id) if subject_id else None
+            # Fetch extra candidates from each retriever so fusion has room to re-rank
+            candidates = max(top_k, Config.HYBRID_CANDIDATES) if Config.HYBRID_SEARCH_ENABLED else top_k
             
-            # Optimized query: limit results and use indexes
-            # Only fetch top 200 candidates to reduce data transfer
-            if subject_id:
-                sql = """
-                    SELECT de.id, de.chunk_text, de.page_number, 
-                           de.material_id, de.embedding_vector,
-                           m.title, m.subject_id
-                    FROM document_embeddings de
-                    JOIN materials m ON de.material_id = m.id
-                    WHERE m.subject_id = %s AND m.is_processed = TRUE
-                    ORDER BY de.id DESC
-                    LIMIT 200
-                """
-                embeddings = db.execute_query(sql, (subject_id,))
-            else:
-                sql = """
-                    SELECT de.id, de.chunk_text, de.page_number, 
-                           de.material_id, de.embedding_vector,
-                           m.title, m.subject_id
-                    FROM document_embeddings de
-                    JOIN materials m ON de.material_id = m.id
-                    WHERE m.is_processed = TRUE
-                    ORDER BY de.id DESC
-                    LIMIT 200
-                """
-                embeddings = db.execute_query(sql)
+            if query_vec is None:
+                with metrics.timer('search.embed_seconds'):
+                    query_vec = self.embed_query(query)
             
-            if not embeddings:
-                logger.warning("No embeddings found in database")
-                return []
+            with metrics.timer('search.vector_seconds'):
+                vector_results = self.vector_index.search(query_vec, subject_id, candidates)
             
-            # Vectorized similarity calculation
-            embedding_vectors = []
-            metadata = []
-            
-            for emb in embeddings:
-                try:
-                    stored_embedding = json.loads(emb['embedding_vector'])
-                    if stored_embedding and len(stored_embedding) > 0:
-                        embedding_vectors.append(stored_embedding)
-                        metadata.append({
-                            'chunk_text': emb['chunk_text'],
-                            'page_number': emb['page_number'],
-                            'material_id': emb['material_id'],
-                            'material_title': emb['title']
-                        })
-                except (json.JSONDecodeError, KeyError) as e:
-                    logger.warning(f"Skipping invalid embedding: {e}")
-                    continue
+            if Config.HYBRID_SEARCH_ENABLED:
+                with metrics.timer('search.bm25_seconds'):
+                    keyword_results = self.bm25_index.search(query, subject_id, candidates)
+                
+                with metrics.timer('search.fusion_seconds'):
+                    results = reciprocal_rank_fusion(
+                        [vector_results, keyword_results], top_k, Config.RRF_K
+                    )
+                    # Keyword-only hits rank below every vector candidate, so the
+                    # weakest vector score is an upper bound on their similarity
+                    floor = vector_results[-1]['similarity'] if vector_results else 0.0
+                    for result in results:
+                        result.setdefault('similarity', floor)
+            else:
+                results = vector_results[:top_k]
             
-            if not embedding_vectors:
-                logger.warning("No valid embeddings to search")
+            if not results:
+                logger.warning("No embeddings found in vector index")
                 return []
             
-            # Convert to NumPy array for vectorized operations
-            embedding_matrix = np.array(embedding_vectors)
-            
-            # Vectorized cosine similarity calculation (much faster than loop)
-            # similarity = (A · B) / (||A|| * ||B||)
-            dot_products = np.dot(embedding_matrix, query_vec)
-            query_norm = np.linalg.norm(query_vec)
-            embedding_norms = np.linalg.norm(embedding_matrix, axis=1)
-            similarities = dot_products / (embedding_norms * query_norm)
-            
-            # Get top k indices
-            top_indices = np.argsort(similarities)[::-1][:top_k]
-            
-            # Build results
-            results = []
-            for idx in top_indices:
-                result = metadata[idx].copy()
-                result['similarity'] = float(similarities[idx])
-                results.append(result)
-            
-            logger.info(f"Found {len(results)} similar chunks (searched {len(embeddings)} candidates)")
+            logger.info(f"Found {len(results)} similar chunks (searched {len(self.vector_index)} indexed chunks)")
             return results
             
         except Exception as e:
@@ -178,12 +633,11 @@ class GeminiRAGEngine:
             logger.error(traceback.format_exc())
             return []
     
-    def generate_answer_with_gemini(self, query, context_chunks):
-        """Generate answer using Gemini AI with retrieved context"""
-        try:
-            if not context_chunks:
-                # No context found - alert about missing content
-                prompt = f"""You are a Senior Engineering Professor at TKR College.
+    def build_answer_prompt(self, query, context_chunks):
+        """Build the Gemini prompt for a question; returns (prompt, sources, confidence)"""
+        if not context_chunks:
+            # No context found - alert about missing content
+            prompt = f"""You are a Senior Engineering Professor at TKR College.
 
 Student's Question: {query}
 
@@ -203,27 +657,21 @@ RESPONSE FORMAT:
 ## 📐 Formulas (LaTeX: $$formula$$)
 
 Use markdown, emojis, and clear formatting:"""
-                
-                response = self.gemini_model.generate_content(prompt)
-                return {
-                    'answer': response.text,
-                    'sources': [],
-                    'confidence': 0.3
-                }
-            
-            # Combine context from retrieved chunks with source citations
-            context_parts = []
-            for chunk in context_chunks:
-                source_ref = f"[Ref: {chunk['material_title']}, Page {chunk['page_number']}]"
-                context_parts.append(f"{source_ref}:\n{chunk['chunk_text']}")
-            
-            context = "\n\n---\n\n".join(context_parts)
-            
-            # Calculate average confidence
-            avg_confidence = sum(chunk['similarity'] for chunk in context_chunks) / len(context_chunks)
-            
-            # Create optimized prompt for fast, conversational answers
-            prompt = f"""You are an AI tutor for TKR College students. Answer directly and conversationally using the study materials provided.
+            return prompt, [], 0.3
+        
+        # Combine context from retrieved chunks with source citations
+        context_parts = []
+        for chunk in context_chunks:
+            source_ref = f"[Ref: {chunk['material_title']}, Page {chunk['page_number']}]"
+            context_parts.append(f"{source_ref}:\n{chunk['chunk_text']}")
+        
+        context = "\n\n---\n\n".join(context_parts)
+        
+        # Calculate average confidence
+        avg_confidence = sum(chunk['similarity'] for chunk in context_chunks) / len(context_chunks)
+        
+        # Create optimized prompt for fast, conversational answers
+        prompt = f"""You are an AI tutor for TKR College students. Answer directly and conversationally using the study materials provided.
 
 STUDY MATERIALS:
 {context}
@@ -254,70 +702,187 @@ $$formula$$
 **Referenced from:** [Material names and pages]
 
 Generate a clear, well-formatted answer:"""
+        
+        # Extract sources
+        sources = []
+        for chunk in context_chunks:
+            source_info = {
+                'material': chunk['material_title'],
+                'page': chunk['page_number'],
+                'material_id': chunk['material_id']
+            }
+            if source_info not in sources:
+                sources.append(source_info)
+        
+        return prompt, sources, float(avg_confidence)
+    
+    def generate_answer_with_gemini(self, query, context_chunks):
+        """Generate answer using Gemini AI with retrieved context
+        
+        On failure the result carries 'error': True so it is never cached.
+        """
+        try:
+            prompt, sources, confidence = self.build_answer_prompt(query, context_chunks)
             
             # Generate response with Gemini
             response = self.gemini_model.generate_content(prompt)
             
-            # Extract sources
-            sources = []
-            for chunk in context_chunks:
-                source_info = {
-                    'material': chunk['material_title'],
-                    'page': chunk['page_number'],
-                    'material_id': chunk['material_id']
-                }
-                if source_info not in sources:
-                    sources.append(source_info)
-            
-            return {
+            result = {
                 'answer': response.text,
                 'sources': sources,
-                'confidence': float(avg_confidence),
-                'context_chunks': context_chunks
+                'confidence': confidence
             }
+            if context_chunks:
+                result['context_chunks'] = context_chunks
+            return result
             
         except Exception as e:
             logger.error(f"Gemini answer generation failed: {e}")
             return {
                 'answer': f"I encountered an error while generating the answer: {str(e)}",
                 'sources': [],
-                'confidence': 0.0
+                'confidence': 0.0,
+                'error': True
             }
     
+    def _semantic_cache_lookup(self, question, query_vec, subject_id, top_k):
+        """Look for a cached answer to a paraphrase of the question
+        
+        Returns (cached_result, chunks). A candidate above the similarity
+        threshold is only served if retrieval for the new question still
+        returns mostly the same chunks; otherwise it is counted as a false
+        hit and the freshly retrieved chunks are handed back for reuse.
+        """
+        metrics = get_metrics()
+        entry, similarity = self.semantic_cache.lookup(query_vec, (subject_id, top_k))
+        metrics.observe('semantic_cache.similarity', similarity, SIMILARITY_BUCKETS)
+        
+        if entry is None or similarity < self.semantic_cache.threshold - self.semantic_cache.near_miss_margin:
+            metrics.incr('semantic_cache.misses')
+            return None, None
+        if similarity < self.semantic_cache.threshold:
+            metrics.incr('semantic_cache.near_misses')
+            return None, None
+        
+        chunks = self.search_similar_chunks(question, subject_id, top_k, query_vec)
+        cached_ids = {c.get('chunk_id') for c in entry.get('context_chunks', [])}
+        overlap = chunk_overlap(cached_ids, {c.get('chunk_id') for c in chunks})
+        
+        if overlap >= Config.SEMANTIC_CACHE_MIN_OVERLAP:
+            metrics.incr('semantic_cache.hits')
+            logger.info(f"Semantic cache hit ({similarity:.3f}) for: {question[:50]}")
+            return entry, chunks
+        
+        metrics.incr('semantic_cache.false_hits')
+        logger.info(f"Semantic cache false hit ({similarity:.3f}, overlap {overlap:.2f}) for: {question[:50]}")
+        return None, chunks
+    
+    @staticmethod
+    def _cacheable(result):
+        """Copy of an answer for caching, keeping chunk references but not their text"""
+        cached = dict(result)
+        if 'context_chunks' in cached:
+            cached['context_chunks'] = [
+                {key: value for key, value in chunk.items() if key != 'chunk_text'}
+                for chunk in cached['context_chunks']
+            ]
+        return cached
+    
+    def _lookup_answer(self, question, subject_id, top_k):
+        """Check every cache tier for an answer
+        
+        Returns (cache_key, query_vec, cached_result, similar_chunks); the
+        last two are None on a miss, although chunks retrieved for a
+        semantic-cache check are handed back for reuse.
+        """
+        # Check cache first
+        generation = self._cache_generation(subject_id)
+        cache_key = (question.lower().strip(), subject_id, top_k, generation)
+        if generation is None:
+            # Without the generation no tier can tell stale answers apart
+            return cache_key, None, None, None
+        cached_result = self.answer_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info(f"Returning cached answer for: {question[:50]}")
+            return cache_key, None, cached_result, None
+        
+        # Then the tier shared with other workers
+        if self.shared_cache is not None:
+            cached_result = self.shared_cache.get(cache_key)
+            if cached_result is not None:
+                get_metrics().incr('shared_cache.hits')
+                logger.info(f"Returning shared cached answer for: {question[:50]}")
+                self.answer_cache.put(cache_key, cached_result)
+                return cache_key, None, cached_result, None
+            get_metrics().incr('shared_cache.misses')
+        
+        # Check for a cached answer to an equivalent question
+        query_vec = None
+        similar_chunks = None
+        if Config.SEMANTIC_CACHE_ENABLED:
+            query_vec = normalize_rows(self.embed_query(question))[0]
+            cached_result, similar_chunks = self._semantic_cache_lookup(
+                question, query_vec, subject_id, top_k
+            )
+        return cache_key, query_vec, cached_result, similar_chunks
+    
+    def _store_answer(self, cache_key, query_vec, result):
+        """Cache a fresh answer in every tier, without the bulky chunk text
+        
+        Failed generations are skipped so a transient LLM error is not
+        served from the caches afterwards.
+        """
+        if result.get('error') or not result.get('answer'):
+            get_metrics().incr('answer_cache.uncached_failures')
+            return
+        _, subject_id, top_k, generation = cache_key
+        if generation is None:
+            return
+        cached = self._cacheable(result)
+        self.answer_cache.put(cache_key, cached)
+        if self.shared_cache is not None:
+            self.shared_cache.put(cache_key, subject_id, cached)
+        if query_vec is not None:
+            self.semantic_cache.store(query_vec, (subject_id, top_k), cached)
+    
     def answer_question(self, question, subject_id=None, top_k=5):
         """Complete RAG pipeline: retrieve and generate answer with Gemini (with caching)"""
         try:
-            # Create cache key
-            cache_key = f"{question.lower().strip()}_{subject_id}_{top_k}"
-            
-            # Check cache first
-            if hasattr(self, '_answer_cache') and cache_key in self._answer_cache:
-                cached_result, cache_time = self._answer_cache[cache_key]
-                # Cache valid for 5 minutes
-                if (time.time() - cache_time) < 300:
-                    logger.info(f"Returning cached answer for: {question[:50]}")
-                    return cached_result
-            
-            # Search for relevant chunks
-            similar_chunks = self.search_similar_chunks(question, subject_id, top_k)
-            
-            # Generate answer using Gemini
-            result = self.generate_answer_with_gemini(question, similar_chunks)
-            
-            # Cache the result
-            if not hasattr(self, '_answer_cache'):
-                self._answer_cache = {}
-            
-            # Limit cache size to 100 entries
-            if len(self._answer_cache) > 100:
-                # Remove oldest entries
-                oldest_keys = sorted(self._answer_cache.keys(), 
-                                   key=lambda k: self._answer_cache[k][1])[:20]
-                for key in oldest_keys:
-                    del self._answer_cache[key]
-            
-            self._answer_cache[cache_key] = (result, time.time())
-            
+            subject_id = int(subject_id) if subject_id else None
+            cache_key, query_vec, cached_result, similar_chunks = self._lookup_answer(
+                question, subject_id, top_k
+            )
+            if cached_result is not None:
+                return cached_result
+            
+            chunk_ids = None
+            if query_vec is not None:
+                # Retrieve up front so a paraphrase only joins an in-flight
+                # answer built from mostly the same chunks
+                if similar_chunks is None:
+                    similar_chunks = self.search_similar_chunks(question, subject_id, top_k, query_vec)
+                chunk_ids = {c.get('chunk_id') for c in similar_chunks}
+            
+            def compute():
+                chunks = similar_chunks
+                # Search for relevant chunks
+                if chunks is None:
+                    chunks = self.search_similar_chunks(question, subject_id, top_k, query_vec)
+                
+                # Generate answer using Gemini
+                result = self.generate_answer_with_gemini(question, chunks)
+                self._store_answer(cache_key, query_vec, result)
+                return result
+            
+            # Identical questions already being answered share that answer
+            result, shared = self.inflight.do(
+                cache_key, compute, vector=query_vec, scope=(subject_id, top_k), chunk_ids=chunk_ids
+            )
+            metrics = get_metrics()
+            metrics.incr('single_flight.followers' if shared else 'single_flight.leaders')
+            metrics.set_gauge('single_flight.coalescing_ratio', self.inflight.stats()['coalescing_ratio'])
+            if shared:
+                logger.info(f"Coalesced with in-flight answer for: {question[:50]}")
             return result
             
         except Exception as e:
@@ -327,13 +892,103 @@ Generate a clear, well-formatted answer:"""
                 'sources': [],
                 'confidence': 0.0
             }
+    
+    def stream_answer(self, question, subject_id=None, top_k=5):
+        """Answer a question as a stream of (event, data) pairs
+        
+        Yields ('sources', {...}) as soon as retrieval is done, then one
+        ('token', text) per streamed piece of the answer and finally
+        ('done', result). Cached answers are sent as a single token. On
+        failure an ('error', {...}) event ends the stream and nothing is
+        cached.
+        """
+        metrics = get_metrics()
+        start_time = time.perf_counter()
+        try:
+            subject_id = int(subject_id) if subject_id else None
+            cache_key, query_vec, cached_result, similar_chunks = self._lookup_answer(
+                question, subject_id, top_k
+            )
+            if cached_result is not None:
+                yield 'sources', {
+                    'sources': cached_result.get('sources', []),
+                    'confidence': cached_result.get('confidence', 0)
+                }
+                yield 'token', cached_result['answer']
+                yield 'done', cached_result
+                return
+            
+            if similar_chunks is None:
+                similar_chunks = self.search_similar_chunks(question, subject_id, top_k, query_vec)
+            prompt, sources, confidence = self.build_answer_prompt(question, similar_chunks)
+            yield 'sources', {'sources': sources, 'confidence': confidence}
+            
+            parts = []
+            for chunk in self.gemini_model.generate_content(prompt, stream=True):
+                text = chunk.text
+                if not text:
+                    continue
+                if not parts:
+                    metrics.observe('chat.stream.first_token_seconds', time.perf_counter() - start_time)
+                parts.append(text)
+                yield 'token', text
+            
+            result = {'answer': ''.join(parts), 'sources': sources, 'confidence': confidence}
+            if similar_chunks:
+                result['context_chunks'] = similar_chunks
+            self._store_answer(cache_key, query_vec, result)
+            metrics.observe('chat.stream.total_seconds', time.perf_counter() - start_time)
+            yield 'done', result
+            
+        except Exception as e:
+            logger.error(f"Streaming answer failed: {e}")
+            yield 'error', {'error': "An error occurred while generating the answer. Please try again."}
 
 # Global Gemini RAG engine instance
 gemini_rag_engine = None
+engine_loader = None
+_engine_lock = threading.Lock()
 
 def get_gemini_rag_engine():
-    """Get or create Gemini RAG engine instance"""
+    """Get or create Gemini RAG engine instance (waits for a background load in progress)"""
     global gemini_rag_engine
-    if gemini_rag_engine is None:
-        gemini_rag_engine = GeminiRAGEngine()
+    if engine_loader is not None:
+        return engine_loader.wait()
+    with _engine_lock:
+        if gemini_rag_engine is None:
+            gemini_rag_engine = GeminiRAGEngine()
     return gemini_rag_engine
+
+def start_engine_loader():
+    """Build the global engine on a background thread, then warm it up
+    
+    The loader then polls for a newly activated embedding version and
+    swaps in an engine built for it, and indexes materials reembed.py
+    re-embedded into the serving version after the switch.
+    """
+    global engine_loader
+    
+    def build(mark):
+        global gemini_rag_engine
+        engine = GeminiRAGEngine(progress=mark)
+        engine.warm_up()
+        mark('warmup')
+        gemini_rag_engine = engine
+        return engine
+    
+    def needs_rebuild(engine):
+        # Rows reembed.py re-embedded after the switch only need indexing, not a rebuild
+        engine.index_caught_up_materials()
+        return engine.embedding_version_changed()
+    
+    with _engine_lock:
+        if engine_loader is None:
+            engine_loader = EngineLoader(['embedding_model', 'vector_index', 'llm', 'warmup'])
+            engine_loader.start(build)
+            engine_loader.watch(
+                needs_rebuild,
+                build,
+                Config.EMBEDDING_VERSION_POLL_SECONDS,
+                retire=lambda engine: engine.close()
+            )
+    return engine_loader
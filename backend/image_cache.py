@@ -0,0 +1,154 @@
+"""
+Rendered-image disk cache for TKR Chatbot
+PDF images are rendered on first request and kept as PNG files, evicting the least recently used
+"""
+import os
+import uuid
+import threading
+import logging
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Eviction frees space down to this fraction of the limit so it does not run on every render
+EVICT_TO = 0.9
+
+
+class ImageCache:
+    """Directory of rendered PNGs bounded to max_bytes, with LRU eviction by mtime
+
+    A hit touches the file's mtime; concurrent requests for the same
+    missing image share one render. Files are written under a temporary
+    name and renamed, so readers never see a partial PNG.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.inflight = SingleFlight()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'render_errors': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(size for _, _, size in self._entries())
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _entries(self):
+        """(path, mtime, size) of every cached PNG"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.png'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, key, render):
+        """Path of the PNG for key, calling render() for a PIL image on a miss"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+            with self._lock:
+                self._stats['hits'] += 1
+            return path
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._stats['misses'] += 1
+        result, _ = self.inflight.do(key, lambda: self._render(path, render))
+        return result
+
+    def _render(self, path, render):
+        if os.path.exists(path):
+            return path  # another process rendered it meanwhile
+        try:
+            image = render()
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA', '1', 'P'):
+                image = image.convert('RGB')
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            image.save(temp_path, 'PNG')
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except Exception:
+            with self._lock:
+                self._stats['render_errors'] += 1
+            raise
+        with self._lock:
+            self._bytes += size
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict()
+        return path
+
+    def _evict(self):
+        """Delete the least recently used files until the cache is under EVICT_TO of its limit"""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        for path, _, size in entries:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._bytes = total
+            self._stats['evictions'] += evicted
+        if evicted:
+            logger.info(f"Evicted {evicted} rendered images ({total / 1e6:.1f} MB left)")
+
+    def remove_prefix(self, prefix):
+        """Drop every cached image whose key starts with prefix"""
+        removed = 0
+        for path, _, size in self._entries():
+            if not os.path.basename(path).startswith(prefix):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            with self._lock:
+                self._bytes -= size
+        return removed
+
+    def stats(self):
+        """Return hit/miss/eviction counters plus current size"""
+        with self._lock:
+            stats = dict(self._stats)
+            size = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hit_rate': stats['hits'] / lookups if lookups else 0.0
+        })
+        return stats
+
+
+def image_key(image, thumbnail=False):
+    """Cache key of an extracted_images row; prefixed by material so deletes can drop them together"""
+    return f"m{image['material_id']}_i{image['id']}_{'thumb' if thumbnail else 'full'}"
+
+
+def render_extracted_image(image, pdf_path, pdf_processor, thumbnail_px, thumbnail=False):
+    """PIL image for an extracted_images row, rendered from the PDF or the saved file"""
+    from PIL import Image
+    if image['source'] == 'file':
+        rendered = Image.open(image['image_path'])
+        rendered.load()
+    else:
+        rendered = pdf_processor.render_image(
+            pdf_path, image['page_number'], image['source'], image['bbox'], image['xref']
+        )
+    if thumbnail:
+        rendered.thumbnail((thumbnail_px, thumbnail_px))
+    return rendered
@@ -0,0 +1,292 @@
+"""
+Background ingestion queue for TKR Chatbot
+Worker threads claim jobs from the ingest_jobs table and run the PDF -> chunks -> embeddings pipeline
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+from config import Config
+from models import Material, IngestJob, IngestJobSuperseded, ExtractedImage, MaterialPage
+from database import get_db
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Pages are parsed, chunked, embedded and stored as one stream up to this progress
+PROCESSING_PROGRESS = 0.95
+
+# Minimum seconds between progress writes within one stage
+PROGRESS_INTERVAL = 1.0
+
+# Parsed page texts are written in batches of this many pages
+PAGE_TEXT_BATCH = 50
+
+
+def clear_partial_ingest(material, engine=None):
+    """Remove rows (and, given the engine, vectors) left behind by an earlier failed attempt"""
+    db = get_db()
+    db.execute_query("DELETE FROM extracted_images WHERE material_id = %s", (material['id'],), fetch=False)
+    db.execute_query("DELETE FROM material_pages WHERE material_id = %s", (material['id'],), fetch=False)
+    db.execute_query("DELETE FROM document_embeddings WHERE material_id = %s", (material['id'],), fetch=False)
+    if engine is not None:
+        engine.remove_material(material['id'], material['subject_id'])
+
+
+def copy_material_content(source_id, material_id):
+    """Copy the chunks, vectors (of every embedding version), page texts and images of one material to another"""
+    db = get_db()
+    db.execute_query("""
+        INSERT INTO document_embeddings
+        (material_id, chunk_text, chunk_index, page_number, embedding_vector, text_hash, embedding_version)
+        SELECT %s, chunk_text, chunk_index, page_number, embedding_vector, text_hash, embedding_version
+        FROM document_embeddings WHERE material_id = %s
+        ORDER BY embedding_version, chunk_index
+    """, (material_id, source_id), fetch=False)
+    db.execute_query("""
+        INSERT INTO material_pages (material_id, page_number, page_text)
+        SELECT %s, page_number, page_text FROM material_pages WHERE material_id = %s
+    """, (material_id, source_id), fetch=False)
+    db.execute_query("""
+        INSERT INTO extracted_images
+        (material_id, image_path, page_number, image_type, caption, source, bbox, xref)
+        SELECT %s, image_path, page_number, image_type, caption, source, bbox, xref
+        FROM extracted_images WHERE material_id = %s
+        ORDER BY id
+    """, (material_id, source_id), fetch=False)
+
+
+def reuse_duplicate(material, source, engine, report):
+    """Copy the work of an identical processed material instead of parsing, and index it"""
+    report('processing', 0.0)
+    copy_material_content(source['id'], material['id'])
+    report('processing', PROCESSING_PROGRESS / 2)
+    return engine.index_stored_material(material['id'])
+
+
+def ingest_material(material, engine, pdf_processor, report, retry=False):
+    """Run the ingestion pipeline for one material, calling report(stage, progress) as it goes
+
+    Returns {'chunks_total', 'chunks_reused', 'reused_from'} for the job record.
+    """
+    material_id = material['id']
+    file_path = material['file_path']
+    if retry:
+        clear_partial_ingest(material, engine)
+
+    source = None
+    if Config.UPLOAD_DEDUP_ENABLED and material.get('content_hash'):
+        source = Material.find_processed_duplicate(material['content_hash'], material_id)
+    if source is not None:
+        chunk_count = reuse_duplicate(material, source, engine, report)
+        report('finalizing', PROCESSING_PROGRESS)
+        Material.mark_processed(material_id)
+        engine.invalidate_subject(material['subject_id'])
+        logger.info(f"Ingested material {material_id} as a copy of material {source['id']}: {chunk_count} chunks reused")
+        return {'chunks_total': chunk_count, 'chunks_reused': chunk_count, 'reused_from': source['id']}
+
+    pages_done = 0
+    image_count = 0
+    page_texts = []
+
+    def on_page(page_num, page_count, text, page_images):
+        # Images and page text are recorded as their page is parsed; chunks flow on to be embedded.
+        # Reporting first stops a superseded worker before it writes anything for the page.
+        nonlocal pages_done, image_count, page_texts
+        pages_done += 1
+        report('processing', PROCESSING_PROGRESS * pages_done / max(page_count, 1))
+        for img in page_images:
+            ExtractedImage.create(
+                material_id, img['path'], img['page'], img['type'], None,
+                img['source'], img.get('bbox'), img.get('xref')
+            )
+        image_count += len(page_images)
+        if text:
+            page_texts.append((page_num, text))
+        if len(page_texts) >= PAGE_TEXT_BATCH:
+            MaterialPage.create_many(material_id, page_texts)
+            page_texts = []
+
+    report('processing', 0.0)
+    stored = engine.store_embeddings(
+        material_id,
+        pdf_processor.iter_chunks(file_path, material_id, on_page=on_page)
+    )
+    if page_texts:
+        MaterialPage.create_many(material_id, page_texts)
+
+    report('finalizing', PROCESSING_PROGRESS)
+    Material.mark_processed(material_id)
+
+    # New material changes the answers for this subject
+    engine.invalidate_subject(material['subject_id'])
+    logger.info(f"Ingested material {material_id}: {pages_done} pages, {stored['chunks']} chunks "
+                f"({stored['cached']} cached embeddings), {image_count} images")
+    return {'chunks_total': stored['chunks'], 'chunks_reused': stored['cached'], 'reused_from': None}
+
+
+class IngestWorkerPool:
+    """Pool of threads that claim queued ingest jobs and run them
+
+    handler(job, material, report) does the work and may return keyword
+    arguments for IngestJob.mark_done; an exception marks the job failed
+    with its message so it can be retried. Jobs are claimed
+    through the database, so pools in several processes can share a queue.
+
+    While a job runs, a timer sends a heartbeat every heartbeat_interval
+    seconds regardless of progress. If the job was re-queued meanwhile
+    (no heartbeat landed for stale_seconds) and claimed again, the next
+    report() raises IngestJobSuperseded and this worker writes nothing
+    more for it.
+    """
+
+    def __init__(self, handler, workers=2, poll_interval=2.0, stale_seconds=600, heartbeat_interval=30.0):
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.heartbeat_interval = min(heartbeat_interval, stale_seconds / 4)
+        self._wakeup = threading.Condition()
+        self._pending_wakeups = 0
+        self._stopping = False
+        self._threads = []
+        self._active = 0
+        self._lock = threading.Lock()
+        self._token_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        """Start the worker threads (only the first call has any effect)"""
+        with self._lock:
+            if self._threads:
+                return self
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(index,), name=f'ingest-worker-{index}', daemon=True)
+                self._threads.append(thread)
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Started {self.workers} ingestion workers")
+        return self
+
+    def notify(self):
+        """Wake an idle worker after a job was queued (instead of waiting for the next poll)"""
+        with self._wakeup:
+            self._pending_wakeups += 1
+            self._wakeup.notify()
+
+    def stop(self, timeout=None):
+        """Stop after the current jobs finish"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _idle(self):
+        with self._wakeup:
+            if not self._pending_wakeups and not self._stopping:
+                self._wakeup.wait(self.poll_interval)
+            self._pending_wakeups = max(self._pending_wakeups - 1, 0)
+
+    def _run(self, index):
+        token = f"{self._token_prefix}:{index}:{uuid.uuid4().hex[:8]}"
+        last_stale_check = 0.0
+        while not self._stopping:
+            try:
+                # Worker 0 recovers jobs orphaned by a crashed process
+                if index == 0 and time.time() - last_stale_check > min(self.stale_seconds, 60):
+                    IngestJob.requeue_stale(self.stale_seconds)
+                    last_stale_check = time.time()
+                job = IngestJob.claim(token)
+            except Exception as e:
+                logger.error(f"Ingestion worker {index} could not poll the queue: {e}")
+                job = None
+            if job is None:
+                self._idle()
+                continue
+            self._process(job)
+
+    def _heartbeat(self, job, claim, finished, superseded):
+        """Timer thread: keep a running job's heartbeat fresh until it finishes"""
+        while not finished.wait(self.heartbeat_interval):
+            try:
+                if not IngestJob.heartbeat(job['id'], claim):
+                    logger.warning(f"Ingest job {job['id']} was claimed by another worker; abandoning it")
+                    superseded.set()
+                    return
+            except Exception as e:
+                logger.warning(f"Could not send heartbeat for ingest job {job['id']}: {e}")
+
+    def _process(self, job):
+        metrics = get_metrics()
+        last = {'stage': None, 'at': 0.0}
+        claim = (job['claimed_by'], job['attempts'])
+        finished = threading.Event()
+        superseded = threading.Event()
+
+        def report(stage, progress):
+            if superseded.is_set():
+                raise IngestJobSuperseded(f"Ingest job {job['id']} attempt {job['attempts']} was superseded")
+            now = time.time()
+            if stage == last['stage'] and now - last['at'] < PROGRESS_INTERVAL:
+                return
+            last['stage'], last['at'] = stage, now
+            try:
+                IngestJob.update_progress(job['id'], stage, round(progress, 3), claim=claim)
+            except Exception as e:
+                logger.warning(f"Could not record progress for ingest job {job['id']}: {e}")
+
+        threading.Thread(
+            target=self._heartbeat, args=(job, claim, finished, superseded),
+            name=f"ingest-heartbeat-{job['id']}", daemon=True
+        ).start()
+        with self._lock:
+            self._active += 1
+        start_time = time.time()
+        try:
+            logger.info(f"Ingest job {job['id']} started for material {job['material_id']} (attempt {job['attempts']})")
+            material = Material.get_by_id(job['material_id'])
+            if material is None:
+                raise ValueError(f"Material {job['material_id']} no longer exists")
+            result = self.handler(job, material, report)
+            IngestJob.mark_done(job['id'], **(result or {}), claim=claim)
+            metrics.incr('ingest.jobs_done')
+            metrics.observe('ingest.job_seconds', time.time() - start_time)
+        except IngestJobSuperseded as e:
+            # The job belongs to its new claim now; leave its rows and status alone
+            logger.warning(str(e))
+            metrics.incr('ingest.jobs_superseded')
+        except Exception as e:
+            logger.error(f"Ingest job {job['id']} failed: {e}")
+            metrics.incr('ingest.jobs_failed')
+            try:
+                IngestJob.mark_failed(job['id'], str(e) or e.__class__.__name__, claim=claim)
+            except Exception as record_error:
+                logger.error(f"Could not mark ingest job {job['id']} failed: {record_error}")
+        finally:
+            finished.set()
+            with self._lock:
+                self._active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'workers': len(self._threads), 'active': self._active}
+
+
+def create_worker_pool(get_engine, pdf_processor, workers=None):
+    """Build a pool that ingests with the engine returned by get_engine() (waited for per job)"""
+    def handler(job, material, report):
+        engine = get_engine()
+        if engine is None:
+            raise RuntimeError("RAG engine failed to load")
+        return ingest_material(material, engine, pdf_processor, report, retry=job['attempts'] > 1)
+
+    return IngestWorkerPool(
+        handler,
+        workers=Config.INGEST_WORKERS if workers is None else workers,
+        poll_interval=Config.INGEST_POLL_SECONDS,
+        stale_seconds=Config.INGEST_STALE_SECONDS,
+        heartbeat_interval=Config.INGEST_HEARTBEAT_SECONDS
+    )
+
@@ -0,0 +1,99 @@
+"""
+Lightweight in-process metrics for TKR Chatbot
+Counters, gauges and histograms exposed through /api/metrics
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with count/sum/min/max"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'min': self.min,
+            'max': self.max,
+            'buckets': {str(bound): n for bound, n in zip(self.buckets, self.bucket_counts)}
+        }
+
+
+class Metrics:
+    """Thread-safe registry of named counters, gauges and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def incr(self, name, value=1):
+        """Increase a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Record the latest value of a gauge"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        """Add a sample to a histogram (buckets are fixed on first use)"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Observe the wall-clock duration of a block, in seconds"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time)
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def snapshot(self):
+        """Return every metric as plain JSON-serializable data"""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': {name: h.snapshot() for name, h in self._histograms.items()}
+            }
+
+
+# Global metrics registry
+metrics = Metrics()
+
+
+def get_metrics():
+    """Get metrics registry"""
+    return metrics
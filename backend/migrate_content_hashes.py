@@ -0,0 +1,108 @@
+"""
+Database migration script for content-addressed dedup
+Adds materials.content_hash, document_embeddings.text_hash and the ingest_jobs reuse columns, then backfills the hashes
+
+Safe to re-run; only rows without a hash are processed.
+"""
+import argparse
+import os
+import time
+from database import get_db
+from content_hash import file_sha256, text_hash
+
+COLUMNS = [
+    ('materials', 'content_hash', "ALTER TABLE materials ADD COLUMN content_hash CHAR(64), "
+                                  "ADD INDEX idx_content_hash (content_hash)"),
+    ('document_embeddings', 'text_hash', "ALTER TABLE document_embeddings ADD COLUMN text_hash CHAR(64), "
+                                         "ADD INDEX idx_text_hash (text_hash)"),
+    ('ingest_jobs', 'reused_from', "ALTER TABLE ingest_jobs ADD COLUMN reused_from INT NULL, "
+                                   "ADD COLUMN chunks_total INT DEFAULT 0, ADD COLUMN chunks_reused INT DEFAULT 0"),
+]
+
+
+def has_column(db, table, column):
+    rows = db.execute_query("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return bool(rows)
+
+
+def has_table(db, table):
+    rows = db.execute_query("""
+        SELECT 1 FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return bool(rows)
+
+
+def backfill_material_hashes(db):
+    """Hash every uploaded file that is still on disk"""
+    rows = db.execute_query("SELECT id, file_path FROM materials WHERE content_hash IS NULL")
+    hashed = 0
+    for row in rows:
+        if not row['file_path'] or not os.path.exists(row['file_path']):
+            print(f"  ⚠ material {row['id']}: file missing, skipped")
+            continue
+        db.execute_query(
+            "UPDATE materials SET content_hash = %s WHERE id = %s",
+            (file_sha256(row['file_path']), row['id']),
+            fetch=False
+        )
+        hashed += 1
+    print(f"✓ Hashed {hashed} of {len(rows)} material files")
+
+
+def backfill_text_hashes(db, batch_size):
+    """Hash the normalized text of every stored chunk"""
+    total = db.execute_query(
+        "SELECT COUNT(*) AS n FROM document_embeddings WHERE text_hash IS NULL"
+    )[0]['n']
+    print(f"Hashing {total} chunks (batch size {batch_size})...")
+
+    done = 0
+    last_id = 0
+    start_time = time.time()
+    while True:
+        rows = db.execute_query("""
+            SELECT id, chunk_text FROM document_embeddings
+            WHERE id > %s AND text_hash IS NULL
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, batch_size))
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        db.execute_many(
+            "UPDATE document_embeddings SET text_hash = %s WHERE id = %s",
+            [(text_hash(row['chunk_text']), row['id']) for row in rows]
+        )
+        done += len(rows)
+        elapsed = time.time() - start_time
+        print(f"  {done}/{total} hashed ({done / max(elapsed, 1e-6):.0f} rows/s)")
+    print(f"✓ Hashed {done} chunks")
+
+
+def migrate_content_hashes(batch_size=1000):
+    db = get_db()
+    for table, column, ddl in COLUMNS:
+        if not has_table(db, table):
+            print(f"  ⚠ {table} does not exist yet (create_ingest_tables.py creates it with these columns)")
+        elif has_column(db, table, column):
+            print(f"✓ {table}.{column} already exists")
+        else:
+            print(f"Adding {table}.{column}...")
+            db.execute_query(ddl, fetch=False)
+            print(f"✓ {table}.{column} added")
+
+    backfill_material_hashes(db)
+    backfill_text_hashes(db, batch_size)
+    print("\n✅ Content hashes ready; duplicate uploads and repeated chunks will be reused")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add and backfill content hashes for upload/chunk dedup")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    migrate_content_hashes(args.batch_size)
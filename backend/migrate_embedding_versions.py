@@ -0,0 +1,120 @@
+"""
+Database migration script for versioned embeddings and the parsed-text cache
+Adds document_embeddings.embedding_version, the embedding_versions and material_pages tables,
+and records the current vectors as version 1 of EMBEDDING_MODEL
+
+--backfill-pages re-parses the text (no images) of processed materials still on disk, so they
+can later be re-chunked without parsing. Safe to re-run.
+Usage: python migrate_embedding_versions.py [--backfill-pages]
+"""
+import argparse
+import os
+from config import Config
+from database import get_db
+from models import EmbeddingVersion, MaterialPage
+from migrate_content_hashes import has_column, has_table
+from build_ann_index import detect_dimension
+
+TABLES = {
+    'embedding_versions': """
+        CREATE TABLE IF NOT EXISTS embedding_versions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            model_name VARCHAR(200) NOT NULL,
+            dimension INT,
+            status ENUM('building', 'active', 'retired', 'failed') DEFAULT 'building',
+            chunks_done INT DEFAULT 0,
+            chunks_total INT DEFAULT 0,
+            error TEXT,
+            catch_up_generation INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            activated_at TIMESTAMP NULL,
+            INDEX idx_status (status)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+    'material_pages': """
+        CREATE TABLE IF NOT EXISTS material_pages (
+            material_id INT NOT NULL,
+            page_number INT NOT NULL,
+            page_text MEDIUMTEXT NOT NULL,
+            PRIMARY KEY (material_id, page_number),
+            FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+}
+
+
+def backfill_pages(db):
+    """Store the page texts of processed materials that have none yet"""
+    from pdf_processor import PDFProcessor
+
+    rows = db.execute_query("""
+        SELECT m.id, m.file_path FROM materials m
+        WHERE m.is_processed = TRUE
+          AND NOT EXISTS (SELECT 1 FROM material_pages p WHERE p.material_id = m.id)
+        ORDER BY m.id
+    """)
+    processor = PDFProcessor()
+    stored = 0
+    try:
+        for row in rows:
+            if not row['file_path'] or not os.path.exists(row['file_path']):
+                print(f"  ⚠ material {row['id']}: file missing, skipped")
+                continue
+            pages = [
+                (page_num, text)
+                for page_num, _, text, _ in processor.iter_pages(row['file_path'], row['id'], with_images=False)
+                if text
+            ]
+            if pages:
+                MaterialPage.create_many(row['id'], pages)
+            stored += 1
+            print(f"  ✓ material {row['id']}: {len(pages)} pages")
+    finally:
+        processor.close()
+    print(f"✓ Stored page texts of {stored} of {len(rows)} materials")
+
+
+def migrate_embedding_versions(pages=False):
+    db = get_db()
+    for table, ddl in TABLES.items():
+        if has_table(db, table):
+            print(f"✓ {table} already exists")
+        else:
+            db.execute_query(ddl, fetch=False)
+            print(f"✓ {table} created")
+
+    if has_column(db, 'document_embeddings', 'embedding_version'):
+        print("✓ document_embeddings.embedding_version already exists")
+    else:
+        print("Adding document_embeddings.embedding_version (existing vectors become version 1)...")
+        db.execute_query("""
+            ALTER TABLE document_embeddings
+            ADD COLUMN embedding_version INT NOT NULL DEFAULT 1,
+            ADD INDEX idx_version_material (embedding_version, material_id)
+        """, fetch=False)
+        print("✓ document_embeddings.embedding_version added")
+
+    if has_column(db, 'embedding_versions', 'catch_up_generation'):
+        print("✓ embedding_versions.catch_up_generation already exists")
+    else:
+        db.execute_query(
+            "ALTER TABLE embedding_versions ADD COLUMN catch_up_generation INT NOT NULL DEFAULT 0",
+            fetch=False
+        )
+        print("✓ embedding_versions.catch_up_generation added")
+
+    active = EmbeddingVersion.ensure_active(Config.EMBEDDING_MODEL, detect_dimension(db))
+    print(f"✓ Active embedding version: {active['id']} ({active['model_name']}, {active['dimension'] or '?'} dims)")
+
+    if pages:
+        backfill_pages(db)
+    print("\n✅ Embedding versions ready; run reembed.py to migrate to another model")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add embedding versions and the parsed-text cache")
+    parser.add_argument('--backfill-pages', action='store_true',
+                        help="parse the text of already processed materials into material_pages")
+    args = parser.parse_args()
+
+    migrate_embedding_versions(args.backfill_pages)
@@ -0,0 +1,91 @@
+"""
+Database migration script for binary embedding storage
+Converts document_embeddings.embedding_vector from JSON text to packed float32/float16 BLOBs
+
+Stop the backend before running this; it is safe to re-run after an interruption.
+"""
+import argparse
+import json
+import time
+from config import Config
+from database import get_db
+from embedding_codec import pack_embedding
+
+
+def get_column_type(db, column):
+    """Return the MySQL data type of a document_embeddings column (or None)"""
+    rows = db.execute_query("""
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'document_embeddings'
+          AND COLUMN_NAME = %s
+    """, (column,))
+    return rows[0]['DATA_TYPE'].lower() if rows else None
+
+
+def migrate_embeddings(batch_size=1000, dtype='float32'):
+    """Convert every JSON embedding to the binary format in batches"""
+    db = get_db()
+
+    vector_type = get_column_type(db, 'embedding_vector')
+    if vector_type is None:
+        raise RuntimeError("document_embeddings.embedding_vector not found")
+    if vector_type.endswith('blob'):
+        print("✓ embedding_vector already uses binary storage, nothing to do")
+        return
+
+    if get_column_type(db, 'embedding_blob') is None:
+        print("Adding temporary embedding_blob column...")
+        db.execute_query(
+            "ALTER TABLE document_embeddings ADD COLUMN embedding_blob BLOB NULL",
+            fetch=False
+        )
+
+    total = db.execute_query(
+        "SELECT COUNT(*) AS n FROM document_embeddings WHERE embedding_blob IS NULL"
+    )[0]['n']
+    print(f"Converting {total} embeddings to {dtype} (batch size {batch_size})...")
+
+    converted = 0
+    last_id = 0
+    start_time = time.time()
+    while True:
+        rows = db.execute_query("""
+            SELECT id, embedding_vector FROM document_embeddings
+            WHERE id > %s AND embedding_blob IS NULL
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, batch_size))
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+
+        updates = [
+            (pack_embedding(json.loads(row['embedding_vector']), dtype), row['id'])
+            for row in rows
+        ]
+        db.execute_many(
+            "UPDATE document_embeddings SET embedding_blob = %s WHERE id = %s",
+            updates
+        )
+        converted += len(updates)
+        elapsed = time.time() - start_time
+        print(f"  {converted}/{total} converted ({converted / max(elapsed, 1e-6):.0f} rows/s)")
+
+    print("Replacing JSON column with binary column...")
+    db.execute_query("""
+        ALTER TABLE document_embeddings
+        DROP COLUMN embedding_vector,
+        CHANGE COLUMN embedding_blob embedding_vector BLOB NOT NULL
+    """, fetch=False)
+
+    print(f"\n✅ Migrated {converted} embeddings in {time.time() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON embeddings to binary storage")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default=Config.EMBEDDING_STORAGE_DTYPE)
+    args = parser.parse_args()
+
+    migrate_embeddings(args.batch_size, args.dtype)
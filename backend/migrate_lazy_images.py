@@ -0,0 +1,29 @@
+"""
+Database migration script for on-demand image rendering
+Adds extracted_images.source, bbox and xref; existing rows keep source 'file' and their rendered PNGs
+
+Safe to re-run.
+Usage: python migrate_lazy_images.py
+"""
+from database import get_db
+from migrate_content_hashes import has_column
+
+
+def migrate_lazy_images():
+    db = get_db()
+    if has_column(db, 'extracted_images', 'source'):
+        print("✓ extracted_images.source already exists")
+    else:
+        print("Adding extracted_images.source, bbox and xref...")
+        db.execute_query("""
+            ALTER TABLE extracted_images
+            ADD COLUMN source ENUM('file', 'crop', 'embedded') DEFAULT 'file',
+            ADD COLUMN bbox VARCHAR(100),
+            ADD COLUMN xref INT
+        """, fetch=False)
+        print("✓ extracted_images columns added")
+    print("\n✅ New uploads record image positions; images render on first view (LAZY_IMAGES)")
+
+
+if __name__ == "__main__":
+    migrate_lazy_images()
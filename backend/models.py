@@ -43,14 +43,53 @@ class Material:
     """Study material model"""
     
     @staticmethod
-    def create(subject_id, title, description, file_path, file_type, file_size):
+    def create(subject_id, title, description, file_path, file_type, file_size, content_hash=None):
         """Create new material"""
         db = get_db()
         query = """
-            INSERT INTO materials (subject_id, title, description, file_path, file_type, file_size)
-            VALUES (%s, %s, %s, %s, %s, %s)
+            INSERT INTO materials (subject_id, title, description, file_path, file_type, file_size, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
         """
-        return db.execute_query(query, (subject_id, title, description, file_path, file_type, file_size), fetch=False)
+        return db.execute_query(
+            query, (subject_id, title, description, file_path, file_type, file_size, content_hash), fetch=False
+        )
+    
+    @staticmethod
+    def find_processed_duplicate(content_hash, exclude_id=None):
+        """Get the oldest processed material with the same file content"""
+        db = get_db()
+        query = """
+            SELECT * FROM materials
+            WHERE content_hash = %s AND is_processed = TRUE AND id != %s
+            ORDER BY id
+            LIMIT 1
+        """
+        results = db.execute_query(query, (content_hash, exclude_id or 0))
+        return results[0] if results else None
+    
+    @staticmethod
+    def find_by_hash(content_hash, subject_id):
+        """Get the newest material of a subject with the given file content"""
+        db = get_db()
+        query = """
+            SELECT * FROM materials
+            WHERE content_hash = %s AND subject_id = %s
+            ORDER BY id DESC
+            LIMIT 1
+        """
+        results = db.execute_query(query, (content_hash, subject_id))
+        return results[0] if results else None
+    
+    @staticmethod
+    def get_content_counts(material_id):
+        """Number of stored chunks and extracted images of a material"""
+        db = get_db()
+        query = """
+            SELECT
+                (SELECT COUNT(DISTINCT chunk_index) FROM document_embeddings WHERE material_id = %s) AS chunks,
+                (SELECT COUNT(*) FROM extracted_images WHERE material_id = %s) AS images
+        """
+        return db.execute_query(query, (material_id, material_id))[0]
     
     @staticmethod
     def get_by_subject(subject_id):
@@ -232,14 +271,25 @@ class ExtractedImage:
     """Extracted images model"""
     
     @staticmethod
-    def create(material_id, image_path, page_number, image_type, caption):
-        """Save extracted image"""
+    def create(material_id, image_path, page_number, image_type, caption, source='file', bbox=None, xref=None):
+        """Save extracted image (lazy images have an empty image_path and a bbox/xref to render from)"""
         db = get_db()
         query = """
-            INSERT INTO extracted_images (material_id, image_path, page_number, image_type, caption)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO extracted_images
+            (material_id, image_path, page_number, image_type, caption, source, bbox, xref)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
         """
-        return db.execute_query(query, (material_id, image_path, page_number, image_type, caption), fetch=False)
+        return db.execute_query(
+            query, (material_id, image_path, page_number, image_type, caption, source, bbox, xref), fetch=False
+        )
+    
+    @staticmethod
+    def get_by_id(image_id):
+        """Get image by ID"""
+        db = get_db()
+        query = "SELECT * FROM extracted_images WHERE id = %s"
+        result = db.execute_query(query, (image_id,))
+        return result[0] if result else None
     
     @staticmethod
     def get_by_material(material_id):
@@ -251,3 +301,253 @@ class ExtractedImage:
             ORDER BY page_number
         """
         return db.execute_query(query, (material_id,))
+
+
+class MaterialPage:
+    """Parsed page text model (the parsed-text cache)"""
+    
+    @staticmethod
+    def create_many(material_id, pages):
+        """Save a batch of (page_number, text) pairs"""
+        db = get_db()
+        query = """
+            INSERT INTO material_pages (material_id, page_number, page_text)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE page_text = VALUES(page_text)
+        """
+        return db.execute_many(query, [(material_id, page, text) for page, text in pages])
+    
+    @staticmethod
+    def get_by_material(material_id):
+        """Get a material's page texts in page order"""
+        db = get_db()
+        query = """
+            SELECT page_number, page_text FROM material_pages
+            WHERE material_id = %s
+            ORDER BY page_number
+        """
+        return db.execute_query(query, (material_id,))
+
+
+class EmbeddingVersion:
+    """Embedding model version model (see reembed.py)"""
+    
+    @staticmethod
+    def get_active():
+        """Get the version currently served"""
+        db = get_db()
+        results = db.execute_query("SELECT * FROM embedding_versions WHERE status = 'active' LIMIT 1")
+        return results[0] if results else None
+    
+    @staticmethod
+    def ensure_active(model_name, dimension=None):
+        """Get the active version, recording version 1 for model_name on first use"""
+        active = EmbeddingVersion.get_active()
+        if active is not None:
+            return active
+        db = get_db()
+        db.execute_query("""
+            INSERT IGNORE INTO embedding_versions (id, model_name, dimension, status, activated_at)
+            VALUES (1, %s, %s, 'active', CURRENT_TIMESTAMP)
+        """, (model_name, dimension), fetch=False)
+        return EmbeddingVersion.get_active()
+    
+    @staticmethod
+    def create(model_name, dimension):
+        """Start building a new version"""
+        db = get_db()
+        query = "INSERT INTO embedding_versions (model_name, dimension) VALUES (%s, %s)"
+        return db.execute_query(query, (model_name, dimension), fetch=False)
+    
+    @staticmethod
+    def get_by_id(version_id):
+        """Get version by ID"""
+        db = get_db()
+        results = db.execute_query("SELECT * FROM embedding_versions WHERE id = %s", (version_id,))
+        return results[0] if results else None
+    
+    @staticmethod
+    def get_building(model_name):
+        """Get the newest unfinished version for a model, to resume it"""
+        db = get_db()
+        query = """
+            SELECT * FROM embedding_versions
+            WHERE model_name = %s AND status = 'building'
+            ORDER BY id DESC LIMIT 1
+        """
+        results = db.execute_query(query, (model_name,))
+        return results[0] if results else None
+    
+    @staticmethod
+    def get_all():
+        """Get every version, newest first"""
+        db = get_db()
+        return db.execute_query("SELECT * FROM embedding_versions ORDER BY id DESC")
+    
+    @staticmethod
+    def update_progress(version_id, chunks_done, chunks_total):
+        """Record how many chunks a building version has"""
+        db = get_db()
+        query = "UPDATE embedding_versions SET chunks_done = %s, chunks_total = %s WHERE id = %s"
+        db.execute_query(query, (chunks_done, chunks_total, version_id), fetch=False)
+    
+    @staticmethod
+    def activate(version_id):
+        """Make a built version the active one and retire the previous one
+        
+        A single UPDATE, so readers see either the old or the new active
+        version, never both or neither.
+        """
+        db = get_db()
+        query = """
+            UPDATE embedding_versions
+            SET status = IF(id = %s, 'active', 'retired'),
+                activated_at = IF(id = %s, CURRENT_TIMESTAMP, activated_at)
+            WHERE id = %s OR status = 'active'
+        """
+        db.execute_query(query, (version_id, version_id, version_id), fetch=False)
+    
+    @staticmethod
+    def bump_catch_up(version_id):
+        """Tell running backends that rows were added to a version behind their back"""
+        db = get_db()
+        query = "UPDATE embedding_versions SET catch_up_generation = catch_up_generation + 1 WHERE id = %s"
+        db.execute_query(query, (version_id,), fetch=False)
+    
+    @staticmethod
+    def mark_failed(version_id, error):
+        """Mark a building version as failed"""
+        db = get_db()
+        query = "UPDATE embedding_versions SET status = 'failed', error = %s WHERE id = %s"
+        db.execute_query(query, (error[:2000], version_id), fetch=False)
+
+
+class IngestJobSuperseded(Exception):
+    """The running job was re-queued and claimed again; its old worker must stop writing"""
+
+
+class IngestJob:
+    """Background ingestion job model (see ingest_queue.py)
+    
+    A claim is identified by (claimed_by, attempts); writes given that
+    claim only apply while it still owns the running job.
+    """
+    
+    @staticmethod
+    def create(material_id):
+        """Queue a material for ingestion"""
+        db = get_db()
+        query = "INSERT INTO ingest_jobs (material_id) VALUES (%s)"
+        return db.execute_query(query, (material_id,), fetch=False)
+    
+    @staticmethod
+    def claim(worker_token):
+        """Atomically take the oldest queued job, or return None
+        
+        The conditional UPDATE only succeeds for one claimant, so workers
+        in any number of processes never run the same job twice.
+        """
+        db = get_db()
+        queued = db.execute_query(
+            "SELECT id FROM ingest_jobs WHERE status = 'queued' ORDER BY id LIMIT 5"
+        )
+        for row in queued:
+            db.execute_query("""
+                UPDATE ingest_jobs
+                SET status = 'running', stage = 'starting', progress = 0, error = NULL,
+                    claimed_by = %s, attempts = attempts + 1, heartbeat_at = NOW()
+                WHERE id = %s AND status = 'queued'
+            """, (worker_token, row['id']), fetch=False)
+            job = IngestJob.get_by_id(row['id'])
+            if job and job['claimed_by'] == worker_token and job['status'] == 'running':
+                return job
+        return None
+    
+    @staticmethod
+    def _claim_filter(job_id, claim):
+        """WHERE clause and params matching a job, or with claim=(claimed_by, attempts) only that running claim"""
+        if claim is None:
+            return "id = %s", (job_id,)
+        return "id = %s AND status = 'running' AND claimed_by = %s AND attempts = %s", (job_id, *claim)
+    
+    @staticmethod
+    def heartbeat(job_id, claim):
+        """Refresh a running job's heartbeat; returns False once the claim was superseded"""
+        db = get_db()
+        where, params = IngestJob._claim_filter(job_id, claim)
+        db.execute_query(f"UPDATE ingest_jobs SET heartbeat_at = NOW() WHERE {where}", params, fetch=False)
+        return bool(db.execute_query(f"SELECT 1 FROM ingest_jobs WHERE {where}", params))
+    
+    @staticmethod
+    def update_progress(job_id, stage, progress, claim=None):
+        """Record the stage a running job reached and its overall progress (0-1)"""
+        db = get_db()
+        where, params = IngestJob._claim_filter(job_id, claim)
+        query = f"UPDATE ingest_jobs SET stage = %s, progress = %s WHERE {where}"
+        db.execute_query(query, (stage, progress, *params), fetch=False)
+    
+    @staticmethod
+    def mark_done(job_id, chunks_total=0, chunks_reused=0, reused_from=None, claim=None):
+        """Mark a job as finished, recording how much of its work was reused"""
+        db = get_db()
+        where, params = IngestJob._claim_filter(job_id, claim)
+        query = f"""
+            UPDATE ingest_jobs
+            SET status = 'done', stage = 'done', progress = 1, finished_at = CURRENT_TIMESTAMP,
+                chunks_total = %s, chunks_reused = %s, reused_from = %s
+            WHERE {where}
+        """
+        db.execute_query(query, (chunks_total, chunks_reused, reused_from, *params), fetch=False)
+    
+    @staticmethod
+    def mark_failed(job_id, error, claim=None):
+        """Mark a job as failed, keeping the stage it failed in"""
+        db = get_db()
+        where, params = IngestJob._claim_filter(job_id, claim)
+        query = f"""
+            UPDATE ingest_jobs
+            SET status = 'failed', error = %s, finished_at = CURRENT_TIMESTAMP
+            WHERE {where}
+        """
+        db.execute_query(query, (error[:2000], *params), fetch=False)
+    
+    @staticmethod
+    def retry(job_id):
+        """Put a failed job back on the queue"""
+        db = get_db()
+        query = """
+            UPDATE ingest_jobs
+            SET status = 'queued', stage = 'queued', progress = 0, claimed_by = NULL, finished_at = NULL
+            WHERE id = %s AND status = 'failed'
+        """
+        db.execute_query(query, (job_id,), fetch=False)
+    
+    @staticmethod
+    def requeue_stale(stale_seconds):
+        """Re-queue running jobs whose worker stopped sending heartbeats (e.g. it was killed)
+        
+        Jobs claimed before heartbeat_at existed fall back to updated_at.
+        """
+        db = get_db()
+        query = """
+            UPDATE ingest_jobs
+            SET status = 'queued', stage = 'queued', progress = 0, claimed_by = NULL
+            WHERE status = 'running' AND COALESCE(heartbeat_at, updated_at) < NOW() - INTERVAL %s SECOND
+        """
+        db.execute_query(query, (int(stale_seconds),), fetch=False)
+    
+    @staticmethod
+    def get_by_id(job_id):
+        """Get job by ID"""
+        db = get_db()
+        query = "SELECT * FROM ingest_jobs WHERE id = %s"
+        results = db.execute_query(query, (job_id,))
+        return results[0] if results else None
+    
+    @staticmethod
+    def get_latest_by_material(material_id):
+        """Get the most recent job for a material"""
+        db = get_db()
+        query = "SELECT * FROM ingest_jobs WHERE material_id = %s ORDER BY id DESC LIMIT 1"
+        results = db.execute_query(query, (material_id,))
+        return results[0] if results else None
@@ -1,37 +1,334 @@
-import PyPDF2
-import pdfplumber
-from PIL import Image
 import io
 import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 from config import Config
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _limit_worker_memory(max_mb):
+    """Process-pool initializer: cap a PDF worker's address space (Unix only)"""
+    if not max_mb:
+        return
+    try:
+        import resource
+        limit = int(max_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Could not cap PDF worker memory at {max_mb} MB: {e}")
+
+
+def _parse_page_range(pdf_path, material_id, first_page, last_page, with_images, images_folder, lazy_images):
+    """Process-pool task: parse pages first_page..last_page (1-based, inclusive) of one PDF"""
+    processor = PDFProcessor(workers=1)
+    processor.lazy_images = lazy_images
+    return [
+        (page_num, text, images)
+        for page_num, _, text, images in processor.parse_page_range(
+            pdf_path, material_id, first_page, last_page, with_images, images_folder
+        )
+    ]
+
+
 class PDFProcessor:
     """Process PDF files to extract text and images"""
     
-    def __init__(self):
+    def __init__(self, workers=None):
         self.chunk_size = Config.CHUNK_SIZE
         self.chunk_overlap = Config.CHUNK_OVERLAP
+        self.workers = Config.PDF_WORKERS if workers is None else workers
+        self.pages_per_task = Config.PDF_PAGES_PER_TASK
+        self.lazy_images = Config.LAZY_IMAGES
+        self._executor = None
+        self._executor_lock = threading.Lock()
+    
+    def iter_pages(self, pdf_path, material_id=None, with_images=True):
+        """Yield (page_num, page_count, text, images) for each page, in page order
+        
+        PDFs longer than PDF_PAGES_PER_TASK are split into page ranges that
+        the process pool parses in parallel; shorter ones (or PDF_WORKERS=1)
+        are parsed here in a single pass.
+        """
+        if self.workers > 1:
+            page_count = self.count_pages(pdf_path)
+            if page_count > self.pages_per_task:
+                yield from self._iter_pages_parallel(pdf_path, material_id, with_images, page_count)
+                return
+        yield from self.parse_page_range(pdf_path, material_id, with_images=with_images)
+    
+    def count_pages(self, pdf_path):
+        import pdfplumber
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
+    
+    def parse_page_range(self, pdf_path, material_id=None, first_page=1, last_page=None, with_images=True,
+                         images_folder=None):
+        """Parse pages first_page..last_page in one pass, yielding (page_num, page_count, text, images)
+        
+        Text, image crops and embedded image streams all come from the same
+        pdfplumber page, so the file is opened once and each page parsed once.
+        With lazy_images only each image's position is recorded; render_image
+        produces the picture when it is first requested. An embedded stream
+        (e.g. a logo on every page) is kept once per range, at its first page.
+        """
+        import pdfplumber
+        images_folder = images_folder or Config.IMAGES_FOLDER
+        seen_streams = set()
+        with pdfplumber.open(pdf_path) as pdf:
+            page_count = len(pdf.pages)
+            last_page = min(last_page or page_count, page_count)
+            for page_num in range(first_page, last_page + 1):
+                page = pdf.pages[page_num - 1]
+                text = (page.extract_text() or '').strip()
+                images = []
+                if with_images:
+                    # One malformed XObject must not fail the whole ingest
+                    try:
+                        if self.lazy_images:
+                            images = self._page_image_metadata(page, page_num, seen_streams)
+                        else:
+                            images = self._extract_page_images(page, page_num, material_id, images_folder,
+                                                               seen_streams)
+                    except Exception as img_error:
+                        logger.warning(f"Image extraction failed on page {page_num}: {img_error}")
+                self._release_page(page)
+                yield page_num, page_count, text, images
+    
+    @staticmethod
+    def _release_page(page):
+        """Free a parsed page's layout and text caches, which pdfplumber keeps until the PDF closes"""
+        page.flush_cache()
+        page.__dict__.pop('_layout', None)
+        if hasattr(page.get_textmap, 'cache_clear'):
+            page.get_textmap.cache_clear()
+    
+    def _iter_pages_parallel(self, pdf_path, material_id, with_images, page_count):
+        """Parse page ranges on the process pool, yielding pages in order as ranges complete"""
+        ranges = deque(
+            (first, min(first + self.pages_per_task - 1, page_count))
+            for first in range(1, page_count + 1, self.pages_per_task)
+        )
+        executor = self._get_executor()
+        pending = deque()
+        seen_streams = set()
+        try:
+            while ranges or pending:
+                # A bounded window of ranges in flight keeps results from piling up in memory
+                while ranges and len(pending) < self.workers * 2:
+                    first, last = ranges.popleft()
+                    pending.append(executor.submit(
+                        _parse_page_range, pdf_path, material_id, first, last, with_images, Config.IMAGES_FOLDER,
+                        self.lazy_images
+                    ))
+                for page_num, text, images in pending.popleft().result():
+                    yield page_num, page_count, text, self._drop_seen_streams(images, seen_streams)
+        except BrokenProcessPool:
+            # A worker died (e.g. hit the memory cap); start a fresh pool for the next PDF
+            self._shutdown_executor()
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: the backend is multi-threaded, and forking it is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_limit_worker_memory,
+                    initargs=(Config.PDF_WORKER_MAX_MEMORY_MB,)
+                )
+                logger.info(f"Started PDF process pool with {self.workers} workers")
+            return self._executor
+    
+    def _shutdown_executor(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def close(self):
+        """Stop the PDF worker processes"""
+        self._shutdown_executor()
+    
+    @staticmethod
+    def _drop_seen_streams(images, seen_streams):
+        """Drop embedded images whose stream an earlier page range already returned
+        
+        Each range is parsed in its own process, so only the parent sees the
+        whole document; pages arrive in order and the first use is kept.
+        """
+        kept = []
+        for image in images:
+            xref = image.get('xref')
+            if xref is not None and image['source'] != 'crop':
+                if xref in seen_streams:
+                    if image['path']:
+                        try:
+                            os.remove(image['path'])
+                        except OSError as e:
+                            logger.warning(f"Could not remove duplicate image {image['path']}: {e}")
+                    continue
+                seen_streams.add(xref)
+            kept.append(image)
+        return kept
+    
+    def _extract_page_images(self, page, page_num, material_id, images_folder, saved_streams=None):
+        """Save the rendered crop of each image on a page and each embedded stream not in saved_streams"""
+        extracted_images = []
+        if saved_streams is None:
+            saved_streams = set()
+        
+        for img_idx, img in enumerate(page.images):
+            try:
+                # Get image from page
+                x0, y0, x1, y1 = img['x0'], img['top'], img['x1'], img['bottom']
+                cropped = page.within_bbox((x0, y0, x1, y1))
+                
+                image_filename = f"material_{material_id}_page_{page_num}_img_{img_idx}.png"
+                image_path = os.path.join(images_folder, image_filename)
+                
+                # Convert to image and save
+                img_obj = cropped.to_image(resolution=150)
+                img_obj.save(image_path, format='PNG')
+                
+                extracted_images.append({
+                    'path': image_path,
+                    'page': page_num,
+                    'type': 'png',
+                    'source': 'file'
+                })
+            except Exception as img_error:
+                logger.warning(f"Failed to extract image {img_idx} from page {page_num}: {img_error}")
+            
+            # The same XObject can be drawn many times; save its stream once per document
+            stream = img.get('stream')
+            if stream is None or stream.objid in saved_streams:
+                continue
+            saved_streams.add(stream.objid)
+            try:
+                image_filename = f"material_{material_id}_page_{page_num}_embedded_{stream.objid}.png"
+                image_path = os.path.join(images_folder, image_filename)
+                self._decode_image_stream(img).save(image_path)
+                
+                extracted_images.append({
+                    'path': image_path,
+                    'page': page_num,
+                    'type': 'png',
+                    'source': 'file',
+                    'xref': stream.objid
+                })
+            except Exception as embed_error:
+                logger.warning(f"Failed to extract embedded image: {embed_error}")
+        
+        return extracted_images
+    
+    @staticmethod
+    def _image_bbox(page, img):
+        """An image's bbox clipped to the page as 'x0,top,x1,bottom', or None if nothing is visible"""
+        px0, ptop, px1, pbottom = page.bbox
+        x0, top = max(img['x0'], px0), max(img['top'], ptop)
+        x1, bottom = min(img['x1'], px1), min(img['bottom'], pbottom)
+        if x1 <= x0 or bottom <= top:
+            return None
+        return f"{x0:.2f},{top:.2f},{x1:.2f},{bottom:.2f}"
+    
+    def _page_image_metadata(self, page, page_num, seen_streams=None):
+        """Record where each image on a page is, without rendering or decoding anything
+        
+        Like _extract_page_images there is a 'crop' entry per drawn image and
+        an 'embedded' entry per XObject stream (its xref) not yet in
+        seen_streams. Embedded entries keep the page and bbox of their first
+        use to fall back on.
+        """
+        images = []
+        if seen_streams is None:
+            seen_streams = set()
+        for img in page.images:
+            bbox = self._image_bbox(page, img)
+            if bbox is not None:
+                images.append({'path': '', 'page': page_num, 'type': 'png', 'source': 'crop', 'bbox': bbox, 'xref': None})
+            stream = img.get('stream')
+            if stream is None or stream.objid in seen_streams:
+                continue
+            seen_streams.add(stream.objid)
+            images.append({
+                'path': '', 'page': page_num, 'type': 'png', 'source': 'embedded', 'bbox': bbox, 'xref': stream.objid
+            })
+        return images
+    
+    def render_image(self, pdf_path, page_number, source, bbox=None, xref=None, resolution=None):
+        """Render an image recorded by _page_image_metadata as a PIL image
+        
+        Embedded streams that cannot be decoded directly are rendered from
+        the page area they were drawn in instead.
+        """
+        import pdfplumber
+        resolution = resolution or Config.IMAGE_RENDER_DPI
+        with pdfplumber.open(pdf_path) as pdf:
+            page = pdf.pages[page_number - 1]
+            if source == 'embedded':
+                for img in page.images:
+                    stream = img.get('stream')
+                    if stream is not None and stream.objid == xref:
+                        try:
+                            return self._decode_image_stream(img)
+                        except Exception as e:
+                            logger.info(f"Rendering image {xref} on page {page_number} from the page instead: {e}")
+                            break
+            if not bbox:
+                raise ValueError(f"Image {xref} not found on page {page_number}")
+            x0, top, x1, bottom = (float(v) for v in bbox.split(','))
+            return page.within_bbox((x0, top, x1, bottom)).to_image(resolution=resolution).original.copy()
+    
+    def _decode_image_stream(self, img):
+        """Decode an image XObject stream to a PIL image without rendering the page"""
+        from PIL import Image
+        stream = img['stream']
+        filters = [getattr(f, 'name', f) for f, _ in stream.get_filters()]
+        if 'DCTDecode' in filters:
+            # JPEG data is stored as-is
+            return Image.open(io.BytesIO(stream.get_rawdata()))
+        
+        colorspace = [getattr(c, 'name', c) for c in img.get('colorspace') or []]
+        bits = img.get('bits') or 8
+        if bits == 1:
+            mode = "1"
+        elif bits != 8:
+            raise ValueError(f"unsupported bit depth {bits}")
+        elif 'DeviceRGB' in colorspace or 'CalRGB' in colorspace:
+            mode = "RGB"
+        elif 'DeviceGray' in colorspace or 'CalGray' in colorspace:
+            mode = "L"
+        elif 'DeviceCMYK' in colorspace:
+            mode = "CMYK"
+        else:
+            # Indexed, ICC-based and other spaces need more than a raw copy
+            raise ValueError(f"unsupported colour space {colorspace}")
+        width, height = img['srcsize']
+        data = stream.get_data()
+        expected = (width + 7) // 8 * height if mode == "1" else width * height * len(mode)
+        if len(data) < expected:
+            raise ValueError(f"stream has {len(data)} bytes, expected {expected} for {mode} {width}x{height}")
+        image = Image.frombytes(mode, (width, height), data[:expected])
+        return image.convert("RGB") if mode == "CMYK" else image
     
     def extract_text(self, pdf_path):
         """Extract text from PDF file"""
         try:
-            text_content = []
-            page_texts = []
-            
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    text = page.extract_text()
-                    if text:
-                        page_texts.append({
-                            'page': page_num,
-                            'text': text.strip()
-                        })
-                        text_content.append(text.strip())
-            
-            full_text = '\n\n'.join(text_content)
+            page_texts = [
+                {'page': page_num, 'text': text}
+                for page_num, _, text, _ in self.iter_pages(pdf_path, with_images=False)
+                if text
+            ]
+            full_text = '\n\n'.join(page['text'] for page in page_texts)
             logger.info(f"Extracted text from {len(page_texts)} pages")
             return full_text, page_texts
             
@@ -40,76 +337,11 @@ class PDFProcessor:
             raise
     
     def extract_images(self, pdf_path, material_id):
-        """Extract images from PDF file"""
+        """Extract images from PDF file (only their positions when lazy_images is set)"""
         try:
             extracted_images = []
-            
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    # Extract images from page
-                    if hasattr(page, 'images') and page.images:
-                        for img_idx, img in enumerate(page.images):
-                            try:
-                                # Get image from page
-                                x0, y0, x1, y1 = img['x0'], img['top'], img['x1'], img['bottom']
-                                cropped = page.within_bbox((x0, y0, x1, y1))
-                                
-                                # Save image
-                                image_filename = f"material_{material_id}_page_{page_num}_img_{img_idx}.png"
-                                image_path = os.path.join(Config.IMAGES_FOLDER, image_filename)
-                                
-                                # Convert to image and save
-                                img_obj = cropped.to_image(resolution=150)
-                                img_obj.save(image_path, format='PNG')
-                                
-                                extracted_images.append({
-                                    'path': image_path,
-                                    'page': page_num,
-                                    'type': 'png'
-                                })
-                                
-                            except Exception as img_error:
-                                logger.warning(f"Failed to extract image {img_idx} from page {page_num}: {img_error}")
-                                continue
-            
-            # Also try PyPDF2 method for embedded images
-            try:
-                with open(pdf_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page_num, page in enumerate(pdf_reader.pages, 1):
-                        if '/XObject' in page['/Resources']:
-                            xObject = page['/Resources']['/XObject'].get_object()
-                            
-                            for obj_idx, obj in enumerate(xObject):
-                                if xObject[obj]['/Subtype'] == '/Image':
-                                    try:
-                                        size = (xObject[obj]['/Width'], xObject[obj]['/Height'])
-                                        data = xObject[obj].get_data()
-                                        
-                                        image_filename = f"material_{material_id}_page_{page_num}_embedded_{obj_idx}.png"
-                                        image_path = os.path.join(Config.IMAGES_FOLDER, image_filename)
-                                        
-                                        # Check if already extracted
-                                        if not any(img['path'] == image_path for img in extracted_images):
-                                            if xObject[obj]['/ColorSpace'] == '/DeviceRGB':
-                                                mode = "RGB"
-                                            else:
-                                                mode = "P"
-                                            
-                                            img = Image.frombytes(mode, size, data)
-                                            img.save(image_path)
-                                            
-                                            extracted_images.append({
-                                                'path': image_path,
-                                                'page': page_num,
-                                                'type': 'png'
-                                            })
-                                    except Exception as embed_error:
-                                        logger.warning(f"Failed to extract embedded image: {embed_error}")
-                                        continue
-            except Exception as pypdf_error:
-                logger.warning(f"PyPDF2 image extraction failed: {pypdf_error}")
-            
+            for _, _, _, images in self.iter_pages(pdf_path, material_id):
+                extracted_images.extend(images)
             logger.info(f"Extracted {len(extracted_images)} images from PDF")
             return extracted_images
             
@@ -118,45 +350,73 @@ class PDFProcessor:
             return []
     
     def chunk_text(self, text, page_texts):
-        """Split text into chunks for embedding"""
+        """Split text into chunks for embedding (text is unused; chunks never span pages)"""
         chunks = []
-        
         for page_data in page_texts:
-            page_num = page_data['page']
-            page_text = page_data['text']
-            
-            # Split by sentences or paragraphs
-            paragraphs = page_text.split('\n\n')
-            
-            current_chunk = ""
-            for para in paragraphs:
-                if len(current_chunk) + len(para) < self.chunk_size:
-                    current_chunk += para + "\n\n"
-                else:
-                    if current_chunk:
-                        chunks.append({
-                            'text': current_chunk.strip(),
-                            'page': page_num
-                        })
-                    current_chunk = para + "\n\n"
-            
-            if current_chunk:
-                chunks.append({
-                    'text': current_chunk.strip(),
-                    'page': page_num
-                })
+            chunks.extend(self.chunk_page(page_data['page'], page_data['text']))
         
         logger.info(f"Created {len(chunks)} text chunks")
         return chunks
     
+    def chunk_page(self, page_num, page_text):
+        """Split one page's text into chunks"""
+        chunks = []
+        
+        # Split by sentences or paragraphs
+        paragraphs = page_text.split('\n\n')
+        
+        current_chunk = ""
+        for para in paragraphs:
+            if len(current_chunk) + len(para) < self.chunk_size:
+                current_chunk += para + "\n\n"
+            else:
+                if current_chunk:
+                    chunks.append({
+                        'text': current_chunk.strip(),
+                        'page': page_num
+                    })
+                current_chunk = para + "\n\n"
+        
+        if current_chunk:
+            chunks.append({
+                'text': current_chunk.strip(),
+                'page': page_num
+            })
+        return chunks
+    
+    def iter_chunks(self, pdf_path, material_id, on_page=None):
+        """Stream a PDF as chunks, page by page, without holding the document in memory
+        
+        on_page(page_num, page_count, text, images) is called as each page
+        is parsed, before its chunks are yielded.
+        """
+        for page_num, page_count, text, images in self.iter_pages(pdf_path, material_id):
+            if on_page:
+                on_page(page_num, page_count, text, images)
+            if text:
+                yield from self.chunk_page(page_num, text)
+    
+    def parse_pdf(self, pdf_path, material_id, progress=None):
+        """Single pass over the PDF returning (page_texts, images)
+        
+        progress(page_num, page_count) is called after each page.
+        """
+        page_texts = []
+        images = []
+        for page_num, page_count, text, page_images in self.iter_pages(pdf_path, material_id):
+            if text:
+                page_texts.append({'page': page_num, 'text': text})
+            images.extend(page_images)
+            if progress:
+                progress(page_num, page_count)
+        logger.info(f"Parsed {len(page_texts)} pages of text and {len(images)} images")
+        return page_texts, images
+    
     def process_pdf(self, pdf_path, material_id):
         """Complete PDF processing pipeline"""
         try:
-            # Extract text
-            full_text, page_texts = self.extract_text(pdf_path)
-            
-            # Extract images
-            images = self.extract_images(pdf_path, material_id)
+            page_texts, images = self.parse_pdf(pdf_path, material_id)
+            full_text = '\n\n'.join(page['text'] for page in page_texts)
             
             # Chunk text
             chunks = self.chunk_text(full_text, page_texts)
@@ -0,0 +1,90 @@
+"""
+Import-time profile for TKR Chatbot backend modules and CLI tools
+Imports each module in a fresh interpreter with `python -X importtime` and reports the heaviest imports
+
+Usage: python profile_imports.py [module ...] [--top 8] [--budget 1.0]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MODULES = [
+    'database', 'models', 'pdf_processor', 'gemini_rag', 'ingest_queue', 'app',
+    'create_admin_tables', 'init_db', 'migrate_embeddings', 'build_ann_index'
+]
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def profile_module(module):
+    """Return (wall seconds, import seconds, [(seconds, package)], error) for importing one module
+
+    Packages are reported by root name with their largest cumulative time,
+    so `numpy 0.15s` covers numpy and everything it pulled in.
+    """
+    start_time = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start_time
+
+    packages = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, package = int(match.group(2)), len(match.group(3)), match.group(4)
+        if indent == 1:
+            total_us += cumulative_us
+        root = package.split('.')[0]
+        if root != module:
+            packages[root] = max(packages.get(root, 0), cumulative_us)
+
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"
+    heaviest = sorted(((us / 1e6, root) for root, us in packages.items()), reverse=True)
+    return wall, total_us / 1e6, heaviest, error
+
+
+def report(modules, top, budget):
+    print(f"{'module':<22} {'wall':>7} {'imports':>8}  heaviest packages")
+    print("-" * 100)
+    slow = []
+    failed = []
+    for module in modules:
+        wall, imports, heaviest, error = profile_module(module)
+        mark = '✓' if wall < budget and not error else '✗'
+        details = ', '.join(f"{package} {seconds:.2f}s" for seconds, package in heaviest[:top])
+        print(f"{mark} {module:<20} {wall:>6.2f}s {imports:>7.2f}s  {details}")
+        if error:
+            print(f"    failed: {error}")
+        if error:
+            failed.append(module)
+        elif wall >= budget:
+            slow.append(module)
+
+    print()
+    if slow:
+        print(f"Over the {budget:.1f}s budget: {', '.join(slow)}")
+    if failed:
+        print(f"Failed to import: {', '.join(failed)}")
+    if not slow and not failed:
+        print(f"✅ Every module imports in under {budget:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import time of backend modules")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--top', type=int, default=8, help="heaviest imports to list per module")
+    parser.add_argument('--budget', type=float, default=1.0, help="wall-clock seconds allowed per module")
+    args = parser.parse_args()
+
+    report(args.modules, args.top, args.budget)
@@ -0,0 +1,102 @@
+"""
+Embedding dimensionality reduction for TKR Chatbot
+Offline-fitted PCA (or Matryoshka-style truncation) applied to stored chunks and queries alike
+"""
+import os
+import hashlib
+import numpy as np
+
+# Rows sampled when fitting PCA; the covariance converges long before the full corpus
+PCA_SAMPLE_ROWS = 100000
+
+
+def projection_path(directory):
+    """Path of the projection stored alongside the vector index"""
+    return os.path.join(directory, 'projection.npz')
+
+
+class Projection:
+    """Linear map from embedding space to a smaller space: (x - mean) @ components.T"""
+
+    def __init__(self, kind, mean, components):
+        self.kind = kind
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+
+    @property
+    def input_dim(self):
+        return self.components.shape[1]
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    @property
+    def fingerprint(self):
+        """Short hash identifying this exact projection (used to key on-disk data)"""
+        digest = hashlib.sha1(self.mean.tobytes() + self.components.tobytes()).hexdigest()
+        return f"{self.kind}{self.dim}_{digest[:8]}"
+
+    @classmethod
+    def fit_pca(cls, vectors, dim, seed=0):
+        """Principal components of (a sample of) the corpus embeddings"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > PCA_SAMPLE_ROWS:
+            rng = np.random.default_rng(seed)
+            vectors = vectors[rng.choice(len(vectors), PCA_SAMPLE_ROWS, replace=False)]
+        mean = vectors.mean(axis=0)
+        centered = vectors - mean
+        covariance = (centered.T @ centered) / max(len(centered) - 1, 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance.astype(np.float64))
+        order = np.argsort(eigenvalues)[::-1][:dim]
+        projection = cls('pca', mean, eigenvectors[:, order].T)
+        projection.explained_variance = float(eigenvalues[order].sum() / eigenvalues.sum())
+        return projection
+
+    @classmethod
+    def truncate(cls, input_dim, dim):
+        """Keep the first dim coordinates (only meaningful for Matryoshka-trained models)"""
+        return cls('truncate', np.zeros(input_dim, dtype=np.float32), np.eye(dim, input_dim, dtype=np.float32))
+
+    def apply(self, vectors):
+        """Project vectors (rows) into the reduced space; callers re-normalize"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        return (vectors - self.mean) @ self.components.T
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, kind=np.array(self.kind), mean=self.mean, components=self.components)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(str(data['kind']), data['mean'], data['components'])
+
+
+def load_projection(mode, directory, input_dim, dim):
+    """Return the Projection selected by EMBEDDING_REDUCTION, or None for full vectors
+
+    'truncate' needs nothing on disk. 'pca' loads the projection written by
+    build_projection.py and raises if it is missing or does not match.
+    """
+    if not mode or mode == 'none':
+        return None
+    if mode == 'truncate':
+        return Projection.truncate(input_dim, dim)
+    if mode != 'pca':
+        raise ValueError(f"Unknown embedding reduction: {mode} (expected none, pca or truncate)")
+
+    path = projection_path(directory)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No PCA projection at {path}; run build_projection.py first")
+    projection = Projection.load(path)
+    if projection.input_dim != input_dim or projection.dim != dim:
+        raise ValueError(
+            f"PCA projection at {path} maps {projection.input_dim} -> {projection.dim} dims, "
+            f"expected {input_dim} -> {dim}; re-run build_projection.py"
+        )
+    return projection
@@ -0,0 +1,111 @@
+"""
+Quantized embedding codes for TKR Chatbot
+Int8 scalar and 1-bit binary codes for first-pass scoring, re-scored with float32 vectors
+"""
+import numpy as np
+
+# Rows decoded at a time while scoring; small enough for the float32 block to stay in cache
+SCORE_BLOCK_ROWS = 1024
+
+# Set bits per byte value, for Hamming distance on numpy without bitwise_count
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(bytes_matrix):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bytes_matrix)
+    return _POPCOUNT[bytes_matrix]
+
+
+class Int8Quantizer:
+    """Symmetric per-dimension int8 scalar quantization (4x smaller than float32)"""
+
+    kind = 'int8'
+
+    def __init__(self, scales):
+        self.scales = scales
+        # Rows encoded since fit, and how many had a component beyond the fitted range
+        self.encoded_rows = 0
+        self.clipped_rows = 0
+
+    @classmethod
+    def fit(cls, vectors):
+        """Choose per-dimension scales so the largest component maps to +-127"""
+        absmax = np.abs(np.asarray(vectors, dtype=np.float32)).max(axis=0) if len(vectors) else None
+        if absmax is None:
+            return None
+        absmax[absmax == 0] = 1.0
+        return cls((absmax / 127.0).astype(np.float32))
+
+    def copy(self):
+        """Same scales and counters; snapshots that encode more rows take a copy, not the published quantizer"""
+        quantizer = Int8Quantizer(self.scales)
+        quantizer.encoded_rows = self.encoded_rows
+        quantizer.clipped_rows = self.clipped_rows
+        return quantizer
+
+    def encode(self, vectors):
+        codes = np.rint(np.asarray(vectors, dtype=np.float32) / self.scales)
+        self.encoded_rows += len(codes)
+        self.clipped_rows += int((np.abs(codes) > 127).any(axis=1).sum())
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    @property
+    def clipped_fraction(self):
+        """Share of encoded rows that did not fit the scales (later appends can exceed the fit)"""
+        return self.clipped_rows / self.encoded_rows if self.encoded_rows else 0.0
+
+    def score(self, codes, query_vec):
+        """Approximate dot products of every coded row with a float32 query"""
+        query = (query_vec * self.scales).astype(np.float32)
+        scores = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((min(SCORE_BLOCK_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            decoded = buffer[:len(block)]
+            np.copyto(decoded, block, casting='unsafe')
+            scores[start:start + len(block)] = decoded @ query
+        return scores
+
+
+class BinaryQuantizer:
+    """1-bit sign quantization scored by Hamming distance (32x smaller than float32)"""
+
+    kind = 'binary'
+    # Signs never fall outside the fit
+    clipped_fraction = 0.0
+
+    @classmethod
+    def fit(cls, vectors):
+        return cls()
+
+    def copy(self):
+        # Stateless, so it is safe to share
+        return self
+
+    def encode(self, vectors):
+        return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+    def score(self, codes, query_vec):
+        """Negated Hamming distance, so larger is more similar like a dot product"""
+        query_code = self.encode(query_vec.reshape(1, -1))[0]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = -_popcount(block ^ query_code).sum(axis=1, dtype=np.int32)
+        return scores
+
+
+QUANTIZERS = {
+    'int8': Int8Quantizer,
+    'binary': BinaryQuantizer,
+}
+
+
+def get_quantizer_class(mode):
+    """Return the quantizer class for a QUANTIZATION setting ('none' -> None)"""
+    if not mode or mode == 'none':
+        return None
+    if mode not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization mode: {mode} (expected none, int8 or binary)")
+    return QUANTIZERS[mode]
@@ -0,0 +1,372 @@
+"""
+Bulk re-embedding job for TKR Chatbot model migrations
+Encodes the stored chunks of every processed material with another model as a new embedding version,
+alongside the served one, then activates it; running backends switch within EMBEDDING_VERSION_POLL_SECONDS
+
+Nothing is re-parsed: chunks come from document_embeddings, or with --rechunk from the cached page
+texts in material_pages. The job runs at low CPU priority with REEMBED_THREADS torch threads and at
+most REEMBED_MAX_CHUNKS_PER_SECOND so chat latency is unaffected. Interrupted runs resume.
+Usage: python reembed.py --model all-mpnet-base-v2 [--rechunk] [--max-rate 100] [--threads 1] [--no-activate]
+       python reembed.py --status | --activate VERSION | --drop-retired
+"""
+import argparse
+import os
+import time
+import numpy as np
+from config import Config
+from database import get_db
+from models import EmbeddingVersion, MaterialPage
+from embedding_codec import pack_embedding
+from content_hash import text_hash
+from gemini_rag import cached_embeddings
+
+INSERT_QUERY = """
+    INSERT INTO document_embeddings
+    (material_id, chunk_text, chunk_index, page_number, embedding_vector, text_hash, embedding_version)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Seconds to wait for running ingest jobs to finish before activating
+INGEST_DRAIN_SECONDS = 300
+
+# Allowance for a backend to load the new model once it noticed the activation
+ENGINE_SWAP_SECONDS = 120
+
+# Seconds between catch-up passes while backends switch over
+CATCH_UP_INTERVAL = 5
+
+
+class Throttle:
+    """Sleep as needed to keep the average rate at or below max_rate items/s (0 = unthrottled)"""
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self.start_time = time.time()
+        self.count = 0
+
+    def wait(self, count):
+        self.count += count
+        if self.max_rate <= 0:
+            return
+        ahead = self.count / self.max_rate - (time.time() - self.start_time)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.start_time
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+
+def lower_priority(threads):
+    """Keep the job from competing with the backend for CPU"""
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    import torch
+    torch.set_num_threads(max(threads, 1))
+
+
+def pending_materials(db, version_id, source_version):
+    """Processed materials with chunks in the source version but none yet in version_id"""
+    return db.execute_query("""
+        SELECT m.id, m.title FROM materials m
+        WHERE m.is_processed = TRUE
+          AND EXISTS (SELECT 1 FROM document_embeddings de
+                      WHERE de.material_id = m.id AND de.embedding_version = %s)
+          AND NOT EXISTS (SELECT 1 FROM document_embeddings de
+                          WHERE de.material_id = m.id AND de.embedding_version = %s)
+        ORDER BY m.id
+    """, (source_version, version_id))
+
+
+def material_chunks(db, material_id, source_version, rechunk, processor):
+    """Chunks of a material as dicts with text, page and index, without parsing the PDF"""
+    if rechunk:
+        pages = MaterialPage.get_by_material(material_id)
+        if pages:
+            chunks = [
+                chunk
+                for page in pages
+                for chunk in processor.chunk_page(page['page_number'], page['page_text'])
+            ]
+            return [{'text': c['text'], 'page': c['page'], 'index': i} for i, c in enumerate(chunks)]
+    rows = db.execute_query("""
+        SELECT chunk_text, chunk_index, page_number FROM document_embeddings
+        WHERE material_id = %s AND embedding_version = %s
+        ORDER BY chunk_index
+    """, (material_id, source_version))
+    return [{'text': r['chunk_text'], 'page': r['page_number'], 'index': r['chunk_index']} for r in rows]
+
+
+def embed_material(db, model, version, material_id, chunks, throttle):
+    """Encode a material's chunks and insert them as one batch; returns the number reused from the cache
+
+    A single insert keeps every material either fully present in the new version or absent,
+    which is what resuming relies on.
+    """
+    hashes = [text_hash(chunk['text']) for chunk in chunks]
+    blobs = cached_embeddings(hashes, version['id'], version['dimension']) if Config.EMBEDDING_CACHE_ENABLED else {}
+    new_texts = {}
+    for chunk, chunk_hash in zip(chunks, hashes):
+        if chunk_hash not in blobs:
+            new_texts.setdefault(chunk_hash, chunk['text'])
+
+    texts = list(new_texts.items())
+    for start in range(0, len(texts), Config.EMBEDDING_BATCH_SIZE):
+        batch = texts[start:start + Config.EMBEDDING_BATCH_SIZE]
+        vectors = model.encode([text for _, text in batch], batch_size=len(batch), convert_to_numpy=True)
+        for (chunk_hash, _), vector in zip(batch, vectors.astype(np.float32, copy=False)):
+            blobs[chunk_hash] = pack_embedding(vector, Config.EMBEDDING_STORAGE_DTYPE)
+        throttle.wait(len(batch))
+
+    # Another run may have finished this material while we were encoding
+    if db.execute_query(
+        "SELECT 1 FROM document_embeddings WHERE material_id = %s AND embedding_version = %s LIMIT 1",
+        (material_id, version['id'])
+    ):
+        return 0
+    db.execute_many(INSERT_QUERY, [
+        (material_id, chunk['text'], chunk['index'], chunk['page'], blobs[chunk_hash], chunk_hash, version['id'])
+        for chunk, chunk_hash in zip(chunks, hashes)
+    ])
+    return len(chunks) - len(new_texts)
+
+
+def run_pass(db, model, version, source_version, rechunk, processor, throttle, progress):
+    """Embed every pending material once; returns the number of materials embedded"""
+    materials = pending_materials(db, version['id'], source_version)
+    for material in materials:
+        chunks = material_chunks(db, material['id'], source_version, rechunk, processor)
+        if not chunks:
+            continue
+        reused = embed_material(db, model, version, material['id'], chunks, throttle)
+        progress['chunks'] += len(chunks)
+        EmbeddingVersion.update_progress(version['id'], progress['chunks'], progress['total'])
+        print(f"  ✓ material {material['id']}: {len(chunks)} chunks ({reused} cached), "
+              f"{progress['chunks']}/{progress['total']} total, {throttle.rate:.0f} chunks/s")
+    return len(materials)
+
+
+def running_ingest_jobs(db):
+    return db.execute_query("SELECT COUNT(*) AS n FROM ingest_jobs WHERE status = 'running'")[0]['n']
+
+
+def unfinished_ingest_jobs(db, last_job_id):
+    """Queued or running jobs among those created up to last_job_id"""
+    return db.execute_query(
+        "SELECT COUNT(*) AS n FROM ingest_jobs WHERE id <= %s AND status IN ('queued', 'running')",
+        (last_job_id,)
+    )[0]['n']
+
+
+def catch_up_after_switch(db, model, version, source_id, rechunk, processor, throttle, progress):
+    """Re-embed materials stored with the old version until no backend can still write it
+
+    Backends switch within EMBEDDING_VERSION_POLL_SECONDS plus their model
+    load time, and a job already running keeps the engine it started with.
+    So catch-up continues until that window has passed and every job queued
+    by then has finished; any later job runs on the new engine.
+    """
+    switched_by = time.time() + Config.EMBEDDING_VERSION_POLL_SECONDS + ENGINE_SWAP_SECONDS
+    caught_up = 0
+    last_job_id = None
+    while True:
+        caught_up += catch_up_pass(db, model, version, source_id, rechunk, processor, throttle, progress)
+        if time.time() >= switched_by:
+            if last_job_id is None:
+                last_job_id = db.execute_query("SELECT COALESCE(MAX(id), 0) AS id FROM ingest_jobs")[0]['id']
+            if not unfinished_ingest_jobs(db, last_job_id):
+                break
+        time.sleep(CATCH_UP_INTERVAL)
+    # Whatever those last jobs stored
+    caught_up += catch_up_pass(db, model, version, source_id, rechunk, processor, throttle, progress)
+    return caught_up
+
+
+def catch_up_pass(db, model, version, source_id, rechunk, processor, throttle, progress):
+    """run_pass on an active version, then signal backends to index what it added
+
+    Backends built their index before these rows existed; they poll the
+    version's catch_up_generation and load the materials they lack.
+    """
+    embedded = run_pass(db, model, version, source_id, rechunk, processor, throttle, progress)
+    if embedded:
+        EmbeddingVersion.bump_catch_up(version['id'])
+    return embedded
+
+
+def uncovered_materials(db, version_id):
+    """Processed materials with vectors in some version but none in version_id"""
+    return db.execute_query("""
+        SELECT m.id, m.title FROM materials m
+        WHERE m.is_processed = TRUE
+          AND EXISTS (SELECT 1 FROM document_embeddings de WHERE de.material_id = m.id)
+          AND NOT EXISTS (SELECT 1 FROM document_embeddings de
+                          WHERE de.material_id = m.id AND de.embedding_version = %s)
+        ORDER BY m.id
+    """, (version_id,))
+
+
+def reembed(model_name, rechunk=False, max_rate=Config.REEMBED_MAX_CHUNKS_PER_SECOND,
+            threads=Config.REEMBED_THREADS, activate=True):
+    db = get_db()
+    source = EmbeddingVersion.ensure_active(Config.EMBEDDING_MODEL)
+    missing = []
+    if source['model_name'] == model_name and not rechunk:
+        missing = uncovered_materials(db, source['id'])
+        if not missing:
+            print(f"✓ {model_name} is already the active embedding model (version {source['id']})")
+            return
+
+    lower_priority(threads)
+    from sentence_transformers import SentenceTransformer
+    from pdf_processor import PDFProcessor
+    model = SentenceTransformer(model_name)
+    dim = model.get_sentence_embedding_dimension()
+    processor = PDFProcessor(workers=1)
+
+    if missing:
+        # Materials a backend stored with an older version after this one was activated
+        print(f"Re-embedding {len(missing)} materials missing from active version {source['id']}")
+        progress = {'chunks': 0, 'total': 0}
+        throttle = Throttle(max_rate)
+        for other in sorted(EmbeddingVersion.get_all(), key=lambda v: v['id'], reverse=True):
+            if other['id'] != source['id']:
+                catch_up_pass(db, model, source, other['id'], False, processor, throttle, progress)
+        print(f"✓ {len(missing) - len(uncovered_materials(db, source['id']))} materials caught up")
+        return
+
+    version = EmbeddingVersion.get_building(model_name)
+    if version is None:
+        version = EmbeddingVersion.get_by_id(EmbeddingVersion.create(model_name, dim))
+        print(f"Building embedding version {version['id']} ({model_name}, {dim} dims)")
+    else:
+        print(f"Resuming embedding version {version['id']} ({model_name}, {version['chunks_done']} chunks done)")
+
+    total = db.execute_query("""
+        SELECT COUNT(*) AS n FROM document_embeddings de
+        JOIN materials m ON de.material_id = m.id
+        WHERE m.is_processed = TRUE AND de.embedding_version = %s
+    """, (source['id'],))[0]['n']
+    progress = {'chunks': version['chunks_done'], 'total': total}
+    throttle = Throttle(max_rate)
+    start_time = time.time()
+
+    # Repeat until materials uploaded meanwhile are covered too
+    while run_pass(db, model, version, source['id'], rechunk, processor, throttle, progress):
+        pass
+    print(f"✓ Version {version['id']} built: {progress['chunks']} chunks in {time.time() - start_time:.0f}s")
+
+    if not activate:
+        print(f"Activate it with: python reembed.py --activate {version['id']}")
+        return
+
+    # Uploads still being ingested write the old version; let them land first
+    deadline = time.time() + INGEST_DRAIN_SECONDS
+    while running_ingest_jobs(db) and time.time() < deadline:
+        time.sleep(5)
+        run_pass(db, model, version, source['id'], rechunk, processor, throttle, progress)
+    run_pass(db, model, version, source['id'], rechunk, processor, throttle, progress)
+
+    EmbeddingVersion.activate(version['id'])
+    print(f"✅ Version {version['id']} ({model_name}) is active; backends switch within "
+          f"{Config.EMBEDDING_VERSION_POLL_SECONDS:.0f}s")
+
+    # Anything a backend stores with the old version until every one has switched
+    print(f"Catching up with uploads ingested during the switch (at least "
+          f"{Config.EMBEDDING_VERSION_POLL_SECONDS + ENGINE_SWAP_SECONDS:.0f}s)...")
+    caught_up = catch_up_after_switch(db, model, version, source['id'], rechunk, processor, throttle, progress)
+    print(f"✓ Switch complete; {caught_up} materials ingested meanwhile were re-embedded")
+    if Config.EMBEDDING_MODEL != model_name:
+        print(f"⚠ Set EMBEDDING_MODEL={model_name} in .env so new deployments expect this model")
+    if Config.EMBEDDING_REDUCTION == 'pca' or Config.ANN_ENABLED:
+        print("⚠ Re-run build_projection.py / build_ann_index.py for the new version")
+
+
+def show_status():
+    versions = EmbeddingVersion.get_all()
+    if not versions:
+        print("No embedding versions recorded yet (run migrate_embedding_versions.py)")
+    for version in versions:
+        print(f"{version['id']:>3} {version['status']:<9} {version['model_name']:<40} "
+              f"{version['dimension'] or '?':>5} dims  {version['chunks_done']}/{version['chunks_total']} chunks")
+
+
+def activate_version(version_id):
+    """Activate a built (or retired, for rollback) version that covers every material"""
+    db = get_db()
+    version = EmbeddingVersion.get_by_id(version_id)
+    active = EmbeddingVersion.get_active()
+    if version is None or version['status'] == 'failed':
+        print(f"❌ Version {version_id} does not exist or failed")
+        return False
+    if active is not None and active['id'] == version_id:
+        print(f"✓ Version {version_id} is already active")
+        return True
+    missing = pending_materials(db, version_id, active['id']) if active else []
+    if missing:
+        print(f"❌ Version {version_id} lacks {len(missing)} materials; "
+              f"run python reembed.py --model {version['model_name']} to catch up and activate")
+        return False
+    EmbeddingVersion.activate(version_id)
+    print(f"✅ Version {version_id} ({version['model_name']}) is active")
+    return True
+
+
+def drop_retired(batch_size=5000):
+    """Delete the rows of retired and failed versions in small batches
+    
+    Refuses while a processed material has no vectors in the active version,
+    since the retired rows would be all it has.
+    """
+    db = get_db()
+    active = EmbeddingVersion.get_active()
+    if active is None:
+        print("❌ No active embedding version")
+        return False
+    missing = uncovered_materials(db, active['id'])
+    if missing:
+        print(f"❌ {len(missing)} processed materials have no vectors in active version {active['id']} "
+              f"(e.g. {', '.join(str(m['id']) for m in missing[:5])}); "
+              f"run python reembed.py --model {active['model_name']} to catch up first")
+        return False
+    for version in EmbeddingVersion.get_all():
+        if version['status'] not in ('retired', 'failed'):
+            continue
+        remaining = db.execute_query(
+            "SELECT COUNT(*) AS n FROM document_embeddings WHERE embedding_version = %s", (version['id'],)
+        )[0]['n']
+        deleted = 0
+        while deleted < remaining:
+            db.execute_query(
+                "DELETE FROM document_embeddings WHERE embedding_version = %s LIMIT %s",
+                (version['id'], batch_size),
+                fetch=False
+            )
+            deleted += min(batch_size, remaining - deleted)
+            time.sleep(0.1)  # let other writers at the table between batches
+        print(f"✓ Version {version['id']} ({version['model_name']}): {deleted} rows deleted")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed stored chunks with another model as a new version")
+    parser.add_argument('--model', default=Config.EMBEDDING_MODEL, help="sentence-transformers model to migrate to")
+    parser.add_argument('--rechunk', action='store_true', help="re-chunk from cached page texts where available")
+    parser.add_argument('--max-rate', type=float, default=Config.REEMBED_MAX_CHUNKS_PER_SECOND,
+                        help="chunks per second cap (0 = unthrottled)")
+    parser.add_argument('--threads', type=int, default=Config.REEMBED_THREADS)
+    parser.add_argument('--no-activate', action='store_true', help="build the version but keep serving the current one")
+    parser.add_argument('--activate', type=int, metavar='VERSION', help="activate an already built version")
+    parser.add_argument('--status', action='store_true', help="list embedding versions")
+    parser.add_argument('--drop-retired', action='store_true', help="delete vectors of retired versions")
+    args = parser.parse_args()
+
+    if args.status:
+        show_status()
+    elif args.activate:
+        activate_version(args.activate)
+    elif args.drop_retired:
+        drop_retired()
+    else:
+        reembed(args.model, args.rechunk, args.max_rate, args.threads, not args.no_activate)
@@ -0,0 +1,88 @@
+"""
+Semantic answer cache for TKR Chatbot
+Reuses answers for paraphrased questions by comparing query embeddings within a subject
+"""
+import threading
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Similarity histogram buckets, used to tune the hit threshold
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 1.0)
+
+
+class _Partition:
+    """Cached query embeddings for one (subject_id, top_k) scope"""
+
+    def __init__(self, dim, capacity):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.entries = [None] * capacity
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.next_slot = 0
+
+
+class SemanticCache:
+    """Cosine-similarity cache of answered questions
+
+    Each scope keeps a fixed-size ring of unit-length query embeddings, so
+    a lookup is one vectorized matrix-vector product and inserts overwrite
+    the oldest slot in O(1).
+    """
+
+    def __init__(self, dim, threshold=0.92, near_miss_margin=0.05, max_entries=1000, ttl=300):
+        self.dim = dim
+        self.threshold = threshold
+        self.near_miss_margin = near_miss_margin
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, query_vec, scope):
+        """Return (entry, similarity) of the closest live cached query
+
+        entry is None when nothing in scope is within the TTL. The caller
+        decides what to do with the similarity (hit / near miss / miss).
+        """
+        with self._lock:
+            partition = self._partitions.get(scope)
+            if partition is None:
+                return None, 0.0
+            scores = partition.vectors @ query_vec
+            scores[partition.created < time.time() - self.ttl] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] <= -1.0 or partition.entries[best] is None:
+                return None, 0.0
+            return partition.entries[best], float(scores[best])
+
+    def store(self, query_vec, scope, entry):
+        """Remember the answer to a query embedding"""
+        with self._lock:
+            partition = self._partitions.get(scope)
+            if partition is None:
+                partition = self._partitions[scope] = _Partition(self.dim, self.max_entries)
+            slot = partition.next_slot
+            partition.vectors[slot] = query_vec
+            partition.entries[slot] = entry
+            partition.created[slot] = time.time()
+            partition.next_slot = (slot + 1) % self.max_entries
+
+    def invalidate(self, subject_id=None):
+        """Forget cached answers for one subject (or every subject)"""
+        with self._lock:
+            if subject_id is None:
+                self._partitions.clear()
+            else:
+                # Global (subject_id=None) answers may draw on any subject
+                for scope in [s for s in self._partitions if s[0] in (subject_id, None)]:
+                    del self._partitions[scope]
+
+    def stats(self):
+        """Return the number of cached queries per scope"""
+        with self._lock:
+            return {
+                f"{subject_id}:{top_k}": sum(entry is not None for entry in partition.entries)
+                for (subject_id, top_k), partition in self._partitions.items()
+            }
@@ -0,0 +1,168 @@
+"""
+Shared answer cache for TKR Chatbot
+SQLite-backed second cache tier shared by every worker on a node, with per-subject generations
+"""
+import os
+import json
+import random
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Scope id used for answers that were not restricted to one subject
+GLOBAL_SCOPE = 0
+
+
+class InProcessGenerations:
+    """Per-subject generation counters for a single process (no shared tier)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations = {}
+
+    def generation(self, subject_id):
+        return self._generations.get(subject_id or GLOBAL_SCOPE, 0)
+
+    def bump(self, subject_id):
+        with self._lock:
+            for scope in {subject_id or GLOBAL_SCOPE, GLOBAL_SCOPE}:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+
+
+class SharedAnswerCache:
+    """Answer cache in a local SQLite file, shared across processes and restarts
+
+    Every subject has a generation counter that is part of each cache key.
+    Bumping it (on upload or delete) makes every older answer for that
+    subject unreachable at once in all workers; answers that were not
+    scoped to a subject follow the global generation, which is bumped
+    alongside any subject.
+    """
+
+    def __init__(self, path, ttl=3600, purge_probability=0.01):
+        self.path = path
+        self.ttl = ttl
+        self.purge_probability = purge_probability
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    cache_key TEXT PRIMARY KEY,
+                    scope INTEGER NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers (scope)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    scope INTEGER PRIMARY KEY,
+                    generation INTEGER NOT NULL
+                )
+            """)
+
+    def _connection(self):
+        """Return this thread's connection (sqlite3 connections are not thread-safe)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def generation(self, subject_id):
+        """Return the current generation of a subject (or the global scope)
+        
+        None means the cache file could not be read; callers then must not
+        trust any cached answer for this request.
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT generation FROM generations WHERE scope = ?",
+                (subject_id or GLOBAL_SCOPE,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache generation read failed: {e}")
+            return None
+        return row[0] if row else 0
+
+    def all_generations(self):
+        """Return every recorded generation by scope, or None if the cache file could not be read"""
+        try:
+            rows = self._connection().execute("SELECT scope, generation FROM generations").fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache generation read failed: {e}")
+            return None
+        return dict(rows)
+
+    def bump(self, subject_id):
+        """Invalidate every cached answer that may depend on a subject
+        
+        Returns False if the cache file could not be written; the caller
+        carries on, and answers stored meanwhile expire after the TTL.
+        """
+        scopes = sorted({subject_id or GLOBAL_SCOPE, GLOBAL_SCOPE})
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for scope in scopes:
+                    conn.execute("""
+                        INSERT INTO generations (scope, generation) VALUES (?, 1)
+                        ON CONFLICT(scope) DO UPDATE SET generation = generation + 1
+                    """, (scope,))
+                    conn.execute("DELETE FROM answers WHERE scope = ?", (scope,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache generation bump for subject {subject_id} failed: {e}")
+            return False
+        logger.info(f"Bumped answer cache generation for subject {subject_id}")
+        return True
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key)
+
+    def get(self, key):
+        """Return a cached answer, or None if missing or expired"""
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM answers WHERE cache_key = ?",
+                (self._key(key),)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed: {e}")
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, subject_id, value):
+        """Store an answer; expired rows are purged occasionally"""
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (cache_key, scope, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self._key(key), subject_id or GLOBAL_SCOPE, json.dumps(value, default=str), time.time() + self.ttl)
+            )
+            if random.random() < self.purge_probability:
+                conn.execute("DELETE FROM answers WHERE expires_at < ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache write failed: {e}")
+
+    def stats(self):
+        """Return the number of stored answers"""
+        try:
+            row = self._connection().execute("SELECT COUNT(*) FROM answers").fetchone()
+        except sqlite3.Error as e:
+            return {'entries': None, 'path': self.path, 'error': str(e)}
+        return {'entries': row[0], 'path': self.path}
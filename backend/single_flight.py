@@ -0,0 +1,98 @@
+"""
+Request coalescing for TKR Chatbot
+Concurrent identical (or semantically equivalent) questions share one in-flight computation
+"""
+import threading
+import logging
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """One in-flight computation, the query embedding it answers and the chunks it retrieved"""
+
+    def __init__(self, vector, scope, chunk_ids):
+        self.future = Future()
+        self.vector = vector
+        self.scope = scope
+        self.chunk_ids = chunk_ids
+
+
+def chunk_overlap(a, b):
+    """Jaccard overlap of two sets of retrieved chunk ids (1.0 when both are empty)"""
+    union = a | b
+    return len(a & b) / len(union) if union else 1.0
+
+
+class SingleFlight:
+    """Run at most one computation per key at a time
+
+    The first caller for a key (the leader) runs the function; callers
+    arriving while it is in flight wait on the same future. When a query
+    vector is given, a caller also joins an in-flight call in the same
+    scope whose vector has cosine similarity >= threshold and, when
+    min_overlap is set, whose retrieved chunk ids overlap the caller's
+    by at least min_overlap (the semantic cache's false-hit check).
+    """
+
+    def __init__(self, threshold=None, min_overlap=None):
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def _find_similar(self, vector, scope, chunk_ids):
+        best, best_score = None, self.threshold
+        for call in self._calls.values():
+            if call.scope != scope or call.vector is None:
+                continue
+            if self.min_overlap is not None and (
+                chunk_ids is None or call.chunk_ids is None
+                or chunk_overlap(call.chunk_ids, chunk_ids) < self.min_overlap
+            ):
+                continue
+            score = float(np.dot(call.vector, vector))
+            if score >= best_score:
+                best, best_score = call, score
+        return best
+
+    def do(self, key, fn, vector=None, scope=None, chunk_ids=None):
+        """Return (result, shared); shared is True when another caller did the work"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None and vector is not None and self.threshold is not None:
+                call = self._find_similar(vector, scope, chunk_ids)
+            if call is not None:
+                self.followers += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call(vector, scope, chunk_ids)
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            return call.future.result(), True
+
+        try:
+            call.future.set_result(fn())
+        except BaseException as e:
+            call.future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return call.future.result(), False
+
+    def stats(self):
+        """Return in-flight count and the share of callers served by another's computation"""
+        with self._lock:
+            total = self.leaders + self.followers
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'coalescing_ratio': self.followers / total if total else 0.0
+            }
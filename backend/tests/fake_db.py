@@ -0,0 +1,68 @@
+"""In-memory stand-in for the document_embeddings/materials queries VectorIndex runs"""
+from embedding_codec import pack_embedding
+
+
+class EmbeddingsDB:
+    """Rows of document_embeddings joined with their material, answered like Database.execute_query"""
+
+    def __init__(self):
+        self.rows = []
+        self.next_id = 1
+        self.materials = {}
+
+    def add_material(self, subject_id, material_id, processed=True):
+        self.materials[material_id] = {'subject_id': subject_id, 'title': f"m{material_id}", 'is_processed': processed}
+
+    def add(self, subject_id, material_id, vectors, version=1, processed=True):
+        """Store one chunk per vector and return their ids"""
+        self.add_material(subject_id, material_id, processed)
+        ids = []
+        for index, vector in enumerate(vectors):
+            self.rows.append({
+                'id': self.next_id, 'chunk_text': f"material {material_id} chunk {index}", 'page_number': 1,
+                'material_id': material_id, 'embedding_vector': pack_embedding(vector), 'title': f"m{material_id}",
+                'subject_id': subject_id, 'is_processed': processed, 'embedding_version': version,
+            })
+            ids.append(self.next_id)
+            self.next_id += 1
+        return ids
+
+    def delete_material(self, material_id):
+        self.rows = [row for row in self.rows if row['material_id'] != material_id]
+
+    def execute_many(self, query, rows):
+        assert 'INSERT INTO document_embeddings' in query, query
+        for material_id, chunk_text, chunk_index, page_number, blob, _, version in rows:
+            material = self.materials[material_id]
+            self.rows.append({
+                'id': self.next_id, 'chunk_text': chunk_text, 'chunk_index': chunk_index, 'page_number': page_number,
+                'material_id': material_id, 'embedding_vector': blob, 'title': material['title'],
+                'subject_id': material['subject_id'], 'is_processed': material['is_processed'],
+                'embedding_version': version,
+            })
+            self.next_id += 1
+        return len(rows)
+
+    def execute_query(self, query, params=None, fetch=True):
+        if 'FROM materials WHERE id' in query:
+            material = self.materials.get(params[0])
+            return [dict(material)] if material else []
+        if 'SELECT id FROM document_embeddings WHERE material_id' in query:
+            material_id, version = params
+            rows = [row for row in self.rows if row['material_id'] == material_id and row['embedding_version'] == version]
+            return [{'id': row['id']} for row in sorted(rows, key=lambda row: row.get('chunk_index', 0))]
+        if query.lstrip().startswith('DELETE FROM document_embeddings'):
+            material_id, version = params
+            self.rows = [row for row in self.rows
+                         if not (row['material_id'] == material_id and row['embedding_version'] == version)]
+            return 0
+        if 'de.id IN' in query:
+            wanted = set(params)
+            return [dict(row) for row in self.rows if row['id'] in wanted]
+        if 'de.id > %s' in query:
+            version, *subject_ids, last_id, limit = params
+            rows = [row for row in self.rows
+                    if row['is_processed'] and row['embedding_version'] == version and row['id'] > last_id
+                    and ('m.subject_id IN' not in query or row['subject_id'] in subject_ids)]
+            return [dict(row) for row in sorted(rows, key=lambda row: row['id'])[:limit]]
+        raise AssertionError(f"Unexpected query: {query}")
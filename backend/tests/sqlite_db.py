@@ -0,0 +1,74 @@
+"""In-memory SQLite stand-in for the MySQL Database, with the tables ingestion writes to"""
+import re
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE materials (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, subject_id INT, title TEXT, description TEXT, file_path TEXT,
+    file_type TEXT, file_size INT, upload_date TEXT DEFAULT CURRENT_TIMESTAMP, is_processed BOOLEAN DEFAULT 0,
+    content_hash TEXT
+);
+CREATE TABLE document_embeddings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, material_id INT, chunk_text TEXT, chunk_index INT, page_number INT,
+    embedding_vector BLOB, text_hash TEXT, embedding_version INT NOT NULL DEFAULT 1
+);
+CREATE TABLE material_pages (
+    material_id INT, page_number INT, page_text TEXT, PRIMARY KEY (material_id, page_number)
+);
+CREATE TABLE extracted_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, material_id INT, image_path TEXT, page_number INT, image_type TEXT,
+    caption TEXT, source TEXT DEFAULT 'file', bbox TEXT, xref INT
+);
+CREATE TABLE ingest_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, material_id INT, status TEXT DEFAULT 'queued',
+    stage TEXT DEFAULT 'queued', progress REAL DEFAULT 0, attempts INT DEFAULT 0, error TEXT, claimed_by TEXT,
+    reused_from INT, chunks_total INT DEFAULT 0, chunks_reused INT DEFAULT 0, heartbeat_at TEXT,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP, finished_at TEXT
+);
+"""
+
+
+def _translate(query):
+    """Rewrite the MySQL-only syntax the models use"""
+    query = query.replace('NOW() - INTERVAL %s SECOND', "datetime('now', '-' || %s || ' seconds')")
+    query = query.replace('NOW()', "datetime('now')")
+    query = re.sub(
+        r'ON DUPLICATE KEY UPDATE (\w+) = VALUES\(\1\)',
+        r'ON CONFLICT(material_id, page_number) DO UPDATE SET \1 = excluded.\1',
+        query
+    )
+    return query.replace('%s', '?')
+
+
+class SqliteDB:
+    """Answers execute_query/execute_many like database.Database, from one shared connection"""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def execute_query(self, query, params=None, fetch=True):
+        with self._lock:
+            cursor = self.conn.execute(_translate(query), tuple(params or ()))
+            if fetch:
+                return [dict(row) for row in cursor.fetchall()]
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def execute_many(self, query, rows):
+        with self._lock:
+            cursor = self.conn.executemany(_translate(query), list(rows))
+            self.conn.commit()
+            return cursor.rowcount
+
+
+def install(monkeypatch, *modules):
+    """Point get_db of the database module and of each given module at a fresh SqliteDB"""
+    import database
+    db = SqliteDB()
+    for module in (database, *modules):
+        monkeypatch.setattr(module, 'get_db', lambda: db)
+    return db
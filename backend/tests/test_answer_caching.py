@@ -0,0 +1,105 @@
+"""Failed answer generations must not be cached in any tier, and paraphrases only share fitting answers"""
+import threading
+import time
+import numpy as np
+import pytest
+from config import Config
+from gemini_rag import GeminiRAGEngine
+from answer_cache import LRUCache
+from semantic_cache import SemanticCache
+from shared_cache import SharedAnswerCache
+from single_flight import SingleFlight
+from vector_index import VectorIndex
+
+DIM = 8
+
+
+class FlakyModel:
+    """Stands in for the Gemini model: fails the first call, then answers"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("503 service unavailable")
+        return type('Response', (), {'text': 'An answer'})()
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'SEMANTIC_CACHE_ENABLED', True)
+    engine = GeminiRAGEngine.__new__(GeminiRAGEngine)
+    engine.answer_cache = LRUCache()
+    engine.semantic_cache = SemanticCache(DIM, threshold=0.9)
+    engine.shared_cache = SharedAnswerCache(str(tmp_path / 'answers.sqlite3'))
+    engine.generations = engine.shared_cache
+    engine._seen_generations = {}
+    engine._generations_lock = threading.Lock()
+    engine.vector_index = VectorIndex(DIM)
+    engine._indexed_generations = {}
+    engine._reload_lock = threading.Lock()
+    engine.inflight = SingleFlight()
+    engine.gemini_model = FlakyModel()
+    engine.embed_query = lambda text: np.ones((1, DIM), dtype=np.float32)
+    engine.search_similar_chunks = lambda *args, **kwargs: []
+    return engine
+
+
+def test_failed_generation_is_not_cached(engine):
+    failed = engine.answer_question("What is a stack?", subject_id=1)
+    assert failed['error']
+    assert engine.answer_cache.stats()['entries'] == 0
+    assert engine.shared_cache.stats()['entries'] == 0
+
+    # The next asker gets a fresh attempt, which is cached once it succeeds
+    answered = engine.answer_question("What is a stack?", subject_id=1)
+    assert answered['answer'] == 'An answer'
+    assert engine.gemini_model.calls == 2
+    assert engine.answer_question("What is a stack?", subject_id=1)['answer'] == 'An answer'
+    assert engine.gemini_model.calls == 2
+
+
+def test_unreadable_generation_bypasses_caches(engine):
+    engine.gemini_model.calls = 1  # answer successfully from now on
+    engine.shared_cache.generation = lambda subject_id: None
+    assert engine.answer_question("What is a queue?", subject_id=2)['answer'] == 'An answer'
+    assert engine.answer_question("What is a queue?", subject_id=2)['answer'] == 'An answer'
+    assert engine.gemini_model.calls == 3
+    assert engine.answer_cache.stats()['entries'] == 0
+
+
+def test_paraphrase_joins_only_with_overlapping_chunks():
+    flight = SingleFlight(threshold=0.9, min_overlap=0.6)
+    vector = np.ones(DIM, dtype=np.float32) / np.sqrt(DIM)
+    release = threading.Event()
+    started = threading.Event()
+
+    def lead():
+        started.set()
+        release.wait(5)
+        return 'leader answer'
+
+    leader = threading.Thread(
+        target=flight.do, args=('q1', lead), kwargs={'vector': vector, 'scope': (1, 5), 'chunk_ids': {1, 2, 3}}
+    )
+    leader.start()
+    started.wait(5)
+
+    # Same embedding but different retrieved chunks: computes its own answer
+    result, shared = flight.do('q2', lambda: 'own answer', vector=vector, scope=(1, 5), chunk_ids={7, 8, 9})
+    assert (result, shared) == ('own answer', False)
+
+    joined = {}
+    follower = threading.Thread(target=lambda: joined.update(zip(
+        ('result', 'shared'),
+        flight.do('q3', lambda: 'own answer', vector=vector, scope=(1, 5), chunk_ids={1, 2, 3})
+    )))
+    follower.start()
+    while flight.stats()['followers'] == 0:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert joined == {'result': 'leader answer', 'shared': True}
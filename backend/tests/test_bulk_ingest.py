@@ -0,0 +1,100 @@
+"""An interrupted bulk_ingest.py run can be started again: done files are skipped, half-written ones redone"""
+import pytest
+import bulk_ingest
+import ingest_queue
+import models
+from bulk_ingest import BatchWriter, prepare
+from config import Config
+from content_hash import file_sha256
+from models import IngestJob, Material
+from sqlite_db import install
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(Config, 'UPLOAD_DEDUP_ENABLED', False)
+    (tmp_path / 'uploads').mkdir()
+    return install(monkeypatch, models, ingest_queue, bulk_ingest)
+
+
+def _pdf(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def _stats():
+    return {'ingested': 0, 'skipped': 0, 'copied': 0, 'failed': 0}
+
+
+def _existing(path, subject_id=1):
+    return Material.create(subject_id, 'notes', '', path, 'pdf', 1, file_sha256(path))
+
+
+def _rows(db, table, material_id):
+    return db.execute_query(f"SELECT COUNT(*) AS n FROM {table} WHERE material_id = %s", (material_id,))[0]['n']
+
+
+def test_new_file_is_created_once_per_run(db, tmp_path):
+    path = _pdf(tmp_path, 'a.pdf', b'%PDF a')
+    stats, seen = _stats(), set()
+    material = prepare((path, 1, None, ''), stats, seen)
+    assert material['title'] == 'a.pdf' and not material['is_processed'] and material['job_id'] is None
+
+    assert prepare((path, 1, None, ''), stats, seen) is None
+    assert stats['skipped'] == 1
+
+
+def test_processed_file_is_skipped(db, tmp_path):
+    path = _pdf(tmp_path, 'a.pdf', b'%PDF a')
+    Material.mark_processed(_existing(path))
+    stats = _stats()
+    assert prepare((path, 1, None, ''), stats, set()) is None
+    assert stats['skipped'] == 1
+    # The same file for another subject is a new material
+    assert prepare((path, 2, None, ''), stats, set())['subject_id'] == 2
+
+
+def test_half_written_material_is_cleared_and_redone(db, tmp_path):
+    path = _pdf(tmp_path, 'a.pdf', b'%PDF a')
+    material_id = _existing(path)
+    # Rows of an earlier run that crashed before marking the material processed
+    db.execute_query("INSERT INTO document_embeddings (material_id, chunk_text, chunk_index) VALUES (%s, 'x', 0)",
+                     (material_id,), fetch=False)
+    db.execute_query("INSERT INTO material_pages (material_id, page_number, page_text) VALUES (%s, 1, 'x')",
+                     (material_id,), fetch=False)
+    db.execute_query("INSERT INTO extracted_images (material_id, image_path, page_number) VALUES (%s, 'x.png', 1)",
+                     (material_id,), fetch=False)
+    failed_job = IngestJob.create(material_id)
+    IngestJob.mark_failed(failed_job, 'parse error')
+
+    material = prepare((path, 1, None, ''), _stats(), set())
+    assert (material['id'], material['job_id']) == (material_id, failed_job)
+    for table in ('document_embeddings', 'material_pages', 'extracted_images'):
+        assert _rows(db, table, material_id) == 0
+
+
+def test_material_still_queued_in_the_backend_is_left_alone(db, tmp_path):
+    path = _pdf(tmp_path, 'a.pdf', b'%PDF a')
+    IngestJob.create(_existing(path))
+    stats = _stats()
+    assert prepare((path, 1, None, ''), stats, set()) is None
+    assert stats['skipped'] == 1
+
+
+def test_material_is_processed_only_once_its_rows_are_written(db, tmp_path):
+    path = _pdf(tmp_path, 'a.pdf', b'%PDF a')
+    material_id = _existing(path)
+    job_id = IngestJob.create(material_id)
+    IngestJob.mark_failed(job_id, 'parse error')
+    writer = BatchWriter(batch_size=100)
+    writer.add(material_id, [(material_id, 'chunk', 0, 1, b'', 'hash', 1)], [(1, 'page text')], [], job_id=job_id)
+
+    # A crash now leaves the material unprocessed, so the next run redoes it
+    assert not Material.get_by_id(material_id)['is_processed']
+    writer.flush()
+    assert Material.get_by_id(material_id)['is_processed']
+    assert IngestJob.get_by_id(job_id)['status'] == 'done'
+    assert _rows(db, 'document_embeddings', material_id) == 1
+    assert _rows(db, 'material_pages', material_id) == 1
@@ -0,0 +1,37 @@
+"""unpack_matrix decodes every stored format into one preallocated float32 matrix"""
+import json
+import numpy as np
+from embedding_codec import pack_embedding, unpack_matrix
+
+
+def test_unpack_matrix_decodes_mixed_rows_in_place():
+    vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+    blobs = [
+        pack_embedding(vectors[0]),
+        pack_embedding(vectors[1], dtype='float16'),
+        json.dumps(vectors[2].tolist()),
+        pack_embedding(vectors[3]),
+    ]
+
+    matrix, kept = unpack_matrix(blobs, 3)
+
+    assert kept == [0, 1, 2, 3]
+    assert matrix.dtype == np.float32 and matrix.flags['C_CONTIGUOUS']
+    np.testing.assert_array_equal(matrix, vectors)
+
+
+def test_unpack_matrix_skips_invalid_rows():
+    good = np.ones(3, dtype=np.float32)
+    blobs = [
+        pack_embedding(np.ones(4, dtype=np.float32)),  # wrong dimension
+        pack_embedding(good),
+        pack_embedding(good)[:-4],  # truncated payload
+        b'not an embedding',
+        pack_embedding(good * 2),
+    ]
+
+    matrix, kept = unpack_matrix(blobs, 3)
+
+    assert kept == [1, 4]
+    np.testing.assert_array_equal(matrix, [good, good * 2])
+    assert unpack_matrix([], 3)[0].shape == (0, 3)
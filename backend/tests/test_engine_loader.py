@@ -0,0 +1,107 @@
+"""Engine loading: readiness reporting, and deletes made meanwhile reach the engine before it serves"""
+import threading
+import numpy as np
+from engine_loader import EngineLoader
+from vector_index import VectorIndex
+
+DIM = 4
+
+
+class IndexEngine:
+    """Just enough of GeminiRAGEngine: an index loaded from a snapshot of the 'database'"""
+
+    def __init__(self, materials):
+        self.vector_index = VectorIndex(DIM)
+        for material_id, vector in materials.items():
+            self.vector_index.add_material(1, material_id, f"m{material_id}", [material_id],
+                                           [{'text': f"chunk {material_id}", 'page': 1}], vector[None, :])
+
+    def remove_material(self, material_id):
+        self.vector_index.remove_material(material_id)
+
+
+def _materials():
+    return {material_id: np.eye(DIM, dtype=np.float32)[material_id] for material_id in (1, 2)}
+
+
+def _blocking_build(loaded, release):
+    def build(mark):
+        engine = IndexEngine(_materials())  # reads the rows before the delete below
+        loaded.set()
+        release.wait(5)
+        return engine
+    return build
+
+
+def test_delete_during_initial_load_is_applied_before_publishing():
+    loaded, release = threading.Event(), threading.Event()
+    loader = EngineLoader([]).start(_blocking_build(loaded, release))
+    assert loaded.wait(5)
+
+    assert loader.apply(lambda engine: engine.remove_material(1)) is False
+    release.set()
+    engine = loader.wait(5)
+
+    assert engine is not None
+    hits = engine.vector_index.search(np.eye(DIM, dtype=np.float32)[1], subject_id=1, top_k=5)
+    assert [hit['material_id'] for hit in hits] == [2]
+
+
+def test_delete_during_rebuild_reaches_old_and_new_engine():
+    loader = EngineLoader([]).start(lambda mark: IndexEngine(_materials()))
+    old = loader.wait(5)
+    loaded, release = threading.Event(), threading.Event()
+    rebuilt = threading.Event()
+    build = _blocking_build(loaded, release)
+    loader.watch(lambda engine: not rebuilt.is_set(), lambda mark: build(mark), interval=0.01)
+    assert loaded.wait(5)
+
+    assert loader.apply(lambda engine: engine.remove_material(2)) is True
+    rebuilt.set()
+    release.set()
+    for _ in range(500):
+        if loader.engine is not old:
+            break
+        threading.Event().wait(0.01)
+
+    for engine in (old, loader.engine):
+        hits = engine.vector_index.search(np.eye(DIM, dtype=np.float32)[2], subject_id=1, top_k=5)
+        assert [hit['material_id'] for hit in hits] == [1]
+    assert loader.engine is not old
+
+
+def test_readiness_reports_components_as_they_load():
+    loaded, release = threading.Event(), threading.Event()
+
+    def build(mark):
+        mark('embedding_model')
+        loaded.set()
+        release.wait(5)
+        mark('vector_index')
+        return IndexEngine({})
+
+    loader = EngineLoader(['embedding_model', 'vector_index']).start(build)
+    assert loaded.wait(5)
+    readiness = loader.readiness()
+    # /api/ready answers 503 until 'ready'; require_engine waits for wait() to return an engine
+    assert (readiness['ready'], readiness['loading']) == (False, True)
+    assert readiness['components']['embedding_model']['ready'] is True
+    assert readiness['components']['vector_index'] == {'ready': False, 'seconds': None}
+    assert loader.wait(0.01) is None
+
+    release.set()
+    assert loader.wait(5) is not None
+    readiness = loader.readiness()
+    assert (readiness['ready'], readiness['loading'], readiness['error']) == (True, False, None)
+    assert all(component['ready'] for component in readiness['components'].values())
+
+
+def test_failed_load_is_reported():
+    def build(mark):
+        raise RuntimeError("database unreachable")
+
+    loader = EngineLoader(['vector_index']).start(build)
+    assert loader.wait(5) is None
+    readiness = loader.readiness()
+    assert (readiness['ready'], readiness['loading']) == (False, False)
+    assert readiness['error'] == "database unreachable"
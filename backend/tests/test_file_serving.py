@@ -0,0 +1,57 @@
+"""Downloads answer Range and conditional requests, or hand the transfer to nginx"""
+import pytest
+from flask import Flask
+from config import Config
+from file_serving import send_static
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / 'notes.pdf'
+    path.write_bytes(CONTENT)
+    return path
+
+
+def _client(path, **kwargs):
+    app = Flask(__name__)
+    app.add_url_rule('/file', 'file', lambda: send_static(str(path), **kwargs))
+    return app.test_client()
+
+
+def test_range_request_returns_partial_content(pdf, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_OFFLOAD', '')
+    response = _client(pdf, mimetype='application/pdf').get('/file', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f"bytes 100-199/{len(CONTENT)}"
+    assert response.data == CONTENT[100:200]
+
+
+def test_matching_etag_returns_not_modified(pdf, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_OFFLOAD', '')
+    client = _client(pdf, etag='content-hash')
+    first = client.get('/file')
+    assert first.status_code == 200 and first.headers['ETag'] == '"content-hash"'
+    assert 'no-cache' in first.headers['Cache-Control']
+
+    again = client.get('/file', headers={'If-None-Match': '"content-hash"'})
+    assert again.status_code == 304 and again.data == b''
+    assert client.get('/file', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_x_accel_redirect_hands_off_files_under_the_root(pdf, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_OFFLOAD', 'x-accel-redirect')
+    monkeypatch.setattr(Config, 'X_ACCEL_ROOT', str(tmp_path))
+    monkeypatch.setattr(Config, 'X_ACCEL_PREFIX', '/protected-uploads/')
+    response = _client(pdf, as_attachment=True, download_name='unit 1.pdf', max_age=60).get('/file')
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Accel-Redirect'] == '/protected-uploads/notes.pdf'
+    assert response.headers['Content-Type'] == 'application/pdf'
+    assert response.headers['Content-Disposition'] == "attachment; filename*=UTF-8''unit%201.pdf"
+    assert 'max-age=60' in response.headers['Cache-Control']
+
+    # Files outside the root are still served by the app
+    monkeypatch.setattr(Config, 'X_ACCEL_ROOT', str(tmp_path / 'elsewhere'))
+    response = _client(pdf).get('/file')
+    assert 'X-Accel-Redirect' not in response.headers and response.data == CONTENT
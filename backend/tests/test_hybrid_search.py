@@ -0,0 +1,55 @@
+"""The BM25 index follows the vector index, and rank fusion favours chunks both searches find"""
+import numpy as np
+import pytest
+from bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+from vector_index import VectorIndex
+
+DIM = 4
+
+
+def _index():
+    index = VectorIndex(DIM)
+    bm25 = BM25Index()
+    index.listeners.append(bm25.sync_subject)
+    return index, bm25
+
+
+def _add(index, subject_id, material_id, first_id, texts):
+    index.add_material(subject_id, material_id, f"m{material_id}", list(range(first_id, first_id + len(texts))),
+                       [{'text': text, 'page': 1} for text in texts], np.eye(DIM, dtype=np.float32)[:len(texts)])
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is the Time-Complexity of a B+ tree?") == ['time', 'complexity', 'b', 'tree']
+
+
+def test_keyword_index_follows_adds_and_deletes():
+    index, bm25 = _index()
+    _add(index, 1, 1, 1, ["binary search tree rotation", "hash table collisions"])
+    _add(index, 2, 2, 10, ["red black tree insertion"])
+
+    assert [hit['chunk_id'] for hit in bm25.search("tree", subject_id=1)] == [1]
+    assert {hit['chunk_id'] for hit in bm25.search("tree")} == {1, 10}
+
+    index.remove_material(1)
+    assert bm25.search("tree", subject_id=1) == []
+    index.remove_subject(2)
+    assert bm25.search("tree") == []
+
+
+def test_rarer_terms_score_higher():
+    index, bm25 = _index()
+    _add(index, 1, 1, 1, ["stack push pop", "stack overflow", "stack heap memory"])
+    hits = bm25.search("stack overflow", subject_id=1)
+    assert hits[0]['chunk_id'] == 2
+    assert hits[0]['bm25_score'] > hits[1]['bm25_score']
+
+
+def test_fusion_ranks_chunks_found_by_both_searches_first():
+    vector = [{'chunk_id': 1, 'similarity': 0.9}, {'chunk_id': 2, 'similarity': 0.8}, {'chunk_id': 3, 'similarity': 0.7}]
+    keyword = [{'chunk_id': 3, 'bm25_score': 7.0}, {'chunk_id': 4, 'bm25_score': 5.0}]
+    fused = reciprocal_rank_fusion([vector, keyword], top_k=3)
+
+    assert [hit['chunk_id'] for hit in fused] == [3, 1, 2]
+    assert fused[0]['similarity'] == 0.7 and fused[0]['bm25_score'] == 7.0
+    assert fused[0]['fusion_score'] == pytest.approx(1 / 63 + 1 / 61)
@@ -0,0 +1,102 @@
+"""An ingest job runs under one claim at a time; a superseded worker stops writing"""
+import threading
+import time
+import pytest
+import ingest_queue
+import models
+from ingest_queue import IngestWorkerPool
+from models import IngestJob, IngestJobSuperseded
+from sqlite_db import install
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = install(monkeypatch, models, ingest_queue)
+    db.execute_query(
+        "INSERT INTO materials (subject_id, title, file_path, file_type) VALUES (1, 'notes', '/tmp/notes.pdf', 'pdf')",
+        fetch=False
+    )
+    return db
+
+
+def _claim(job):
+    return job['claimed_by'], job['attempts']
+
+
+def _age_heartbeat(db, job_id, seconds):
+    db.execute_query(
+        "UPDATE ingest_jobs SET heartbeat_at = datetime('now', %s) WHERE id = %s",
+        (f"-{seconds} seconds", job_id), fetch=False
+    )
+
+
+def test_a_queued_job_is_claimed_once(db):
+    job_id = IngestJob.create(1)
+    job = IngestJob.claim('worker-a')
+    assert job['id'] == job_id and job['status'] == 'running' and job['attempts'] == 1
+    assert IngestJob.claim('worker-b') is None
+
+
+def test_requeue_spares_jobs_with_a_fresh_heartbeat(db):
+    job_id = IngestJob.create(1)
+    job = IngestJob.claim('worker-a')
+    IngestJob.requeue_stale(60)
+    assert IngestJob.get_by_id(job_id)['status'] == 'running'
+
+    _age_heartbeat(db, job_id, 120)
+    assert IngestJob.heartbeat(job_id, _claim(job)) is True
+    IngestJob.requeue_stale(60)
+    assert IngestJob.get_by_id(job_id)['status'] == 'running'
+
+
+def test_superseded_claim_cannot_write(db):
+    job_id = IngestJob.create(1)
+    old = IngestJob.claim('worker-a')
+    _age_heartbeat(db, job_id, 120)
+    IngestJob.requeue_stale(60)
+    new = IngestJob.claim('worker-b')
+    assert new['attempts'] == 2
+
+    assert IngestJob.heartbeat(job_id, _claim(old)) is False
+    IngestJob.update_progress(job_id, 'processing', 0.9, claim=_claim(old))
+    IngestJob.mark_done(job_id, chunks_total=5, claim=_claim(old))
+    IngestJob.mark_failed(job_id, 'late failure', claim=_claim(old))
+    job = IngestJob.get_by_id(job_id)
+    assert (job['status'], job['stage'], job['claimed_by'], job['error']) == ('running', 'starting', 'worker-b', None)
+
+    assert IngestJob.heartbeat(job_id, _claim(new)) is True
+    IngestJob.mark_done(job_id, chunks_total=5, claim=_claim(new))
+    assert IngestJob.get_by_id(job_id)['status'] == 'done'
+
+
+def test_worker_abandons_a_job_claimed_again(db):
+    job_id = IngestJob.create(1)
+    outcome = {}
+    finished = threading.Event()
+
+    def handler(job, material, report):
+        try:
+            # The job is re-queued and taken over by another process meanwhile
+            db.execute_query("UPDATE ingest_jobs SET status = 'queued' WHERE id = %s", (job_id,), fetch=False)
+            outcome['other'] = IngestJob.claim('other-process')
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                report('processing', 0.5)
+                time.sleep(0.01)
+            outcome['stopped'] = False
+        except IngestJobSuperseded:
+            outcome['stopped'] = True
+            raise
+        finally:
+            finished.set()
+        return {'chunks_total': 1}
+
+    pool = IngestWorkerPool(handler, workers=1, poll_interval=0.05, heartbeat_interval=0.05).start()
+    try:
+        assert finished.wait(10)
+    finally:
+        pool.stop(5)
+
+    assert outcome['stopped'] is True
+    job = IngestJob.get_by_id(job_id)
+    assert (job['status'], job['claimed_by'], job['attempts']) == ('running', 'other-process', 2)
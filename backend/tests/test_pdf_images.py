@@ -0,0 +1,110 @@
+"""Embedded images: a stream drawn on many pages is kept once, a broken one only loses its page's images"""
+import os
+import random
+import pytest
+from benchmark_pdf import _image_stream, _text_stream
+from pdf_processor import PDFProcessor
+
+pytest.importorskip('pdfplumber')
+
+LOGO_XREF = 4
+
+
+def _logo_pdf(path, pages):
+    """Every page draws the shared logo twice; odd pages also draw a figure of their own"""
+    rng = random.Random(0)
+
+    def image(data, width, height):
+        return (f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceRGB "
+                f"/BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>\nstream\n").encode() + data + b"\nendstream"
+
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        LOGO_XREF: image(*_image_stream(rng)),
+    }
+    number, kids = 5, []
+    for page_index in range(pages):
+        content = _text_stream(rng) + b"\nq 50 0 0 30 20 740 cm /Logo Do Q\nq 50 0 0 30 540 740 cm /Logo Do Q"
+        xobjects = f"/Logo {LOGO_XREF} 0 R"
+        if page_index % 2:
+            objects[number + 2] = image(*_image_stream(rng))
+            xobjects += f" /Fig {number + 2} 0 R"
+            content += b"\nq 192 0 0 128 72 120 cm /Fig Do Q"
+        objects[number + 1] = f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream"
+        objects[number] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << "
+                           f"/Font << /F1 3 0 R >> /XObject << {xobjects} >> >> /Contents {number + 1} 0 R >>").encode()
+        kids.append(number)
+        number += 3
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {pages} >>".encode()
+
+    offsets = {}
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        for k in range(1, number):
+            offsets[k] = f.tell()
+            f.write(f"{k} 0 obj\n".encode() + objects.get(k, b"null") + b"\nendobj\n")
+        xref_offset = f.tell()
+        f.write(f"xref\n0 {number}\n0000000000 65535 f \n".encode())
+        for k in range(1, number):
+            f.write(f"{offsets[k]:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {number} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+    return str(path)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_shared_stream_is_recorded_once(tmp_path, workers):
+    path = _logo_pdf(tmp_path / 'logo.pdf', 10)
+    processor = PDFProcessor(workers=workers)
+    processor.pages_per_task = 3
+    processor.lazy_images = True
+    try:
+        images = processor.extract_images(path, 1)
+    finally:
+        processor.close()
+
+    embedded = [(image['page'], image['xref']) for image in images if image['source'] == 'embedded']
+    assert [xref for _, xref in embedded].count(LOGO_XREF) == 1
+    # The first page that draws the logo keeps the row, plus one row per figure
+    assert embedded[0] == (1, LOGO_XREF)
+    assert len(embedded) == 1 + 5
+    assert sum(image['source'] == 'crop' for image in images) == 2 * 10 + 5
+
+
+def test_duplicate_files_are_removed_in_eager_mode(tmp_path, monkeypatch):
+    from config import Config
+    monkeypatch.setattr(Config, 'IMAGES_FOLDER', str(tmp_path))
+    path = _logo_pdf(tmp_path / 'logo.pdf', 10)
+    processor = PDFProcessor(workers=3)
+    processor.pages_per_task = 3
+    processor.lazy_images = False
+    try:
+        images = processor.extract_images(path, 1)
+    finally:
+        processor.close()
+
+    assert [image.get('xref') for image in images].count(LOGO_XREF) == 1
+    # Later ranges wrote the logo too; only the files of kept rows remain
+    assert sorted(p.name for p in tmp_path.glob('*.png')) == sorted(
+        os.path.basename(image['path']) for image in images
+    )
+
+
+def test_page_with_broken_images_keeps_its_text(tmp_path, monkeypatch):
+    path = _logo_pdf(tmp_path / 'logo.pdf', 4)
+    processor = PDFProcessor(workers=1)
+    processor.lazy_images = True
+    page_image_metadata = processor._page_image_metadata
+
+    def broken_on_page_2(page, page_num, seen_streams):
+        if page_num == 2:
+            raise ValueError("malformed XObject")
+        return page_image_metadata(page, page_num, seen_streams)
+
+    monkeypatch.setattr(processor, '_page_image_metadata', broken_on_page_2)
+    pages = list(processor.parse_page_range(path, 1))
+
+    assert [page_num for page_num, _, _, _ in pages] == [1, 2, 3, 4]
+    assert all(text for _, _, text, _ in pages)
+    assert pages[1][3] == []
+    assert {image['page'] for _, _, _, images in pages for image in images} == {1, 3, 4}
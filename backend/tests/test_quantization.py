@@ -0,0 +1,74 @@
+"""Int8 scales fitted on earlier rows are refit once appended rows no longer fit them"""
+import numpy as np
+from quantization import Int8Quantizer
+from vector_index import VectorIndex
+
+DIM = 8
+
+
+def _chunks(n):
+    return [{'text': f"chunk {i}", 'page': 1} for i in range(n)]
+
+
+def _narrow_rows(n):
+    """Rows dominated by dimension 0, with small components elsewhere"""
+    rng = np.random.default_rng(0)
+    vectors = rng.uniform(-0.02, 0.02, size=(n, DIM)).astype(np.float32)
+    vectors[:, 0] = 1.0
+    return vectors
+
+
+def test_quantizer_counts_clipped_rows():
+    quantizer = Int8Quantizer.fit(_narrow_rows(10))
+    assert quantizer.clipped_fraction == 0.0
+
+    outlier = np.zeros((1, DIM), dtype=np.float32)
+    outlier[0, 1] = 1.0
+    codes = quantizer.encode(outlier)
+
+    assert codes[0, 1] == 127
+    assert quantizer.clipped_rows == 1
+    assert quantizer.clipped_fraction == 1.0
+
+
+def _index_with_outlier(refit_clipped_fraction):
+    index = VectorIndex(DIM, quantization='int8', rescore_candidates=1,
+                        refit_clipped_fraction=refit_clipped_fraction)
+    index.add_material(1, 1, 'narrow', list(range(1, 51)), _chunks(50), _narrow_rows(50))
+    outlier = np.zeros((1, DIM), dtype=np.float32)
+    outlier[0, 1] = 1.0
+    index.add_material(1, 2, 'outlier', [51], _chunks(1), outlier)
+    return index, outlier
+
+
+def test_out_of_range_append_is_tracked_without_refit():
+    index, _ = _index_with_outlier(refit_clipped_fraction=1.0)
+    stats = index.stats()
+    assert stats['quantization_clipped_fraction'] > 0
+    assert stats['quantizer_refits'] == 0
+
+
+def test_append_leaves_published_quantizer_untouched():
+    index = VectorIndex(DIM, quantization='int8', refit_clipped_fraction=1.0)
+    index.add_material(1, 1, 'narrow', list(range(1, 51)), _chunks(50), _narrow_rows(50))
+    published = index._subjects[1][0]
+    counters = (published.quantizer.encoded_rows, published.quantizer.clipped_rows)
+
+    outlier = np.zeros((1, DIM), dtype=np.float32)
+    outlier[0, 1] = 1.0
+    index.add_material(1, 2, 'outlier', [51], _chunks(1), outlier)
+
+    assert (published.quantizer.encoded_rows, published.quantizer.clipped_rows) == counters
+    assert index._subjects[1][0].quantizer.clipped_rows == published.quantizer.clipped_rows + 1
+
+
+def test_out_of_range_append_refits_scales():
+    index, outlier = _index_with_outlier(refit_clipped_fraction=0.01)
+    stats = index.stats()
+    assert stats['quantizer_refits'] == 1
+    assert stats['quantization_clipped_fraction'] == 0.0
+
+    # With a single re-scored candidate the first pass alone must rank the outlier first
+    result = index.search(outlier[0], subject_id=1, top_k=1)
+    assert result[0]['material_id'] == 2
+    assert result[0]['similarity'] > 0.99
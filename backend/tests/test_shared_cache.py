@@ -0,0 +1,38 @@
+"""The shared answer cache degrades instead of failing when its file is unusable"""
+import sqlite3
+import pytest
+from shared_cache import SharedAnswerCache
+
+
+@pytest.fixture
+def broken_cache(tmp_path):
+    cache = SharedAnswerCache(str(tmp_path / 'answers.sqlite3'))
+    cache.put(('q', 1, 5, 0), 1, {'answer': 'a'})
+    # Simulate a corrupt or locked file behind an open cache
+    conn = cache._connection()
+    conn.execute("DROP TABLE generations")
+    conn.execute("DROP TABLE answers")
+    return cache
+
+
+def test_unreadable_generation_is_none(broken_cache):
+    assert broken_cache.generation(1) is None
+
+
+def test_failed_bump_is_reported_not_raised(broken_cache):
+    assert broken_cache.bump(1) is False
+    assert not broken_cache._connection().in_transaction
+
+
+def test_stats_report_the_error(broken_cache):
+    stats = broken_cache.stats()
+    assert stats['entries'] is None
+    assert 'error' in stats
+
+
+def test_working_cache_bumps_generations(tmp_path):
+    cache = SharedAnswerCache(str(tmp_path / 'answers.sqlite3'))
+    assert cache.generation(1) == 0
+    assert cache.bump(1) is True
+    assert cache.generation(1) == 1
+    assert cache.generation(None) == 1
@@ -0,0 +1,76 @@
+"""A material is written in insert batches but added to the vector index once"""
+import numpy as np
+import pytest
+import gemini_rag
+from config import Config
+from fake_db import EmbeddingsDB
+from gemini_rag import GeminiRAGEngine
+from vector_index import VectorIndex
+from vector_store import MmapVectorStore
+
+DIM = 8
+CHUNKS = 1200
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = EmbeddingsDB()
+    db.add_material(1, 7)
+    monkeypatch.setattr(gemini_rag, 'get_db', lambda: db)
+    monkeypatch.setattr(Config, 'EMBEDDING_CACHE_ENABLED', False)
+    monkeypatch.setattr(Config, 'EMBEDDING_BATCH_SIZE', 64)
+    monkeypatch.setattr(Config, 'EMBEDDING_INSERT_BATCH_SIZE', 100)
+    return db
+
+
+def _engine(store=None):
+    engine = GeminiRAGEngine.__new__(GeminiRAGEngine)
+    engine.embedding_version = 1
+    engine.vector_index = VectorIndex(DIM, store=store)
+    # Chunk k embeds to a direction of its own, so search shows which row a chunk id belongs to
+    engine.generate_embeddings = lambda texts: np.stack([
+        np.random.default_rng(int(text.split()[-1])).normal(size=DIM).astype(np.float32) for text in texts
+    ])
+    return engine
+
+
+def _chunks():
+    return ({'text': f"chunk {k}", 'page': k // 10 + 1} for k in range(CHUNKS))
+
+
+@pytest.mark.parametrize('use_store', [False, True])
+def test_streamed_material_is_indexed_once(db, tmp_path, use_store):
+    store = MmapVectorStore(str(tmp_path / 'store'), DIM) if use_store else None
+    engine = _engine(store)
+    updates = []
+    engine.vector_index.listeners.append(lambda subject_id, segments: updates.append(subject_id))
+
+    result = engine.store_embeddings(7, _chunks())
+
+    assert result == {'chunks': CHUNKS, 'cached': 0}
+    assert len(db.rows) == CHUNKS
+    assert updates == [1]
+    assert engine.vector_index.stats()['subjects'] == {1: CHUNKS}
+    if use_store:
+        _, segments = store.open_segments(1)
+        assert len(segments) == 1
+
+    ids = {row['chunk_text']: row['id'] for row in db.rows}
+    for k in (0, 499, CHUNKS - 1):
+        query = engine.generate_embeddings([f"chunk {k}"])[0]
+        hit = engine.vector_index.search(query, subject_id=1, top_k=1)[0]
+        assert hit['chunk_id'] == ids[f"chunk {k}"]
+        assert hit['chunk_text'] == f"chunk {k}"
+
+
+def test_failed_ingest_leaves_nothing_behind(db):
+    engine = _engine()
+
+    def chunks():
+        yield from ({'text': f"chunk {k}", 'page': 1} for k in range(250))
+        raise RuntimeError("PDF parser crashed")
+
+    with pytest.raises(RuntimeError):
+        engine.store_embeddings(7, chunks())
+    assert db.rows == []
+    assert not engine.vector_index.has_material(7)
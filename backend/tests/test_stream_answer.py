@@ -0,0 +1,76 @@
+"""Streamed answers send their sources first, then tokens, and cache only complete answers"""
+import threading
+import pytest
+from config import Config
+from gemini_rag import GeminiRAGEngine
+from answer_cache import LRUCache
+from fake_llm import FakeChunk, FakeStreamingModel
+from semantic_cache import SemanticCache
+from shared_cache import InProcessGenerations
+from vector_index import VectorIndex
+
+DIM = 8
+CHUNK = {'chunk_id': 1, 'chunk_text': 'A stack is a LIFO list.', 'page_number': 3,
+         'material_id': 1, 'material_title': 'Data Structures', 'similarity': 0.8}
+
+
+class CountingModel(FakeStreamingModel):
+    def __init__(self):
+        super().__init__(token_delay=0.0)
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        return super().generate_content(prompt, stream)
+
+
+class BrokenStreamModel:
+    """Sends one token, then the connection drops"""
+
+    def generate_content(self, prompt, stream=False):
+        yield FakeChunk('A stack ')
+        raise ConnectionError("stream reset")
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(Config, 'SEMANTIC_CACHE_ENABLED', False)
+    engine = GeminiRAGEngine.__new__(GeminiRAGEngine)
+    engine.answer_cache = LRUCache()
+    engine.semantic_cache = SemanticCache(DIM)
+    engine.shared_cache = None
+    engine.generations = InProcessGenerations()
+    engine._seen_generations = {}
+    engine._generations_lock = threading.Lock()
+    engine.vector_index = VectorIndex(DIM)
+    engine.gemini_model = CountingModel()
+    engine.search_similar_chunks = lambda *args, **kwargs: [dict(CHUNK)]
+    return engine
+
+
+def test_sources_then_tokens_then_done(engine):
+    events = list(engine.stream_answer("What is a stack?", subject_id=1))
+    names = [event for event, _ in events]
+    assert names[0] == 'sources' and names[-1] == 'done'
+    assert names.count('token') > 1 and set(names[1:-1]) == {'token'}
+
+    sources = events[0][1]
+    assert sources['sources'] and sources['confidence'] == pytest.approx(0.8)
+    done = events[-1][1]
+    assert done['answer'] == ''.join(data for event, data in events if event == 'token')
+    assert done['sources'] == sources['sources']
+
+
+def test_cached_answer_is_sent_as_one_token(engine):
+    first = list(engine.stream_answer("What is a stack?", subject_id=1))
+    again = list(engine.stream_answer("What is a stack?", subject_id=1))
+    assert engine.gemini_model.calls == 1
+    assert [event for event, _ in again] == ['sources', 'token', 'done']
+    assert again[1][1] == first[-1][1]['answer']
+
+
+def test_interrupted_stream_ends_with_error_and_is_not_cached(engine):
+    engine.gemini_model = BrokenStreamModel()
+    events = list(engine.stream_answer("What is a stack?", subject_id=1))
+    assert [event for event, _ in events] == ['sources', 'token', 'error']
+    assert engine.answer_cache.stats()['entries'] == 0
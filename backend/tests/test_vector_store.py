@@ -0,0 +1,106 @@
+"""The memory-mapped store: segments, tombstones and compaction, shared by workers and in step with the database"""
+import numpy as np
+from fake_db import EmbeddingsDB
+from vector_index import VectorIndex
+from vector_store import MmapVectorStore
+
+DIM = 8
+
+
+def _vectors(n, seed):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def _index(tmp_path, db):
+    index = VectorIndex(DIM, store=MmapVectorStore(str(tmp_path / 'store'), DIM))
+    index.load(db)
+    return index
+
+
+def test_rows_written_behind_the_store_are_added_on_load(tmp_path):
+    db = EmbeddingsDB()
+    db.add(1, 1, _vectors(5, 0))
+    _index(tmp_path, db)  # seeds subject 1
+
+    # e.g. bulk_ingest.py or a reembed.py catch-up writing straight to the database
+    late = _vectors(3, 1)
+    late_ids = db.add(1, 2, late)
+    db.add(2, 3, _vectors(2, 2))
+
+    index = _index(tmp_path, db)
+    assert index.stats()['subjects'] == {1: 8, 2: 2}
+    hits = index.search(late[0], subject_id=1, top_k=1)
+    assert hits[0]['chunk_id'] == late_ids[0]
+
+    # Nothing is appended twice when the next worker loads
+    store = index.store
+    _index(tmp_path, db)
+    _, segments = store.open_segments(1)
+    assert sum(len(s['chunk_ids']) for s in segments) == 8
+
+
+def test_skip_existing_leaves_out_rows_already_stored(tmp_path):
+    store = MmapVectorStore(str(tmp_path / 'store'), DIM)
+    vectors = _vectors(4, 0)
+    store.append_segment(1, vectors[:2], np.array([1, 2]), np.array([1, 1]))
+    store.append_segment(1, vectors, np.array([1, 2, 3, 4]), np.array([1, 1, 2, 2]), skip_existing=True)
+
+    _, segments = store.open_segments(1)
+    assert [s['chunk_ids'].tolist() for s in segments] == [[1, 2], [3, 4]]
+
+
+def test_tombstoned_rows_are_dropped_by_compaction(tmp_path):
+    store = MmapVectorStore(str(tmp_path / 'store'), DIM, max_deleted_ratio=0.5)
+    store.append_segment(1, _vectors(6, 0), np.arange(1, 7), np.array([1, 1, 1, 1, 2, 2]))
+    old_manifest, old_segments = store.open_segments(1)
+
+    # A third of the rows deleted: only a tombstone is recorded
+    store.delete_material(1, 2)
+    manifest, segments = store.open_segments(1)
+    assert manifest['deleted_materials'] == [2]
+    assert segments[0]['chunk_ids'].tolist() == [1, 2, 3, 4, 5, 6]
+
+    store.compact(1)
+    manifest, segments = store.open_segments(1)
+    assert manifest['deleted_materials'] == [] and len(segments) == 1
+    assert segments[0]['chunk_ids'].tolist() == [1, 2, 3, 4]
+    # A reader still holding the old segment keeps working
+    assert old_segments[0]['chunk_ids'].tolist() == [1, 2, 3, 4, 5, 6]
+
+
+def test_segments_are_merged_past_max_segments(tmp_path):
+    store = MmapVectorStore(str(tmp_path / 'store'), DIM, max_segments=3)
+    vectors = _vectors(4, 0)
+    for k in range(4):
+        store.append_segment(1, vectors[k:k + 1], np.array([k + 1]), np.array([k + 1]))
+    _, segments = store.open_segments(1)
+    assert len(segments) == 1
+    assert np.allclose(segments[0]['vectors'], vectors)
+
+
+def test_reingested_material_replaces_its_tombstoned_rows(tmp_path):
+    store = MmapVectorStore(str(tmp_path / 'store'), DIM, max_deleted_ratio=1.0)
+    store.append_segment(1, _vectors(4, 0), np.array([1, 2, 3, 4]), np.array([1, 1, 2, 2]))
+    store.delete_material(1, 2)
+    store.append_segment(1, _vectors(2, 1), np.array([5, 6]), np.array([2, 2]))
+
+    manifest, segments = store.open_segments(1)
+    assert manifest['deleted_materials'] == []
+    assert sorted(cid for s in segments for cid in s['chunk_ids'].tolist()) == [1, 2, 5, 6]
+
+
+def test_workers_see_each_others_changes(tmp_path):
+    db = EmbeddingsDB()
+    db.add(1, 1, _vectors(3, 0))
+    first, second = _index(tmp_path, db), _index(tmp_path, db)
+
+    vectors = _vectors(2, 1)
+    ids = db.add(1, 2, vectors)
+    first.add_material(1, 2, 'm2', ids, [{'text': 'x'}] * 2, vectors)
+    hits = second.search(vectors[0], subject_id=1, top_k=1)
+    assert hits[0]['chunk_id'] == ids[0]
+    assert hits[0]['material_title'] == 'm2'
+
+    second.remove_material(2)
+    assert {hit['material_id'] for hit in first.search(vectors[0], subject_id=1, top_k=5)} == {1}
+    assert first.stats()['subjects'] == {1: 3}
@@ -0,0 +1,88 @@
+"""Worker processes with in-memory indexes pick up each other's uploads and deletes"""
+import threading
+import numpy as np
+import pytest
+import gemini_rag
+from fake_db import EmbeddingsDB
+from gemini_rag import GeminiRAGEngine
+from answer_cache import LRUCache
+from semantic_cache import SemanticCache
+from shared_cache import SharedAnswerCache
+from vector_index import VectorIndex
+
+DIM = 8
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = EmbeddingsDB()
+    db.add(1, 7, np.eye(DIM, dtype=np.float32)[:2])
+    monkeypatch.setattr(gemini_rag, 'get_db', lambda: db)
+    return db
+
+
+def _worker(db, cache_path):
+    """An engine as one gunicorn worker would hold it, sharing only the cache file"""
+    engine = GeminiRAGEngine.__new__(GeminiRAGEngine)
+    engine.vector_index = VectorIndex(DIM)
+    engine.answer_cache = LRUCache()
+    engine.semantic_cache = SemanticCache(DIM)
+    engine.shared_cache = SharedAnswerCache(cache_path)
+    engine.generations = engine.shared_cache
+    engine._seen_generations = {}
+    engine._generations_lock = threading.Lock()
+    engine._indexed_generations = {}
+    engine._reload_lock = threading.Lock()
+    engine.load_vector_index()
+    engine.reloads = []
+    reload_subjects = engine.vector_index.reload_subjects
+    engine.vector_index.reload_subjects = lambda *args: engine.reloads.append(args[1]) or reload_subjects(*args)
+    return engine
+
+
+def _material_ids(engine, subject_id):
+    return {hit['material_id'] for hit in engine.vector_index.search(np.ones(DIM), subject_id, top_k=10)}
+
+
+def test_other_worker_reloads_changed_subject(db, tmp_path):
+    cache_path = str(tmp_path / 'answers.sqlite3')
+    a, b = _worker(db, cache_path), _worker(db, cache_path)
+
+    # Worker a ingests a material into subject 1 and updates its own index
+    vectors = np.eye(DIM, dtype=np.float32)[2:5]
+    ids = db.add(1, 8, vectors)
+    a.vector_index.add_material(1, 8, 'm8', ids, [{'text': 't'}] * 3, vectors)
+    a.invalidate_subject(1)
+
+    assert _material_ids(b, 1) == {7}
+    b._cache_generation(1)
+    assert _material_ids(b, 1) == {7, 8}
+    assert b.reloads == [{1}]
+
+    # Its own change is already indexed, so worker a does not reload
+    a._cache_generation(1)
+    a._cache_generation(None)
+    assert a.reloads == []
+
+    # A delete through b reaches a, including on an unscoped lookup
+    db.delete_material(7)
+    b.vector_index.remove_material(7)
+    b.invalidate_subject(1)
+    a._cache_generation(None)
+    assert _material_ids(a, 1) == {8}
+    assert a.reloads == [{1}]
+
+
+def test_subject_changed_locally_during_reload_is_kept(db, tmp_path):
+    a = _worker(db, str(tmp_path / 'answers.sqlite3'))
+    read_database = a.vector_index._read_database
+
+    def read_then_add(*args, **kwargs):
+        result = read_database(*args, **kwargs)
+        # An upload to this worker lands after the reload's read
+        a.vector_index.add_material(1, 9, 'm9', [100], [{'text': 't'}], np.ones((1, DIM), dtype=np.float32))
+        return result
+
+    a.vector_index._read_database = read_then_add
+    assert a.vector_index.reload_subjects(db, {1}) == set()
+    assert _material_ids(a, 1) == {7, 9}
@@ -0,0 +1,725 @@
+"""
+In-memory vector index for TKR Chatbot
+Keeps pre-normalized embedding matrices per subject so searches need no DB round trip
+"""
+import os
+import threading
+import time
+import logging
+import numpy as np
+from embedding_codec import unpack_matrix
+from ann_index import IVFIndex, InvertedLists, index_path
+from quantization import get_quantizer_class
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(matrix):
+    """Return a float32 copy of matrix with every row scaled to unit length"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def version_index_dir(base_dir, embedding_version):
+    """Directory for the on-disk index state of one embedding version
+
+    Version 1 keeps the original layout; later versions (other models,
+    possibly other dimensions) get their own subdirectory.
+    """
+    if embedding_version == 1:
+        return base_dir
+    return os.path.join(base_dir, f"v{embedding_version}")
+
+
+def top_k_positions(scores, k):
+    """Return the positions of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k < len(scores):
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(len(scores))
+    return positions[np.argsort(-scores[positions])]
+
+
+class SubjectVectors:
+    """Immutable snapshot of the embeddings for a single subject"""
+
+    def __init__(self, vectors, chunk_ids, material_ids, metadata, ivf=None, assignments=None, live=None,
+                 quantizer=None, codes=None):
+        self.vectors = vectors
+        self.chunk_ids = chunk_ids
+        self.material_ids = material_ids
+        self.metadata = metadata
+        # Rows still searchable; None means all. Used for memory-mapped
+        # segments, which are tombstoned instead of copied on delete.
+        self.live = live
+        # Optional IVF quantizer plus the list each row belongs to
+        self.ivf = ivf
+        if ivf is not None and assignments is None:
+            assignments = ivf.assign(vectors)
+        self.assignments = assignments
+        self._lists = None
+        # Optional int8/binary codes for first-pass scoring; the float32
+        # vectors (memory-mapped in store mode) are only read to re-score
+        self.quantizer = quantizer
+        if quantizer is not None and codes is None:
+            codes = quantizer.encode(vectors)
+        self.codes = codes
+
+    def __len__(self):
+        if self.live is not None:
+            return int(self.live.sum())
+        return len(self.metadata)
+
+    @classmethod
+    def empty(cls, dim):
+        """Create an empty snapshot for the given embedding dimension"""
+        return cls(
+            np.empty((0, dim), dtype=np.float32),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            []
+        )
+
+    def with_ivf(self, ivf):
+        """Return a copy of this snapshot partitioned by an IVF quantizer"""
+        return SubjectVectors(
+            self.vectors, self.chunk_ids, self.material_ids, self.metadata, ivf, live=self.live,
+            quantizer=self.quantizer, codes=self.codes
+        )
+
+    def quantized(self, quantizer, codes=None):
+        """Return a copy of this snapshot with quantized codes for first-pass scoring"""
+        return SubjectVectors(
+            self.vectors, self.chunk_ids, self.material_ids, self.metadata,
+            self.ivf, self.assignments, self.live, quantizer, codes
+        )
+
+    def appended(self, vectors, chunk_ids, material_ids, metadata):
+        """Return a new snapshot with the given rows added"""
+        assignments = None
+        if self.ivf is not None:
+            assignments = np.concatenate([self.assignments, self.ivf.assign(vectors)])
+        live = None
+        if self.live is not None:
+            live = np.concatenate([self.live, np.ones(len(chunk_ids), dtype=bool)])
+        quantizer, codes = self.quantizer, None
+        if quantizer is not None:
+            # Encoding updates the clipped-row counters, which this snapshot may share with a published one
+            quantizer = quantizer.copy()
+            codes = np.vstack([self.codes, quantizer.encode(vectors)])
+        return SubjectVectors(
+            np.vstack([self.vectors, vectors]),
+            np.concatenate([self.chunk_ids, chunk_ids]),
+            np.concatenate([self.material_ids, material_ids]),
+            self.metadata + metadata,
+            self.ivf,
+            assignments,
+            live,
+            quantizer,
+            codes
+        )
+
+    def without_material(self, material_id):
+        """Return a new snapshot with every row of material_id removed"""
+        keep = self.material_ids != material_id
+        if keep.all():
+            return self
+        if isinstance(self.vectors, np.memmap):
+            live = keep if self.live is None else (self.live & keep)
+            return SubjectVectors(
+                self.vectors, self.chunk_ids, self.material_ids, self.metadata,
+                self.ivf, self.assignments, live, self.quantizer, self.codes
+            )
+        if self.live is not None:
+            keep &= self.live
+        keep_rows = np.flatnonzero(keep)
+        return SubjectVectors(
+            self.vectors[keep_rows],
+            self.chunk_ids[keep_rows],
+            self.material_ids[keep_rows],
+            [self.metadata[i] for i in keep_rows],
+            self.ivf,
+            self.assignments[keep_rows] if self.ivf is not None else None,
+            quantizer=self.quantizer,
+            codes=self.codes[keep_rows] if self.quantizer is not None else None
+        )
+
+    def top_k(self, query_vec, top_k, nprobe=None, rescore=200):
+        """Return (rows, scores) of the top_k rows by cosine similarity
+
+        When an IVF quantizer is attached and nprobe is set, only the rows
+        in the nprobe closest lists are scored. Falls back to the exact
+        scan when the probed lists hold fewer than top_k rows. Otherwise,
+        with quantized codes, the best `rescore` rows by approximate score
+        are re-scored with their float32 vectors.
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if self.ivf is not None and nprobe:
+            if self._lists is None:
+                self._lists = InvertedLists(self.assignments, self.ivf.nlist)
+            candidates = self._lists.rows(self.ivf.probe(query_vec, nprobe))
+            if self.live is not None:
+                candidates = candidates[self.live[candidates]]
+            if len(candidates) >= top_k:
+                scores = self.vectors[candidates] @ query_vec
+                positions = top_k_positions(scores, top_k)
+                return candidates[positions], scores[positions]
+
+        if self.codes is not None:
+            approx = self.quantizer.score(self.codes, query_vec)
+            if self.live is not None:
+                approx[~self.live] = -np.inf
+            candidates = np.sort(top_k_positions(approx, min(max(top_k, rescore), len(self))))
+            scores = np.asarray(self.vectors[candidates]) @ query_vec
+            positions = top_k_positions(scores, top_k)
+            return candidates[positions], scores[positions]
+
+        scores = self.vectors @ query_vec
+        if self.live is not None:
+            scores[~self.live] = -np.inf
+        rows = top_k_positions(scores, min(top_k, len(self)))
+        return rows, scores[rows]
+
+
+class VectorIndex:
+    """Resident per-subject index of normalized chunk embeddings
+
+    Each subject is held as a tuple of immutable SubjectVectors segments.
+    Writers build new segments under a lock and swap them in, so readers
+    never block and always see a consistent matrix.
+
+    Without a store every subject is a single in-memory segment. With an
+    MmapVectorStore the segments are memory-mapped .npy files shared by
+    every worker process; each worker notices changes made by the others
+    through the store generation counter and re-opens only what changed.
+    """
+
+    def __init__(self, dim, ann_dir=None, ann_nprobe=16, ann_min_vectors=20000, store=None,
+                 quantization=None, rescore_candidates=200, projection=None, embedding_version=1,
+                 refit_clipped_fraction=0.01):
+        # Only rows encoded with this embedding version are loaded
+        self.embedding_version = embedding_version
+        # Embeddings arrive with input_dim; the index holds them reduced to
+        # dim when a Projection is given (queries are projected the same way)
+        self.input_dim = dim
+        self.projection = projection
+        self.dim = projection.dim if projection is not None else dim
+        # IVF settings; ann_dir=None keeps every search exact
+        self.ann_dir = ann_dir
+        self.ann_nprobe = ann_nprobe
+        self.ann_min_vectors = ann_min_vectors
+        self.store = store
+        # First-pass scoring on 'int8' or 'binary' codes; None scores float32 directly
+        self.quantizer_class = get_quantizer_class(quantization)
+        self.rescore_candidates = rescore_candidates
+        # In-memory subjects are re-quantized once this share of rows no longer fits the scales
+        self.refit_clipped_fraction = refit_clipped_fraction
+        self.quantizer_refits = 0
+        self._segment_codes = {}
+        self._subjects = {}
+        self._material_subject = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        # Store mode only: chunk metadata by chunk id, manifest versions seen
+        self._db = None
+        self._metadata = {}
+        self._versions = {}
+        self._generation = None
+        # Called as listener(subject_id, segments) whenever a subject changes
+        self.listeners = []
+
+    def __len__(self):
+        return sum(len(seg) for segments in self._subjects.values() for seg in segments)
+
+    def prepare(self, vectors):
+        """Unit-length (and, with a projection, reduced) float32 rows as stored in the index"""
+        vectors = normalize_rows(vectors)
+        if self.projection is None:
+            return vectors
+        return normalize_rows(self.projection.apply(vectors))
+
+    def _notify(self, subject_ids):
+        """Tell listeners (e.g. the BM25 index) which subjects changed"""
+        for subject_id in subject_ids:
+            segments = self._subjects.get(subject_id, ())
+            for listener in self.listeners:
+                try:
+                    listener(subject_id, segments)
+                except Exception as e:
+                    logger.error(f"Vector index listener failed for subject {subject_id}: {e}")
+
+    def subject(self, subject_id):
+        """Return all live rows of a subject as one in-memory snapshot (or None)"""
+        segments = self._subjects.get(subject_id)
+        if not segments:
+            return None
+        if len(segments) == 1 and segments[0].live is None:
+            return segments[0]
+        merged = SubjectVectors.empty(self.dim)
+        for seg in segments:
+            rows = np.arange(len(seg.metadata)) if seg.live is None else np.flatnonzero(seg.live)
+            merged = merged.appended(
+                np.asarray(seg.vectors[rows]), seg.chunk_ids[rows], seg.material_ids[rows],
+                [seg.metadata[i] for i in rows]
+            )
+        return merged
+
+    def stats(self):
+        """Return per-subject chunk counts and resident memory"""
+        subjects = dict(self._subjects)
+        return {
+            'subjects': {sid: sum(len(seg) for seg in segs) for sid, segs in subjects.items()},
+            'total_chunks': sum(len(seg) for segs in subjects.values() for seg in segs),
+            'vector_bytes': int(sum(seg.vectors.nbytes for segs in subjects.values() for seg in segs)),
+            'code_bytes': int(sum(seg.codes.nbytes for segs in subjects.values() for seg in segs
+                                  if seg.codes is not None)),
+            'quantization': self.quantizer_class.kind if self.quantizer_class else None,
+            'quantization_clipped_fraction': max((seg.quantizer.clipped_fraction for segs in subjects.values()
+                                                  for seg in segs if seg.quantizer is not None), default=0.0),
+            'quantizer_refits': self.quantizer_refits,
+            'dim': self.dim,
+            'embedding_version': self.embedding_version,
+            'projection': self.projection.fingerprint if self.projection is not None else None,
+            'memory_mapped': self.store is not None,
+            'ann_subjects': [sid for sid, segs in subjects.items() if any(seg.ivf is not None for seg in segs)]
+        }
+
+    # ---------- loading ----------
+
+    def load(self, db, batch_size=5000):
+        """Build the index from every processed material in the database"""
+        start_time = time.time()
+        self._db = db
+        if self.store is not None:
+            self._load_from_store(db, batch_size)
+        else:
+            subjects, material_subject = self._read_database(db, batch_size)
+            subjects = {
+                sid: (self._attach_quantizer(self._attach_ivf(sid, snapshot, len(snapshot))),)
+                for sid, snapshot in subjects.items()
+            }
+            with self._lock:
+                previous = set(self._subjects)
+                self._subjects = subjects
+                self._material_subject = material_subject
+                self.loaded = True
+            self._notify(previous | set(subjects))
+
+        logger.info(
+            f"Vector index loaded: {len(self)} chunks across {len(self._subjects)} subjects "
+            f"in {time.time() - start_time:.2f}s"
+        )
+
+    def _read_database(self, db, batch_size, subject_ids=None, chunk_ids=None):
+        """Decode stored embeddings (optionally only some subjects or chunks) into one snapshot per subject"""
+        parts = {}
+        material_subject = {}
+        last_id = 0
+
+        subject_filter, subject_params = '', ()
+        if subject_ids is not None:
+            subject_params = tuple(int(sid) for sid in subject_ids)
+            subject_filter = f"AND m.subject_id IN ({', '.join(['%s'] * len(subject_params))})"
+
+        while True:
+            rows = db.execute_query(f"""
+                SELECT de.id, de.chunk_text, de.page_number,
+                       de.material_id, de.embedding_vector,
+                       m.title, m.subject_id
+                FROM document_embeddings de
+                JOIN materials m ON de.material_id = m.id
+                WHERE m.is_processed = TRUE AND de.embedding_version = %s {subject_filter} AND de.id > %s
+                ORDER BY de.id
+                LIMIT %s
+            """, (self.embedding_version, *subject_params, last_id, batch_size))
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            if chunk_ids is not None:
+                rows = [row for row in rows if row['id'] in chunk_ids]
+            if not rows:
+                continue
+
+            vectors, kept = unpack_matrix([row['embedding_vector'] for row in rows], self.input_dim)
+            if len(kept) < len(rows):
+                logger.warning(f"Skipped {len(rows) - len(kept)} invalid embeddings")
+
+            grouped = {}
+            for position, row_idx in enumerate(kept):
+                grouped.setdefault(rows[row_idx]['subject_id'], []).append(position)
+
+            for subject_id, positions in grouped.items():
+                items = [rows[kept[p]] for p in positions]
+                parts.setdefault(subject_id, []).append((
+                    self.prepare(vectors[positions]),
+                    np.array([row['id'] for row in items], dtype=np.int64),
+                    np.array([row['material_id'] for row in items], dtype=np.int64),
+                    [self._row_metadata(row) for row in items]
+                ))
+                for row in items:
+                    material_subject[row['material_id']] = subject_id
+
+        subjects = {
+            subject_id: SubjectVectors(
+                np.vstack([p[0] for p in subject_parts]),
+                np.concatenate([p[1] for p in subject_parts]),
+                np.concatenate([p[2] for p in subject_parts]),
+                [meta for p in subject_parts for meta in p[3]]
+            )
+            for subject_id, subject_parts in parts.items()
+        }
+        return subjects, material_subject
+
+    def reload_subjects(self, db, subject_ids, batch_size=5000):
+        """Re-read some subjects from the database (in-memory index only)
+
+        Each worker process holds its own in-memory index, so this is how
+        one picks up uploads and deletes another worker made. A subject
+        this process changed meanwhile is left alone, as the read may
+        predate that change. Returns the ids of the subjects replaced.
+        """
+        subject_ids = set(subject_ids)
+        if not subject_ids:
+            return set()
+        with self._lock:
+            before = {sid: self._subjects.get(sid) for sid in subject_ids}
+        subjects, material_subject = self._read_database(db, batch_size, subject_ids=subject_ids)
+
+        reloaded = set()
+        with self._lock:
+            for sid in subject_ids:
+                if self._subjects.get(sid) is not before[sid]:
+                    continue
+                snapshot = subjects.get(sid)
+                if snapshot is None:
+                    self._subjects.pop(sid, None)
+                else:
+                    self._subjects[sid] = (self._attach_quantizer(self._attach_ivf(sid, snapshot, len(snapshot))),)
+                reloaded.add(sid)
+            self._material_subject = {
+                mid: sid for mid, sid in self._material_subject.items() if sid not in reloaded
+            }
+            self._material_subject.update(
+                (mid, sid) for mid, sid in material_subject.items() if sid in reloaded
+            )
+        self._notify(reloaded)
+        if reloaded:
+            logger.info(f"Reloaded subjects {sorted(reloaded)} changed by another worker")
+        return reloaded
+
+    def _read_metadata(self, db, batch_size, chunk_ids=None):
+        """Fetch chunk metadata (no vectors) for the store-backed index"""
+        metadata = {}
+        subject_ids = set()
+        if chunk_ids is not None:
+            chunk_ids = list(chunk_ids)
+            for start in range(0, len(chunk_ids), batch_size):
+                batch = chunk_ids[start:start + batch_size]
+                rows = db.execute_query(f"""
+                    SELECT de.id, de.chunk_text, de.page_number, de.material_id,
+                           m.title, m.subject_id
+                    FROM document_embeddings de
+                    JOIN materials m ON de.material_id = m.id
+                    WHERE de.id IN ({', '.join(['%s'] * len(batch))})
+                """, tuple(int(cid) for cid in batch))
+                for row in rows:
+                    metadata[row['id']] = self._row_metadata(row)
+            return metadata, subject_ids
+
+        last_id = 0
+        while True:
+            rows = db.execute_query("""
+                SELECT de.id, de.chunk_text, de.page_number, de.material_id,
+                       m.title, m.subject_id
+                FROM document_embeddings de
+                JOIN materials m ON de.material_id = m.id
+                WHERE m.is_processed = TRUE AND de.embedding_version = %s AND de.id > %s
+                ORDER BY de.id
+                LIMIT %s
+            """, (self.embedding_version, last_id, batch_size))
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            for row in rows:
+                metadata[row['id']] = self._row_metadata(row)
+                subject_ids.add(row['subject_id'])
+        return metadata, subject_ids
+
+    def _stored_chunk_ids(self):
+        """Chunk ids held by live (not tombstoned) rows of every subject in the store"""
+        chunk_ids = set()
+        for sid in self.store.subjects():
+            manifest, arrays = self.store.open_segments(sid)
+            if manifest is None:
+                continue
+            for a in arrays:
+                live = ~np.isin(a['material_ids'], manifest['deleted_materials'])
+                chunk_ids.update(np.asarray(a['chunk_ids'])[live].tolist())
+        return chunk_ids
+
+    def _load_from_store(self, db, batch_size):
+        """Open the memory-mapped store, first adding any database rows it lacks
+
+        Rows can reach the database without passing through a running
+        backend (bulk_ingest.py, reembed.py catch-up), so every subject is
+        reconciled by chunk id, not only subjects the store has never seen.
+        """
+        metadata, _ = self._read_metadata(db, batch_size)
+
+        missing = set(metadata) - self._stored_chunk_ids()
+        if missing:
+            seeded, _ = self._read_database(db, batch_size, chunk_ids=missing)
+            logger.info(f"Adding {len(missing)} chunks missing from the vector store for subjects {sorted(seeded)}")
+            for sid, snapshot in seeded.items():
+                self.store.append_segment(sid, snapshot.vectors, snapshot.chunk_ids, snapshot.material_ids,
+                                          skip_existing=True)
+
+        with self._lock:
+            previous = set(self._subjects)
+            self._metadata = metadata
+            self._subjects = {}
+            self._versions = {}
+            self._material_subject = {}
+            changed = self._sync_store()
+            self.loaded = True
+        self._notify(previous | changed)
+
+    def _open_subject(self, subject_id):
+        """Map a subject's store segments into SubjectVectors snapshots"""
+        manifest, arrays = self.store.open_segments(subject_id)
+        if manifest is None:
+            return None, ()
+        deleted = manifest['deleted_materials']
+        total = sum(len(a['chunk_ids']) for a in arrays)
+
+        # Rows appended by other workers since our last sync
+        missing = {int(cid) for a in arrays for cid in a['chunk_ids'] if int(cid) not in self._metadata}
+        if missing and self._db is not None:
+            fetched, _ = self._read_metadata(self._db, 5000, missing)
+            self._metadata.update(fetched)
+
+        segments = []
+        for name, a in zip(manifest['segments'], arrays):
+            metadata = [self._metadata.get(int(cid)) for cid in a['chunk_ids']]
+            live = ~np.isin(a['material_ids'], deleted) & np.array([m is not None for m in metadata], dtype=bool)
+            snapshot = SubjectVectors(a['vectors'], np.asarray(a['chunk_ids']), np.asarray(a['material_ids']),
+                                      metadata, live=live)
+            snapshot = self._attach_ivf(subject_id, snapshot, total)
+            segments.append(self._attach_quantizer(snapshot, (subject_id, name)))
+
+        # Segment files never change, so their codes are reused until compaction removes them
+        current = {(subject_id, name) for name in manifest['segments']}
+        for key in [k for k in self._segment_codes if k[0] == subject_id and k not in current]:
+            del self._segment_codes[key]
+        return manifest, tuple(segments)
+
+    def _sync_store(self):
+        """Re-open every subject whose manifest changed (caller holds the lock)
+
+        Returns the ids of the subjects that were re-opened or dropped.
+        """
+        generation = self.store.generation()
+        store_subjects = set(self.store.subjects())
+        changed = set()
+
+        for sid in list(self._subjects):
+            if sid not in store_subjects:
+                del self._subjects[sid]
+                self._versions.pop(sid, None)
+                changed.add(sid)
+
+        for sid in store_subjects:
+            manifest = self.store.read_manifest(sid)
+            if manifest is None or self._versions.get(sid) == manifest['version']:
+                continue
+            manifest, segments = self._open_subject(sid)
+            if manifest is None:
+                continue
+            self._subjects[sid] = segments
+            self._versions[sid] = manifest['version']
+            changed.add(sid)
+            for seg in segments:
+                for mid in np.unique(seg.material_ids[seg.live]):
+                    self._material_subject[int(mid)] = sid
+
+        self._generation = generation
+        return changed
+
+    def refresh(self):
+        """Pick up changes other worker processes made to the shared store"""
+        if self.store is None or not self.loaded:
+            return
+        if self.store.generation() == self._generation:
+            return
+        with self._lock:
+            changed = self._sync_store()
+        self._notify(changed)
+
+    def _attach_ivf(self, subject_id, snapshot, subject_size):
+        """Partition a large subject with its offline-trained IVF centroids"""
+        if not self.ann_dir or subject_size < self.ann_min_vectors:
+            return snapshot
+        path = index_path(self.ann_dir, subject_id)
+        if not os.path.exists(path):
+            logger.warning(f"Subject {subject_id} has {subject_size} chunks but no IVF index, using exact search")
+            return snapshot
+        try:
+            ivf = IVFIndex.load(path)
+        except Exception as e:
+            logger.error(f"Failed to load IVF index for subject {subject_id}: {e}")
+            return snapshot
+        if ivf.centroids.shape[1] != self.dim:
+            logger.warning(f"IVF index for subject {subject_id} has wrong dimension, using exact search")
+            return snapshot
+        logger.info(f"Subject {subject_id}: IVF index with {ivf.nlist} lists")
+        return snapshot.with_ivf(ivf)
+
+    def _attach_quantizer(self, snapshot, segment_key=None):
+        """Add first-pass quantized codes to a snapshot, if quantization is enabled"""
+        if self.quantizer_class is None or snapshot.quantizer is not None or not len(snapshot.metadata):
+            return snapshot
+        cached = self._segment_codes.get(segment_key) if segment_key else None
+        if cached is None:
+            quantizer = self.quantizer_class.fit(snapshot.vectors)
+            cached = (quantizer, quantizer.encode(snapshot.vectors))
+            if segment_key:
+                self._segment_codes[segment_key] = cached
+        return snapshot.quantized(*cached)
+
+    @staticmethod
+    def _row_metadata(row):
+        """Build the result metadata kept alongside each vector"""
+        return {
+            'chunk_id': row['id'],
+            'chunk_text': row['chunk_text'],
+            'page_number': row['page_number'],
+            'material_id': row['material_id'],
+            'material_title': row['title']
+        }
+
+    # ---------- incremental updates ----------
+
+    def has_material(self, material_id):
+        """True if any live row of material_id is indexed"""
+        self.refresh()
+        return material_id in self._material_subject
+
+    def add_material(self, subject_id, material_id, title, chunk_ids, chunks, vectors, skip_existing=False):
+        """Add the freshly stored chunks of one material to the index
+
+        skip_existing (store mode) leaves out rows another worker process
+        already appended, for loads several workers may run at once.
+        """
+        if not len(chunk_ids):
+            return
+        metadata = [{
+            'chunk_id': int(chunk_id),
+            'chunk_text': chunk['text'],
+            'page_number': chunk.get('page', 0),
+            'material_id': material_id,
+            'material_title': title
+        } for chunk_id, chunk in zip(chunk_ids, chunks)]
+        vectors = self.prepare(vectors)
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        material_ids = np.full(len(chunk_ids), material_id, dtype=np.int64)
+
+        if self.store is not None:
+            self.store.append_segment(subject_id, vectors, chunk_ids, material_ids, skip_existing=skip_existing)
+            with self._lock:
+                self._metadata.update(zip(chunk_ids.tolist(), metadata))
+                changed = self._sync_store()
+        else:
+            with self._lock:
+                segments = self._subjects.get(subject_id) or (SubjectVectors.empty(self.dim),)
+                snapshot = segments[0].appended(vectors, chunk_ids, material_ids, metadata)
+                if snapshot.quantizer is not None and snapshot.quantizer.clipped_fraction > self.refit_clipped_fraction:
+                    # The scales were fitted on earlier rows; refit over the whole subject
+                    logger.info(f"Subject {subject_id}: {snapshot.quantizer.clipped_fraction:.1%} of rows "
+                                f"clipped by int8 scales, re-quantizing")
+                    snapshot = snapshot.quantized(None)
+                    self.quantizer_refits += 1
+                self._subjects[subject_id] = (self._attach_quantizer(snapshot),)
+                self._material_subject[material_id] = subject_id
+            changed = {subject_id}
+        self._notify(changed)
+
+        logger.info(f"Indexed {len(chunk_ids)} chunks for material {material_id} (subject {subject_id})")
+
+    def remove_material(self, material_id):
+        """Drop every vector belonging to a material"""
+        self.refresh()
+        with self._lock:
+            subject_id = self._material_subject.pop(material_id, None)
+            segments = self._subjects.get(subject_id)
+            if segments is None:
+                return
+            changed = {subject_id}
+            if self.store is None:
+                self._subjects[subject_id] = tuple(seg.without_material(material_id) for seg in segments)
+        if self.store is not None:
+            self.store.delete_material(subject_id, material_id)
+            with self._lock:
+                for seg in segments:
+                    for cid in seg.chunk_ids[seg.material_ids == material_id]:
+                        self._metadata.pop(int(cid), None)
+                changed = self._sync_store()
+        self._notify(changed)
+        logger.info(f"Removed material {material_id} from vector index")
+
+    def remove_subject(self, subject_id):
+        """Drop every vector belonging to a subject"""
+        if self.store is not None:
+            self.store.delete_subject(subject_id)
+        with self._lock:
+            self._subjects.pop(subject_id, None)
+            self._versions.pop(subject_id, None)
+            self._segment_codes = {k: v for k, v in self._segment_codes.items() if k[0] != subject_id}
+            self._material_subject = {
+                mid: sid for mid, sid in self._material_subject.items() if sid != subject_id
+            }
+        self._notify({subject_id})
+        logger.info(f"Removed subject {subject_id} from vector index")
+
+    # ---------- search ----------
+
+    def search(self, query_vec, subject_id=None, top_k=5, nprobe=None):
+        """Return the top_k chunks by cosine similarity
+
+        With no subject_id every subject is scanned and the per-segment
+        winners are merged, which is exact and avoids keeping a second
+        global copy of every vector. nprobe overrides the configured IVF
+        probe count (more lists = better recall, higher latency).
+        """
+        self.refresh()
+        query_vec = self.prepare(query_vec)[0]
+        if nprobe is None:
+            nprobe = self.ann_nprobe
+
+        if subject_id is not None:
+            snapshots = self._subjects.get(subject_id, ())
+        else:
+            snapshots = [seg for segments in list(self._subjects.values()) for seg in segments]
+
+        candidates = []
+        for snapshot in snapshots:
+            if not len(snapshot):
+                continue
+            rows, scores = snapshot.top_k(query_vec, top_k, nprobe, self.rescore_candidates)
+            for row, score in zip(rows, scores):
+                candidates.append((float(score), snapshot.metadata[row]))
+
+        candidates.sort(key=lambda item: item[0], reverse=True)
+
+        results = []
+        for score, metadata in candidates[:top_k]:
+            result = metadata.copy()
+            result['similarity'] = score
+            results.append(result)
+        return results
@@ -0,0 +1,269 @@
+"""
+On-disk vector store for TKR Chatbot
+Per-subject append-only .npy segments opened with np.memmap so worker processes share the OS page cache
+"""
+import os
+import json
+import shutil
+import threading
+import logging
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_ARRAYS = ('vectors', 'chunk_ids', 'material_ids')
+
+
+class MmapVectorStore:
+    """Append-only segment files per subject, shared read-only across processes
+
+    Layout under root_dir:
+        GENERATION                 bumped on every change, polled by readers
+        subject_<id>/manifest.json segments, tombstoned materials, version
+        subject_<id>/<segment>.<array>.npy
+
+    Deleting a material only records a tombstone; compact() rewrites the
+    subject as a single segment without the deleted rows.
+    """
+
+    def __init__(self, root_dir, dim, max_segments=8, max_deleted_ratio=0.25):
+        self.root_dir = root_dir
+        self.dim = dim
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self._thread_lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    # ---------- paths and locking ----------
+
+    def _subject_dir(self, subject_id):
+        return os.path.join(self.root_dir, f"subject_{subject_id}")
+
+    def _segment_path(self, subject_id, segment, array):
+        return os.path.join(self._subject_dir(subject_id), f"{segment}.{array}.npy")
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across threads and worker processes"""
+        with self._thread_lock, open(os.path.join(self.root_dir, '.lock'), 'a+') as handle:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    # ---------- generation and manifests ----------
+
+    def generation(self):
+        """Return the store-wide change counter"""
+        try:
+            with open(os.path.join(self.root_dir, 'GENERATION'), 'r') as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self):
+        path = os.path.join(self.root_dir, 'GENERATION')
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(self.generation() + 1))
+        os.replace(tmp_path, path)
+
+    def subjects(self):
+        """Return the ids of every subject with a manifest"""
+        subject_ids = []
+        for name in os.listdir(self.root_dir):
+            if name.startswith('subject_') and os.path.exists(
+                os.path.join(self.root_dir, name, 'manifest.json')
+            ):
+                subject_ids.append(int(name[len('subject_'):]))
+        return subject_ids
+
+    def has_subject(self, subject_id):
+        return self.read_manifest(subject_id) is not None
+
+    def read_manifest(self, subject_id):
+        """Return a subject's manifest, or None if it has never been written"""
+        try:
+            with open(os.path.join(self._subject_dir(subject_id), 'manifest.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, subject_id, manifest):
+        manifest['version'] = manifest.get('version', 0) + 1
+        self._write_json(os.path.join(self._subject_dir(subject_id), 'manifest.json'), manifest)
+        self._bump_generation()
+
+    @staticmethod
+    def _new_manifest():
+        return {'version': 0, 'next_segment': 0, 'segments': [], 'deleted_materials': []}
+
+    # ---------- reads ----------
+
+    def open_segments(self, subject_id):
+        """Memory-map every segment of a subject
+
+        Returns (manifest, segments) where each segment is a dict of
+        read-only arrays keyed by SEGMENT_ARRAYS.
+        """
+        manifest = self.read_manifest(subject_id)
+        if manifest is None:
+            return None, []
+        segments = []
+        for segment in manifest['segments']:
+            segments.append({
+                array: np.load(self._segment_path(subject_id, segment, array), mmap_mode='r')
+                for array in SEGMENT_ARRAYS
+            })
+        return manifest, segments
+
+    # ---------- writes ----------
+
+    def _save_segment(self, subject_id, manifest, arrays):
+        """Write one segment's arrays atomically and return its name"""
+        segment = f"seg_{manifest['next_segment']:06d}"
+        manifest['next_segment'] += 1
+        os.makedirs(self._subject_dir(subject_id), exist_ok=True)
+        for array in SEGMENT_ARRAYS:
+            path = self._segment_path(subject_id, segment, array)
+            np.save(f"{path}.tmp.npy", arrays[array])
+            os.replace(f"{path}.tmp.npy", path)
+        return segment
+
+    def append_segment(self, subject_id, vectors, chunk_ids, material_ids, skip_existing=False):
+        """Persist newly embedded rows as a new segment of a subject
+
+        With skip_existing, rows whose chunk id another process stored
+        meanwhile (e.g. two workers seeding at start-up) are left out.
+        """
+        if not len(chunk_ids):
+            return
+        with self._locked():
+            manifest = self.read_manifest(subject_id) or self._new_manifest()
+            if skip_existing:
+                _, segments = self.open_segments(subject_id)
+                stored = [s['chunk_ids'][~np.isin(s['material_ids'], manifest['deleted_materials'])]
+                          for s in segments]
+                if stored:
+                    new = ~np.isin(chunk_ids, np.concatenate(stored))
+                    vectors, chunk_ids, material_ids = vectors[new], chunk_ids[new], material_ids[new]
+                if not len(chunk_ids):
+                    return
+            if manifest['deleted_materials'] and np.isin(material_ids, manifest['deleted_materials']).any():
+                # A material re-ingested after a failed attempt: drop its old rows
+                # now, as its tombstone would otherwise hide the new ones too
+                self._compact(subject_id, manifest)
+            segment = self._save_segment(subject_id, manifest, {
+                'vectors': np.ascontiguousarray(vectors, dtype=np.float32),
+                'chunk_ids': np.asarray(chunk_ids, dtype=np.int64),
+                'material_ids': np.asarray(material_ids, dtype=np.int64),
+            })
+            manifest['segments'].append(segment)
+            self._write_manifest(subject_id, manifest)
+            if self._needs_compaction(subject_id, manifest):
+                self._compact(subject_id, manifest)
+        logger.info(f"Appended {len(chunk_ids)} vectors to subject {subject_id} store")
+
+    def delete_material(self, subject_id, material_id):
+        """Tombstone a material; its rows are dropped at the next compaction"""
+        with self._locked():
+            manifest = self.read_manifest(subject_id)
+            if manifest is None or material_id in manifest['deleted_materials']:
+                return
+            manifest['deleted_materials'].append(material_id)
+            self._write_manifest(subject_id, manifest)
+            if self._needs_compaction(subject_id, manifest):
+                self._compact(subject_id, manifest)
+
+    def delete_subject(self, subject_id):
+        """Remove every segment of a subject"""
+        with self._locked():
+            if os.path.exists(self._subject_dir(subject_id)):
+                shutil.rmtree(self._subject_dir(subject_id), ignore_errors=True)
+                self._bump_generation()
+
+    def _needs_compaction(self, subject_id, manifest):
+        if len(manifest['segments']) > self.max_segments:
+            return True
+        if not manifest['deleted_materials']:
+            return False
+        _, segments = self.open_segments(subject_id)
+        total = sum(len(s['material_ids']) for s in segments)
+        deleted = sum(
+            int(np.isin(s['material_ids'], manifest['deleted_materials']).sum()) for s in segments
+        )
+        return total == 0 or deleted / total > self.max_deleted_ratio
+
+    def compact(self, subject_id):
+        """Merge a subject's segments into one and drop tombstoned rows"""
+        with self._locked():
+            manifest = self.read_manifest(subject_id)
+            if manifest is not None:
+                self._compact(subject_id, manifest)
+
+    def _compact(self, subject_id, manifest):
+        _, segments = self.open_segments(subject_id)
+        deleted = manifest['deleted_materials']
+        keeps = [~np.isin(s['material_ids'], deleted) for s in segments]
+        total = int(sum(keep.sum() for keep in keeps))
+        old_segments = list(manifest['segments'])
+
+        if total:
+            # Stream rows into the merged segment instead of stacking in RAM
+            segment = f"seg_{manifest['next_segment']:06d}"
+            manifest['next_segment'] += 1
+            paths = {array: self._segment_path(subject_id, segment, array) for array in SEGMENT_ARRAYS}
+            merged = {
+                'vectors': np.lib.format.open_memmap(
+                    f"{paths['vectors']}.tmp.npy", mode='w+', dtype=np.float32, shape=(total, self.dim)
+                ),
+                'chunk_ids': np.empty(total, dtype=np.int64),
+                'material_ids': np.empty(total, dtype=np.int64),
+            }
+            offset = 0
+            for seg, keep in zip(segments, keeps):
+                rows = np.flatnonzero(keep)
+                for array in SEGMENT_ARRAYS:
+                    merged[array][offset:offset + len(rows)] = seg[array][rows]
+                offset += len(rows)
+            merged['vectors'].flush()
+            del merged['vectors']
+            os.replace(f"{paths['vectors']}.tmp.npy", paths['vectors'])
+            for array in ('chunk_ids', 'material_ids'):
+                np.save(f"{paths[array]}.tmp.npy", merged[array])
+                os.replace(f"{paths[array]}.tmp.npy", paths[array])
+            manifest['segments'] = [segment]
+        else:
+            manifest['segments'] = []
+
+        manifest['deleted_materials'] = []
+        self._write_manifest(subject_id, manifest)
+
+        # Readers holding old memmaps keep working on POSIX after unlink
+        for segment in old_segments:
+            for array in SEGMENT_ARRAYS:
+                try:
+                    os.remove(self._segment_path(subject_id, segment, array))
+                except OSError as e:
+                    logger.warning(f"Could not remove old segment file: {e}")
+
+        logger.info(
+            f"Compacted subject {subject_id}: {len(old_segments)} segments -> "
+            f"{len(manifest['segments'])}, {total} live vectors"
+        )
@@ -27,9 +27,11 @@ CREATE TABLE IF NOT EXISTS materials (
     file_size BIGINT,
     upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_processed BOOLEAN DEFAULT FALSE,
+    content_hash CHAR(64),  -- SHA-256 of the uploaded file, for duplicate detection
     FOREIGN KEY (subject_id) REFERENCES subjects(id) ON DELETE CASCADE,
     INDEX idx_subject (subject_id),
-    INDEX idx_processed (is_processed)
+    INDEX idx_processed (is_processed),
+    INDEX idx_content_hash (content_hash)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Syllabus table
@@ -81,11 +83,40 @@ CREATE TABLE IF NOT EXISTS document_embeddings (
     chunk_text TEXT NOT NULL,
     chunk_index INT NOT NULL,
     page_number INT,
-    embedding_vector JSON NOT NULL,
+    embedding_vector BLOB NOT NULL,  -- packed float32/float16, see embedding_codec.py
+    text_hash CHAR(64),  -- SHA-256 of the normalized chunk text, the embedding cache key
+    embedding_version INT NOT NULL DEFAULT 1,  -- embedding_versions.id the vector was encoded with
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
     INDEX idx_material (material_id),
-    INDEX idx_page (page_number)
+    INDEX idx_page (page_number),
+    INDEX idx_text_hash (text_hash),
+    INDEX idx_version_material (embedding_version, material_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Embedding model versions; exactly one is active and served (see reembed.py)
+CREATE TABLE IF NOT EXISTS embedding_versions (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    model_name VARCHAR(200) NOT NULL,
+    dimension INT,
+    status ENUM('building', 'active', 'retired', 'failed') DEFAULT 'building',
+    chunks_done INT DEFAULT 0,
+    chunks_total INT DEFAULT 0,
+    error TEXT,
+    -- bumped by reembed.py whenever it adds rows after activation, so backends index them
+    catch_up_generation INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    activated_at TIMESTAMP NULL,
+    INDEX idx_status (status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Parsed page text, so materials can be re-chunked and re-embedded without re-parsing the PDF
+CREATE TABLE IF NOT EXISTS material_pages (
+    material_id INT NOT NULL,
+    page_number INT NOT NULL,
+    page_text MEDIUMTEXT NOT NULL,
+    PRIMARY KEY (material_id, page_number),
+    FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Extracted images table
@@ -96,11 +127,37 @@ CREATE TABLE IF NOT EXISTS extracted_images (
     page_number INT,
     image_type VARCHAR(50),
     caption TEXT,
+    -- 'file': rendered at ingest into image_path; 'crop'/'embedded': rendered on first request
+    source ENUM('file', 'crop', 'embedded') DEFAULT 'file',
+    bbox VARCHAR(100),
+    xref INT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
     INDEX idx_material (material_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Background ingestion jobs (claimed by the workers in ingest_queue.py)
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    material_id INT NOT NULL,
+    status ENUM('queued', 'running', 'done', 'failed') DEFAULT 'queued',
+    stage VARCHAR(50) DEFAULT 'queued',
+    progress FLOAT DEFAULT 0,
+    attempts INT DEFAULT 0,
+    error TEXT,
+    claimed_by VARCHAR(100),
+    reused_from INT NULL,  -- processed material with identical content that was copied
+    chunks_total INT DEFAULT 0,
+    chunks_reused INT DEFAULT 0,
+    heartbeat_at TIMESTAMP NULL,  -- set by the running worker's timer; stale jobs are re-queued
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL,
+    FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
+    INDEX idx_status (status, id),
+    INDEX idx_material (material_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Insert sample subjects
 INSERT INTO subjects (subject_code, subject_name, semester, department) VALUES
 ('CS101', 'Programming in C', 1, 'Computer Science'),
@@ -223,7 +223,7 @@ async function handleChatSubmit(e) {
     showTypingIndicator();
 
     try {
-        const response = await fetch(`${API_BASE_URL}/chat`, {
+        const response = await fetch(`${API_BASE_URL}/chat/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -235,15 +235,11 @@ async function handleChatSubmit(e) {
             })
         });
 
-        const data = await response.json();
-
-        hideTypingIndicator();
-
-        if (data.success) {
-            addMessageToChat('bot', data.answer, data.sources, data.confidence);
-        } else {
-            addMessageToChat('bot', 'Sorry, I encountered an error. Please try again.');
+        if (!response.ok || !response.body) {
+            throw new Error(`Chat stream failed with status ${response.status}`);
         }
+
+        await readChatStream(response);
     } catch (error) {
         hideTypingIndicator();
         console.error('Chat error:', error);
@@ -251,6 +247,101 @@ async function handleChatSubmit(e) {
     }
 }
 
+// Read the server-sent events of a streamed answer, rendering tokens as they arrive
+async function readChatStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const messagesContainer = document.getElementById('chat-messages');
+    let buffer = '';
+    let answer = '';
+    let message = null;
+    let renderPending = false;
+
+    const ensureMessage = (sources = null) => {
+        if (!message) {
+            hideTypingIndicator();
+            message = addMessageToChat('bot', '', sources);
+        }
+    };
+
+    // Re-render at most once per animation frame, however fast tokens arrive
+    const scheduleRender = () => {
+        if (renderPending) return;
+        renderPending = true;
+        requestAnimationFrame(() => {
+            renderPending = false;
+            renderMarkdown(message.text, answer);
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        });
+    };
+
+    const handleEvent = (event, data) => {
+        if (event === 'sources') {
+            ensureMessage(data.sources);
+        } else if (event === 'token') {
+            ensureMessage();
+            answer += data;
+            scheduleRender();
+        } else if (event === 'done') {
+            ensureMessage(data.sources);
+            answer = data.answer;
+            renderMarkdown(message.text, answer);
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        } else if (event === 'error') {
+            ensureMessage();
+            answer += (answer ? '\n\n' : '') + data.error;
+            renderMarkdown(message.text, answer);
+        }
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            const dataLines = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trimStart());
+                }
+            });
+            if (dataLines.length > 0) {
+                handleEvent(event, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+
+    hideTypingIndicator();
+    if (!message) {
+        addMessageToChat('bot', 'Sorry, I encountered an error. Please try again.');
+    }
+}
+
+function renderMarkdown(element, text) {
+    // Configure marked for safe rendering
+    if (typeof marked !== 'undefined') {
+        marked.setOptions({
+            breaks: true,        // Convert \n to <br>
+            gfm: true,          // GitHub Flavored Markdown
+            headerIds: false,   // Don't add IDs to headers
+            mangle: false       // Don't escape email addresses
+        });
+        element.innerHTML = marked.parse(text);
+    } else {
+        // Fallback if marked is not loaded
+        element.textContent = text;
+    }
+}
+
 function addMessageToChat(sender, text, sources = null, confidence = null) {
     const messagesContainer = document.getElementById('chat-messages');
 
@@ -275,19 +366,7 @@ function addMessageToChat(sender, text, sources = null, confidence = null) {
 
     // Render markdown for bot messages, plain text for user messages
     if (sender === 'bot') {
-        // Configure marked for safe rendering
-        if (typeof marked !== 'undefined') {
-            marked.setOptions({
-                breaks: true,        // Convert \n to <br>
-                gfm: true,          // GitHub Flavored Markdown
-                headerIds: false,   // Don't add IDs to headers
-                mangle: false       // Don't escape email addresses
-            });
-            messageText.innerHTML = marked.parse(text);
-        } else {
-            // Fallback if marked is not loaded
-            messageText.textContent = text;
-        }
+        renderMarkdown(messageText, text);
     } else {
         messageText.textContent = text;  // Keep user messages as plain text
     }
@@ -318,6 +397,8 @@ function addMessageToChat(sender, text, sources = null, confidence = null) {
 
     messagesContainer.appendChild(messageDiv);
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
+
+    return { text: messageText, content: content };
 }
 
 function showTypingIndicator() {
@@ -582,6 +663,34 @@ function handleFileSelect() {
     }
 }
 
+const INGEST_STAGE_LABELS = {
+    queued: 'Queued for processing',
+    starting: 'Starting',
+    processing: 'Reading and embedding pages',
+    finalizing: 'Finalizing',
+    done: 'Done'
+};
+
+function formatIngestStage(stage) {
+    return INGEST_STAGE_LABELS[stage] || stage;
+}
+
+async function pollMaterialStatus(materialId, onUpdate, intervalMs = 1000) {
+    // Resolves with the final status once the ingest job is done or failed
+    while (true) {
+        const response = await fetch(`${API_BASE_URL}/materials/${materialId}/status`);
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error || 'Could not fetch processing status');
+        }
+        onUpdate(data);
+        if (data.status === 'done' || data.status === 'failed') {
+            return data;
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 async function handleUploadSubmit(e) {
     e.preventDefault();
 
@@ -630,29 +739,34 @@ async function handleUploadSubmit(e) {
 
         const data = await response.json();
 
-        if (data.success) {
-            progressFill.style.width = '100%';
-            progressText.textContent = 'Processing PDF...';
-
-            setTimeout(() => {
-                showToast('Material uploaded successfully!', 'success');
-                uploadProgress.style.display = 'none';
-                uploadButton.disabled = false;
+        if (!data.success) {
+            throw new Error(data.error || 'Upload failed');
+        }
 
-                // Reset form
-                e.target.reset();
-                document.getElementById('file-info').style.display = 'none';
+        // Processing continues in the background; follow the job until it finishes
+        progressFill.style.width = '0%';
+        progressText.textContent = data.duplicate_of
+            ? `Same file as material #${data.duplicate_of}, reusing its ${data.skipped.chunks} chunks...`
+            : 'Queued for processing...';
+        e.target.reset();
+        document.getElementById('file-info').style.display = 'none';
+
+        const status = await pollMaterialStatus(data.material_id, (update) => {
+            progressFill.style.width = Math.round(update.progress * 100) + '%';
+            progressText.textContent = `${formatIngestStage(update.stage)} (${Math.round(update.progress * 100)}%)`;
+        });
 
-                // Reload materials
-                loadMaterials();
+        uploadProgress.style.display = 'none';
+        uploadButton.disabled = false;
+        loadMaterials();
 
-                // Show info about processing
-                if (data.chunks_created) {
-                    showToast(`Processed ${data.chunks_created} text chunks and ${data.images_extracted} images`, 'success');
-                }
-            }, 1000);
+        if (status.status === 'done' && status.reused_from) {
+            showToast(`Identical file already processed: reused ${status.chunks_reused} chunks from material #${status.reused_from}`, 'success');
+        } else if (status.status === 'done') {
+            const cached = status.chunks_reused ? ` (${status.chunks_reused} of ${status.chunks_total} embeddings reused)` : '';
+            showToast('Material uploaded and processed successfully!' + cached, 'success');
         } else {
-            throw new Error(data.error || 'Upload failed');
+            showToast('File uploaded but processing failed: ' + (status.error || 'unknown error'), 'error');
         }
     } catch (error) {
         console.error('Upload error:', error);